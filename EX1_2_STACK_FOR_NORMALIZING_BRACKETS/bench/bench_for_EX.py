@@ -0,0 +1,305 @@
+"""Бенчмарки для Stack и проверки скобок.
+
+Запуск (из папки EX1_2_STACK_FOR_NORMALIZING_BRACKETS):
+
+    python bench/bench_for_EX.py                          # размеры по умолчанию
+    python bench/bench_for_EX.py --sizes 1K,1M,100M,1G -o results.json
+    python bench/bench_for_EX.py --compare old.json -o new.json
+
+Каждый замер выполняется в отдельном процессе, поэтому пиковый RSS
+(resource.getrusage) относится именно к этому замеру. Пик выделений
+памяти Python считается вторым прогоном под tracemalloc (он заметно
+медленнее, поэтому время берётся из первого прогона).
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import EX1_2_STACK_FOR_NORMALIZING_BRACKETS as brackets  # noqa: E402
+
+
+DEFAULT_SIZES = "1K,64K,1M,16M"
+PIECE = 1 << 16  # генераторы пишут вход кусками по 64 КБ
+STACK_MAX_OPS = 1 << 24  # потолок push/pop для Stack и CompactStack: стек целиком в памяти
+
+
+# ===== Генераторы входных данных (каждый выдаёт куски общей длиной ровно n) =====
+
+def _repeat(unit: str, n: int):
+    """Повторять unit, пока не наберётся n символов."""
+    block = unit * max(1, PIECE // len(unit))
+    while n > 0:
+        piece = block[:n]
+        n -= len(piece)
+        yield piece
+
+
+def gen_deep(n: int):
+    """Глубокая вложенность: "((((...))))"."""
+    half = n // 2
+    yield from _repeat("(", half)
+    yield from _repeat(")", half)
+    if n % 2:
+        yield " "
+
+
+def gen_wide(n: int):
+    """Широкая плоская последовательность: "()[]{}()[]{}..."."""
+    yield from _repeat("()[]{}", n)
+
+
+def gen_noise(n: int):
+    """Случайный текст с редкими сбалансированными группами скобок.
+
+    Блок 64 КБ генерируется один раз (с фиксированным seed) и повторяется,
+    иначе подготовка входа на 1 ГБ заняла бы больше времени, чем сам замер.
+    """
+    rnd = random.Random(42)
+    parts = []
+    length = 0
+    while length < PIECE:
+        word = "".join(rnd.choice("abcdefgh 0123,:\n") for _ in range(rnd.randint(5, 40)))
+        group = rnd.choice(["()", "[x]", "{a: (1)}", "f(a[0], {b})", ""])
+        parts.append(word + group)
+        length += len(word) + len(group)
+    yield from _repeat("".join(parts), n)
+
+
+def gen_early_fail(n: int):
+    """Ошибка в самом начале: лишняя закрывающая скобка."""
+    yield "]"
+    yield from _repeat("()[]{}", n - 1)
+
+
+def gen_late_fail(n: int):
+    """Ошибка в самом конце: незакрытая скобка."""
+    yield from _repeat("()[]{}", n - 1)
+    yield "("
+
+
+GENERATORS = {
+    "deep": gen_deep,
+    "wide": gen_wide,
+    "noise": gen_noise,
+    "early_fail": gen_early_fail,
+    "late_fail": gen_late_fail,
+}
+
+
+# ===== Что измеряем =====
+# Stack и CompactStack входной файл не читают (path=None): их замер — n push, затем n pop,
+# он не зависит от генератора и выполняется один раз на размер (генератор "push_pop").
+
+def _read_text(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def bench_stack(path: str, n: int):
+    """n операций push, затем n операций peek+pop на Stack."""
+    st = brackets.Stack()
+    for _ in range(n):
+        st.push("(")
+    for _ in range(n):
+        st.peek()
+        st.pop()
+    return st.is_empty()
+
+
+def bench_compact_stack(path: str, n: int):
+    """То же, что bench_stack, но на CompactStack."""
+    st = brackets.CompactStack()
+    for _ in range(n):
+        st.push("(")
+    for _ in range(n):
+        st.peek()
+        st.pop()
+    return st.is_empty()
+
+
+def bench_is_brackets_balanced(path: str, n: int):
+    return brackets.is_brackets_balanced(_read_text(path))
+
+
+def bench_verdict_text(path: str, n: int):
+    return brackets.verdict_text(_read_text(path))
+
+
+def bench_stream(path: str, n: int):
+    with open(path, "rb") as f:
+        return brackets.is_brackets_balanced_stream(f)
+
+
+def bench_file_engine(path: str, n: int):
+    return brackets.is_file_brackets_balanced(path)
+
+
+TARGETS = {
+    "Stack": bench_stack,
+    "CompactStack": bench_compact_stack,
+    "is_brackets_balanced": bench_is_brackets_balanced,
+    "verdict_text": bench_verdict_text,
+    "stream": bench_stream,
+    "file_engine": bench_file_engine,
+}
+STACK_TARGETS = ("Stack", "CompactStack")  # замеры без входного файла
+
+
+# ===== Запуск одного замера (в отдельном процессе) =====
+
+def _run_case(target: str, path: str, n: int, allocations: bool) -> dict:
+    fn = TARGETS[target]
+    start = time.perf_counter()
+    result = fn(path, n)
+    seconds = time.perf_counter() - start
+    # ru_maxrss на Linux — в килобайтах, на macOS — в байтах
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss //= 1024
+
+    alloc_peak = None
+    if allocations:
+        tracemalloc.start()
+        fn(path, n)
+        alloc_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        "seconds": round(seconds, 6),
+        "throughput_mb_s": round(n / seconds / 1e6, 3) if seconds else None,
+        "peak_rss_kb": peak_rss,
+        "alloc_peak_bytes": alloc_peak,
+        "result": result if isinstance(result, (bool, str)) else repr(result),
+    }
+
+
+def parse_size(text: str) -> int:
+    """'64K' → 65536, '1G' → 1073741824."""
+    text = text.strip().upper()
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def write_input(generator: str, n: int, directory: str) -> str:
+    """Сгенерировать вход во временный файл (без построения всей строки в памяти)."""
+    path = os.path.join(directory, f"{generator}_{n}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        for piece in GENERATORS[generator](n):
+            f.write(piece)
+    return path
+
+
+def run(sizes, generators, targets, allocations: bool, repeat: int):
+    results = []
+    stack_targets = [t for t in targets if t in STACK_TARGETS]
+    input_targets = [t for t in targets if t not in STACK_TARGETS]
+
+    def measure(gen, path, n, target):
+        best = None
+        for _ in range(repeat):
+            case = pool.submit(_run_case, target, path, n, allocations).result()
+            if best is None or case["seconds"] < best["seconds"]:
+                best = case
+        row = {"generator": gen, "size": n, "target": target, **best}
+        results.append(row)
+        print(f"{gen:>10} {n:>12} {target:>22} "
+              f"{best['seconds']:>10.4f} s {best['throughput_mb_s'] or 0:>9.2f} MB/s "
+              f"rss={best['peak_rss_kb']} KB", flush=True)
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+        stack_sizes = sorted({min(n, STACK_MAX_OPS) for n in sizes})
+        for n in stack_sizes:
+            for target in stack_targets:
+                measure("push_pop", None, n, target)
+        for n in sizes:
+            if not input_targets:
+                break
+            for gen in generators:
+                path = write_input(gen, n, tmp)
+                for target in input_targets:
+                    measure(gen, path, n, target)
+                os.remove(path)
+    return results
+
+
+def compare(old_results, new_results, threshold: float):
+    """Напечатать замеры, которые стали медленнее более чем в threshold раз."""
+    old = {(r["generator"], r["size"], r["target"]): r for r in old_results}
+    regressions = 0
+    for r in new_results:
+        prev = old.get((r["generator"], r["size"], r["target"]))
+        if not prev or not prev["seconds"]:
+            continue
+        ratio = r["seconds"] / prev["seconds"]
+        if ratio > threshold:
+            regressions += 1
+            print(f"РЕГРЕССИЯ {r['generator']} {r['size']} {r['target']}: "
+                  f"{prev['seconds']:.4f} s → {r['seconds']:.4f} s (x{ratio:.2f})")
+    print(f"Регрессий: {regressions}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки Stack и проверки скобок")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"размеры входа через запятую (по умолчанию {DEFAULT_SIZES})")
+    parser.add_argument("--generators", default=",".join(GENERATORS),
+                        help="генераторы входа через запятую")
+    parser.add_argument("--targets", default=",".join(TARGETS),
+                        help="что измерять, через запятую")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов, берётся лучший")
+    parser.add_argument("--no-alloc", action="store_true",
+                        help="не считать пик выделений через tracemalloc")
+    parser.add_argument("-o", "--output", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="во сколько раз медленнее считать регрессией")
+    args = parser.parse_args(argv)
+
+    results = run(
+        sizes=[parse_size(s) for s in args.sizes.split(",")],
+        generators=args.generators.split(","),
+        targets=args.targets.split(","),
+        allocations=not args.no_alloc,
+        repeat=args.repeat,
+    )
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        if compare(old["results"], results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,22 @@
 import unittest
+import io
 import os, sys
+import random
+import tempfile
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 # Импортируем функции и класс, которые будем тестировать.
 # !!!ПЕРЕД ЗАПУСКОМ ТЕСТА!!! имя импорта из файла 'EX1' замените на файла без расширения .py,
 # где реализованы Stack, is_brackets_balanced и verdict_text. Иначе тест упадёт.
 from EX1_2_STACK_FOR_NORMALIZING_BRACKETS import Stack, is_brackets_balanced, verdict_text
+from EX1_2_STACK_FOR_NORMALIZING_BRACKETS import is_brackets_balanced_stream, verdict_text_stream
+from EX1_2_STACK_FOR_NORMALIZING_BRACKETS import is_file_brackets_balanced, verdict_text_file
+from EX1_2_STACK_FOR_NORMALIZING_BRACKETS import CompactStack
+from EX1_2_STACK_FOR_NORMALIZING_BRACKETS import validate_many
+from EX1_2_STACK_FOR_NORMALIZING_BRACKETS import is_brackets_balanced_parallel
+from EX1_2_STACK_FOR_NORMALIZING_BRACKETS import diagnose_brackets, verdict_details
+from EX1_2_STACK_FOR_NORMALIZING_BRACKETS import BracketGrammar, compile_grammar
+from EX1_2_STACK_FOR_NORMALIZING_BRACKETS import IncrementalBracketChecker
 
 
 
@@ -134,6 +145,291 @@ class TestExtraCases(unittest.TestCase):
         self.assertEqual(verdict_text("()[]{}"), "Сбалансированно")
         self.assertEqual(verdict_text("([)]"), "Несбалансированно")
 
+
+# === ТЕСТЫ ДЛЯ КОМПАКТНОГО СТЕКА ===
+class TestCompactStack(unittest.TestCase):
+    def test_lifo_with_int_typecode(self):
+        # Та же семантика LIFO, что и у Stack, но на массиве целых
+        st = CompactStack("i")
+        self.assertTrue(st.is_empty())
+        for x in (1, 2, 3):
+            st.push(x)
+        self.assertEqual(st.size(), 3)
+        self.assertEqual(st.peek(), 3)
+        self.assertEqual([st.pop(), st.pop(), st.pop()], [3, 2, 1])
+        self.assertTrue(st.is_empty())
+
+    def test_chars_by_default(self):
+        st = CompactStack()
+        st.push("x")
+        self.assertEqual(st.peek(), "x")
+        self.assertEqual(st.size(), 1)
+        self.assertFalse(st.is_empty())
+
+    def test_empty_raises_same_messages(self):
+        st = CompactStack()
+        with self.assertRaisesRegex(IndexError, "pop from empty stack"):
+            st.pop()
+        with self.assertRaisesRegex(IndexError, "peek from empty stack"):
+            st.peek()
+
+    def test_slots_and_typed_storage(self):
+        st = CompactStack("B")
+        self.assertFalse(hasattr(st, "__dict__"))  # __slots__ — без __dict__
+        with self.assertRaises(TypeError):
+            st.push("not a byte")                  # тип элементов фиксирован
+        st.push(40)
+        self.assertEqual(repr(st), "CompactStack('B', [40])")
+
+
+# === ТЕСТЫ ДЛЯ ПОДРОБНОГО ОТЧЁТА ===
+class TestDiagnostics(unittest.TestCase):
+    def test_agrees_with_boolean_version(self):
+        for s in SAMPLES:
+            with self.subTest(s=s):
+                self.assertEqual(bool(diagnose_brackets(s)), is_brackets_balanced(s))
+
+    def test_wrong_closer_position(self):
+        r = diagnose_brackets("ab\n((]x")
+        self.assertFalse(r.balanced)
+        self.assertEqual((r.offset, r.line, r.column), (5, 2, 3))
+        self.assertEqual((r.found, r.expected), ("]", ")"))
+        self.assertEqual(r.max_depth, 2)
+        self.assertEqual(r.unclosed, (3, 4))
+
+    def test_extra_closer_and_unclosed_at_eof(self):
+        r = diagnose_brackets("()}")
+        self.assertEqual((r.offset, r.found, r.expected), (2, "}", None))
+        r = diagnose_brackets("[(\n)")
+        self.assertEqual((r.offset, r.line, r.column), (4, 2, 2))
+        self.assertEqual((r.found, r.expected, r.unclosed), (None, "]", (0,)))
+
+    def test_max_depth_when_balanced(self):
+        r = diagnose_brackets("(((([{}]))))")
+        self.assertTrue(r)
+        self.assertEqual(r.max_depth, 6)
+
+    def test_verdict_details(self):
+        self.assertEqual(verdict_details("()[]{}"), "Сбалансированно")
+        self.assertEqual(
+            verdict_details("([)]"),
+            "Несбалансированно: строка 1, столбец 3: найдено ')', ожидалось ']'",
+        )
+
+
+# === ТЕСТЫ ДЛЯ НАСТРАИВАЕМОЙ ГРАММАТИКИ ===
+class TestBracketGrammar(unittest.TestCase):
+    def test_default_grammar_matches_function(self):
+        g = compile_grammar()
+        for s in SAMPLES:
+            with self.subTest(s=s):
+                self.assertEqual(g.is_balanced(s), is_brackets_balanced(s))
+                self.assertEqual(g.verdict_text(s), verdict_text(s))
+
+    def test_custom_single_char_pairs(self):
+        g = compile_grammar((("<", ">"), ("«", "»")))
+        self.assertTrue(g.is_balanced("<a «b» (c>"))   # круглые здесь не скобки
+        self.assertFalse(g.is_balanced("<«>»"))
+
+    def test_multichar_word_delimiters(self):
+        g = compile_grammar((("begin", "end"), ("(", ")")))
+        self.assertTrue(g.is_balanced("begin f(x); begin end end"))
+        self.assertTrue(g.is_balanced("beginning (ended)"))  # только целые слова
+        self.assertFalse(g.is_balanced("begin (end)"))
+
+    def test_quotes_hide_brackets(self):
+        g = compile_grammar(quotes=('"', ("/*", "*/")))
+        self.assertTrue(g.is_balanced('f(")", /* ]] */ [1])'))
+        self.assertTrue(g.is_balanced('f("\\")")'))       # экранированная кавычка
+        self.assertFalse(g.is_balanced('f(")'))           # кавычка не закрыта
+
+    def test_cache_and_validation(self):
+        self.assertIs(compile_grammar((("<", ">"),)), compile_grammar((("<", ">"),)))
+        with self.assertRaises(ValueError):
+            BracketGrammar((("|", "|"),))
+
+
+# === ТЕСТЫ ДЛЯ ПОТОКОВОЙ ПРОВЕРКИ ===
+SAMPLES = [
+    "(((([{}]))))", "[([])((([[[]]])))]{()}", "{{[()]}}", "", "()[]{}",
+    "}{}", "{{[(])]}}", "[[{())}]", "(", "())", "([)]", "func(a[0] + b{2})",
+]
+
+
+class TestStreaming(unittest.TestCase):
+    def test_same_result_as_string_version(self):
+        # Любой размер куска должен давать тот же ответ, что и обычная функция
+        for s in SAMPLES:
+            for size in (1, 2, 3, 64):
+                with self.subTest(s=s, size=size):
+                    self.assertEqual(
+                        is_brackets_balanced_stream(io.StringIO(s), chunk_size=size),
+                        is_brackets_balanced(s),
+                    )
+
+    def test_binary_file_and_generator(self):
+        # Бинарный файл с не-ASCII текстом и генератор кусков байт
+        data = "ключ: {значение: [1, (2)]}".encode("utf-8")
+        self.assertTrue(is_brackets_balanced_stream(io.BytesIO(data), chunk_size=3))
+        chunks = (data[i:i + 5] for i in range(0, len(data), 5))
+        self.assertTrue(is_brackets_balanced_stream(chunks))
+        self.assertFalse(is_brackets_balanced_stream([b"((", b"]"]))
+
+    def test_stops_reading_after_error(self):
+        # После первой ошибки остальные куски не запрашиваются
+        def chunks():
+            yield "(]"
+            raise AssertionError("источник дочитан после ошибки")
+        self.assertFalse(is_brackets_balanced_stream(chunks()))
+
+    def test_verdict_text_stream(self):
+        self.assertEqual(verdict_text_stream(io.StringIO("()[]{}")), "Сбалансированно")
+        self.assertEqual(verdict_text_stream(io.BytesIO(b"([)]")), "Несбалансированно")
+
+
+class TestFileEngine(unittest.TestCase):
+    def _write(self, data: bytes) -> str:
+        # Временный файл удаляется после теста
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_same_result_as_string_version(self):
+        # Маленькое окно проверяет перенос стека между окнами файла
+        for s in SAMPLES + ["(" * 50 + "[]" * 20 + ")" * 50, "([]){}" * 100 + "]"]:
+            path = self._write(s.encode("utf-8"))
+            for window in (1, 3, 7, 1 << 16):
+                with self.subTest(s=s[:20], window=window):
+                    self.assertEqual(
+                        is_file_brackets_balanced(path, window_size=window),
+                        is_brackets_balanced(s),
+                    )
+
+    def test_verdict_text_file(self):
+        self.assertEqual(verdict_text_file(self._write(b"")), "Сбалансированно")
+        self.assertEqual(verdict_text_file(self._write("{ключ: [1]}".encode())), "Сбалансированно")
+        self.assertEqual(verdict_text_file(self._write(b"[[{())}]")), "Несбалансированно")
+
+
+class TestValidateMany(unittest.TestCase):
+    def test_in_process_keeps_order(self):
+        lines = SAMPLES * 7
+        expected = [verdict_text(s) for s in lines]
+        self.assertEqual(list(validate_many(lines, workers=1, batch_size=5)), expected)
+
+    def test_process_pool_keeps_order(self):
+        # Пакеты меньше входа: результаты нескольких процессов склеиваются по порядку
+        lines = io.StringIO("\n".join(SAMPLES * 20))
+        expected = [verdict_text(s) for s in SAMPLES * 20]
+        self.assertEqual(list(validate_many(lines, workers=2, batch_size=7)), expected)
+
+    def test_empty_input(self):
+        self.assertEqual(list(validate_many([], workers=2)), [])
+
+    def test_bytes_rejected(self):
+        # Байтовые строки (например, файл открыт в режиме "rb") не проверяются молча
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                with self.assertRaises(TypeError):
+                    list(validate_many(["()", b"(]"], workers=workers))
+
+
+class TestParallel(unittest.TestCase):
+    def test_small_strings_in_process(self):
+        for s in SAMPLES:
+            with self.subTest(s=s):
+                self.assertEqual(is_brackets_balanced_parallel(s), is_brackets_balanced(s))
+
+    def test_chunks_match_sequential(self):
+        # Разрезы попадают внутрь пар и между незакрытыми скобками разных кусков
+        rnd = random.Random(7)
+        cases = [
+            "([]){}" * 50,
+            "(" * 40 + "[]" * 30 + ")" * 40,
+            "ключ(" * 20 + ")" * 20,
+            "([]){}" * 50 + "(]",
+            "]" + "()" * 50,
+            "(" * 40 + ")" * 39,
+        ] + ["".join(rnd.choice("(((){}[]x") for _ in range(200)) for _ in range(10)]
+        for s in cases:
+            with self.subTest(s=s[:20]):
+                self.assertEqual(
+                    is_brackets_balanced_parallel(s, workers=2, chunk_size=17),
+                    is_brackets_balanced(s),
+                )
+
+
+class TestIncremental(unittest.TestCase):
+    def test_initial_text(self):
+        for s in SAMPLES:
+            with self.subTest(s=s):
+                checker = IncrementalBracketChecker(s, block_size=2)
+                self.assertEqual(checker.is_balanced(), is_brackets_balanced(s))
+                self.assertEqual(checker.text, s)
+
+    def test_random_edits_match_full_rescan(self):
+        # После каждой правки ответ совпадает с проверкой текста целиком
+        rnd = random.Random(3)
+        text = "([]){}" * 10
+        checker = IncrementalBracketChecker(text, block_size=4)
+        for _ in range(500):
+            offset = rnd.randint(0, len(text))
+            if text and rnd.random() < 0.4:
+                length = rnd.randint(0, min(12, len(text) - offset))
+                checker.delete(offset, length)
+                text = text[:offset] + text[offset + length:]
+            else:
+                piece = "".join(rnd.choice("()[]{}x") for _ in range(rnd.randint(1, 10)))
+                checker.insert(offset, piece)
+                text = text[:offset] + piece + text[offset:]
+            self.assertEqual(checker.text, text)
+            self.assertEqual(len(checker), len(text))
+            self.assertEqual(checker.verdict_text(), verdict_text(text))
+
+    def test_typing_fix(self):
+        checker = IncrementalBracketChecker("f(a[0]")
+        self.assertFalse(checker.is_balanced())
+        checker.insert(6, ")")
+        self.assertTrue(checker.is_balanced())
+        checker.delete(3, 1)
+        self.assertFalse(checker.is_balanced())
+
+    def test_offset_out_of_range(self):
+        checker = IncrementalBracketChecker("()")
+        with self.assertRaises(IndexError):
+            checker.insert(3, "(")
+        with self.assertRaises(IndexError):
+            checker.delete(1, 2)
+        with self.assertRaises(ValueError):
+            checker.delete(0, -1)
+        self.assertEqual(checker.text, "()")
+
+    def test_split_rescans_only_new_blocks(self):
+        # Набор текста в одном месте: разбиение блока не пересчитывает сводки остальных блоков
+        text = "(" * 200 + ")" * 200
+        checker = IncrementalBracketChecker(text, block_size=8)
+        module = sys.modules[IncrementalBracketChecker.__module__]
+        original = module._chunk_summary
+        scanned = []
+
+        def counting(block):
+            scanned.append(len(block))
+            return original(block)
+
+        module._chunk_summary = counting
+        try:
+            for _ in range(200):
+                checker.insert(200, "[]")
+                text = text[:200] + "[]" + text[200:]
+        finally:
+            module._chunk_summary = original
+        self.assertEqual(checker.text, text)
+        self.assertTrue(checker.is_balanced())
+        self.assertLessEqual(sum(scanned), 10 * 200 * 2)
+
+
 # Запуск тестов при прямом вызове файла
 if __name__ == "__main__":
     unittest.main(verbosity=2)
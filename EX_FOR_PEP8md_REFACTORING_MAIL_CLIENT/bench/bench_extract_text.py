@@ -0,0 +1,166 @@
+"""Бенчмарк MailClient.extract_text против прежней реализации.
+
+Запуск (из папки EX_FOR_PEP8md_REFACTORING_MAIL_CLIENT):
+
+    python bench/bench_extract_text.py                     # 2000 писем, 5 повторов
+    python bench/bench_extract_text.py --messages 10000 --max-length 500 -o results.json
+
+Корпус — синтетические письма разной структуры: только текст, multipart/
+alternative (текст + HTML), смешанные с вложениями (в том числе text/plain
+с Content-Disposition: attachment и вложенным message/rfc822), в кодировках
+utf-8 / koi8-r / cp1251 и с base64, quoted-printable и 8bit. Письма
+разбираются заранее: замеряется только извлечение текста. Перед замером
+результаты новой реализации сверяются с прежней.
+"""
+
+import argparse
+import email
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from email.message import EmailMessage
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from mail_client_ref import MailClient  # noqa: E402
+
+
+def extract_text_reference(msg) -> str:
+    """Прежняя реализация MailClient.extract_text (для сравнения)."""
+    parts = []
+    if msg.is_multipart():
+        for part in msg.walk():
+            ctype = part.get_content_type()
+            disp = part.get("Content-Disposition", "")
+            if ctype == "text/plain" and "attachment" not in disp:
+                charset = part.get_content_charset() or "utf-8"
+                payload = part.get_payload(decode=True)
+                if payload is not None:
+                    parts.append(payload.decode(charset, errors="replace"))
+    else:
+        charset = msg.get_content_charset() or "utf-8"
+        payload = msg.get_payload(decode=True)
+        if payload is not None:
+            parts.append(payload.decode(charset, errors="replace"))
+    return "\n".join(parts).strip()
+
+
+# ===== Корпус =====
+
+WORDS = ("отчёт бюджет встреча проект договор счёт report budget meeting invoice "
+         "deadline quarter résumé naïve 2024 — «кавычки» ✓").split()
+CHARSETS = ("utf-8", "utf-8", "koi8-r", "cp1251")
+ENCODINGS = ("base64", "quoted-printable", "8bit")
+
+
+def _text(rnd: random.Random, words: int) -> str:
+    lines = []
+    for _ in range(max(1, words // 12)):
+        lines.append(" ".join(rnd.choice(WORDS) for _ in range(12)))
+    return "\n".join(lines) + "\n"
+
+
+def _set_text(part: EmailMessage, rnd: random.Random, words: int) -> None:
+    charset = rnd.choice(CHARSETS)
+    text = _text(rnd, words)
+    if charset != "utf-8":
+        text = text.encode(charset, errors="replace").decode(charset)
+    part.set_content(text, charset=charset, cte=rnd.choice(ENCODINGS))
+
+
+def make_message(rnd: random.Random) -> bytes:
+    """Одно письмо случайной структуры."""
+    msg = EmailMessage()
+    msg["From"] = "sender@example.com"
+    msg["To"] = "user@example.com"
+    msg["Subject"] = "Письмо " + rnd.choice(WORDS)
+    kind = rnd.choice(("plain", "alternative", "mixed", "mixed"))
+    _set_text(msg, rnd, rnd.randint(50, 3000))
+    if kind != "plain":
+        msg.add_alternative("<html><body>" + _text(rnd, 500) + "</body></html>", subtype="html")
+    if kind == "mixed":
+        for _ in range(rnd.randint(1, 3)):
+            msg.add_attachment(rnd.randbytes(rnd.randint(5_000, 50_000)), maintype="application",
+                               subtype="octet-stream", filename="data.bin")
+        if rnd.random() < 0.5:
+            msg.add_attachment(_text(rnd, 2000), filename="notes.txt")  # text/plain, но вложение
+        if rnd.random() < 0.3:
+            inner = EmailMessage()
+            inner["Subject"] = "вложенное"
+            _set_text(inner, rnd, 200)
+            msg.add_attachment(inner)                    # message/rfc822: его текст тоже попадает в результат
+    return msg.as_bytes()
+
+
+def make_corpus(count: int, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    return [email.message_from_bytes(make_message(rnd)) for _ in range(count)]
+
+
+# ===== Замеры =====
+
+def _best(fn, corpus, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for msg in corpus:
+            fn(msg)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def run(count: int, repeat: int, max_length: int) -> list:
+    corpus = make_corpus(count)
+    for msg in corpus:                                   # новая реализация обязана давать тот же текст
+        expected = extract_text_reference(msg)
+        assert MailClient.extract_text(msg) == expected
+        assert MailClient.extract_text(msg, max_length=max_length) == expected[:max_length]
+
+    targets = {
+        "reference": extract_text_reference,
+        "extract_text": MailClient.extract_text,
+        "first_only": lambda m: MailClient.extract_text(m, first_only=True),
+        f"max_length={max_length}": lambda m: MailClient.extract_text(m, max_length=max_length),
+    }
+    results = []
+    baseline = None
+    for name, fn in targets.items():
+        seconds = _best(fn, corpus, repeat)
+        baseline = baseline or seconds
+        results.append({"target": name, "seconds": round(seconds, 6), "speedup": round(baseline / seconds, 2)})
+        print(f"{name:>22} {seconds:>9.4f} s {count / seconds:>10.0f} писем/с  x{baseline / seconds:.2f}",
+              flush=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения текста из писем")
+    parser.add_argument("--messages", type=int, default=2000, help="писем в корпусе")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов, берётся лучший")
+    parser.add_argument("--max-length", type=int, default=200, help="max_length для варианта с обрезкой")
+    parser.add_argument("-o", "--output", help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.messages, args.repeat, args.max_length)
+    if args.output:
+        report = {
+            "meta": {
+                "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "messages": args.messages,
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
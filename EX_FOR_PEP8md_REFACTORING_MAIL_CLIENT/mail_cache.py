@@ -0,0 +1,131 @@
+"""Локальный кэш писем IMAP в SQLite: ключ — (папка, UIDVALIDITY, UID).
+
+UID письма в папке не меняется и не переиспользуется, пока у папки тот же
+UIDVALIDITY (RFC 3501, 2.3.1.1), поэтому скачанное содержимое письма никогда
+не устаревает; при смене UIDVALIDITY кэш папки сбрасывается целиком. Меняться
+могут только флаги — их обновляет MailClient.sync (через CONDSTORE, если есть).
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from typing import Iterable, Mapping, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mailboxes (
+    mailbox     TEXT PRIMARY KEY,
+    uidvalidity INTEGER NOT NULL,
+    last_uid    INTEGER NOT NULL DEFAULT 0,   -- до какого UID папка синхронизирована
+    modseq      INTEGER NOT NULL DEFAULT 0    -- наибольший известный MODSEQ (CONDSTORE); 0 — неизвестен
+);
+CREATE TABLE IF NOT EXISTS messages (
+    mailbox     TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid         INTEGER NOT NULL,
+    flags       TEXT NOT NULL DEFAULT '',     -- флаги через пробел
+    raw         BLOB,                         -- NULL — известны только флаги, тело ещё не скачано
+    PRIMARY KEY (mailbox, uidvalidity, uid)
+);
+"""
+
+
+class MessageCache:
+    """Потокобезопасный кэш писем в файле SQLite (":memory:" — в памяти процесса)."""
+
+    def __init__(self, path: str = ":memory:") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")      # чтение не блокирует запись из другого процесса
+        self._db.executescript(_SCHEMA)
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "resets": 0}
+
+    def state(self, mailbox: str) -> Optional[tuple[int, int, int]]:
+        """(uidvalidity, last_uid, modseq) папки или None, если папка ещё не синхронизировалась."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT uidvalidity, last_uid, modseq FROM mailboxes WHERE mailbox = ?", (mailbox,),
+            ).fetchone()
+
+    def validate(self, mailbox: str, uidvalidity: int) -> tuple[int, int]:
+        """Сверить UIDVALIDITY с сервером и вернуть (last_uid, modseq) для продолжения синхронизации.
+
+        Если UIDVALIDITY изменился, письма папки удаляются и синхронизация начнётся с нуля.
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT uidvalidity, last_uid, modseq FROM mailboxes WHERE mailbox = ?", (mailbox,),
+            ).fetchone()
+            if row is not None and row[0] == uidvalidity:
+                return row[1], row[2]
+            if row is not None:
+                self.stats["resets"] += 1
+            self._db.execute("DELETE FROM messages WHERE mailbox = ?", (mailbox,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO mailboxes (mailbox, uidvalidity) VALUES (?, ?)", (mailbox, uidvalidity),
+            )
+            return 0, 0
+
+    def advance(self, mailbox: str, last_uid: int, modseq: int = 0) -> None:
+        """Запомнить, что папка синхронизирована до last_uid и modseq (значения только растут)."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE mailboxes SET last_uid = MAX(last_uid, ?), modseq = MAX(modseq, ?) WHERE mailbox = ?",
+                (last_uid, modseq, mailbox),
+            )
+
+    def store(self, mailbox: str, uidvalidity: int, messages: Iterable[Mapping]) -> None:
+        """Сохранить письма: словари с ключом uid и (необязательно) flags и body.
+
+        Уже скачанное тело не затирается записью, где body отсутствует (обновление флагов),
+        а известные флаги — записью без ключа flags (тело скачано без FLAGS).
+        """
+        rows = [
+            (mailbox, uidvalidity, m["uid"], " ".join(m["flags"] or ()) if "flags" in m else None, m.get("body"))
+            for m in messages
+        ]
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO messages (mailbox, uidvalidity, uid, flags, raw) VALUES (?1, ?2, ?3, COALESCE(?4, ''), ?5) "
+                "ON CONFLICT (mailbox, uidvalidity, uid) DO UPDATE "
+                "SET flags = COALESCE(?4, flags), raw = COALESCE(excluded.raw, raw)",
+                rows,
+            )
+            self.stats["stored"] += len(rows)
+
+    def get(self, mailbox: str, uidvalidity: int, uid: int) -> Optional[bytes]:
+        """Сырое письмо (RFC 822) из кэша или None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT raw FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                (mailbox, uidvalidity, uid),
+            ).fetchone()
+            hit = row is not None and row[0] is not None
+            self.stats["hits" if hit else "misses"] += 1
+            return bytes(row[0]) if hit else None
+
+    def flags(self, mailbox: str, uidvalidity: int, uid: int) -> Optional[tuple[str, ...]]:
+        """Флаги письма по последней синхронизации или None, если письмо неизвестно."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT flags FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                (mailbox, uidvalidity, uid),
+            ).fetchone()
+        return tuple(row[0].split()) if row is not None else None
+
+    def uids(self, mailbox: str, uidvalidity: int) -> list[int]:
+        """UID всех известных писем папки по возрастанию."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uid FROM messages WHERE mailbox = ? AND uidvalidity = ? ORDER BY uid",
+                (mailbox, uidvalidity),
+            ).fetchall()
+        return [uid for (uid,) in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -3,130 +3,12 @@
 
 from __future__ import annotations
 
-import email
 import imaplib
 import smtplib
-from dataclasses import dataclass
-from email.message import EmailMessage
 from getpass import getpass
-from typing import Iterable, Optional, Sequence, Tuple
 
-
-# ===== Класс (как в твоём варианте) =====
-
-@dataclass
-class MailClient:
-    """Клиент почты с методами отправки (SMTP) и получения (IMAP)."""
-
-    username: str
-    password: str
-    smtp_server: str = "smtp.gmail.com"
-    smtp_port: int = 587
-    imap_server: str = "imap.gmail.com"
-    imap_port: int = 993
-    smtp_use_tls: bool = True
-    timeout: int = 60
-
-    # ---------- SMTP ----------
-    def send_email(
-        self,
-        recipients: Sequence[str],
-        subject: str,
-        body: str,
-        *,
-        cc: Sequence[str] | None = None,
-        bcc: Sequence[str] | None = None,
-        attachments: Iterable[Tuple[str, bytes, str]] | None = None,
-    ) -> None:
-        """Отправить письмо.
-
-        attachments: итерируемый набор кортежей (filename, content_bytes, mime_type)
-                     например: [("readme.txt", b"...", "text/plain")]
-        """
-        cc = cc or []
-        bcc = bcc or []
-        attachments = attachments or []
-
-        msg = EmailMessage()
-        msg["From"] = self.username
-        msg["To"] = ", ".join(recipients)
-        if cc:
-            msg["Cc"] = ", ".join(cc)
-        msg["Subject"] = subject
-        msg.set_content(body)
-
-        for filename, content, mime_type in attachments:
-            maintype, subtype = mime_type.split("/", 1)
-            msg.add_attachment(
-                content,
-                maintype=maintype,
-                subtype=subtype,
-                filename=filename,
-            )
-
-        all_rcpts = list(recipients) + list(cc) + list(bcc)
-
-        with smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout) as s:
-            s.ehlo()
-            if self.smtp_use_tls:
-                s.starttls()
-                s.ehlo()
-            s.login(self.username, self.password)
-            s.send_message(msg, from_addr=self.username, to_addrs=all_rcpts)
-
-    # ---------- IMAP ----------
-    def fetch_latest(
-        self,
-        mailbox: str = "INBOX",
-        *,
-        subject: Optional[str] = None,
-        unread_only: bool = False,
-    ) -> Optional[email.message.Message]:
-        """Получить последнее письмо по критериям (или None, если не найдено)."""
-        with imaplib.IMAP4_SSL(self.imap_server, self.imap_port) as imap:
-            imap.login(self.username, self.password)
-            imap.select(mailbox)
-
-            criteria = ["ALL"]
-            if unread_only:
-                criteria.append("UNSEEN")
-            if subject:
-                safe_subject = subject.replace('"', r"\"")
-                criteria.append(f'(HEADER Subject "{safe_subject}")')
-
-            search_query = " ".join(criteria)
-            status, data = imap.uid("search", None, search_query)
-            if status != "OK" or not data or not data[0]:
-                return None
-
-            latest_uid = data[0].split()[-1]
-            status, fetched = imap.uid("fetch", latest_uid, "(RFC822)")
-            if status != "OK" or not fetched or not fetched[0]:
-                return None
-
-            raw_email = fetched[0][1]
-            return email.message_from_bytes(raw_email)
-
-    # ---------- Helpers ----------
-    @staticmethod
-    def extract_text(msg: email.message.Message) -> str:
-        """Достать текстовую часть письма (text/plain) без вложений."""
-        parts: list[str] = []
-        if msg.is_multipart():
-            for part in msg.walk():
-                ctype = part.get_content_type()
-                disp = part.get("Content-Disposition", "")
-                if ctype == "text/plain" and "attachment" not in disp:
-                    charset = part.get_content_charset() or "utf-8"
-                    payload = part.get_payload(decode=True)
-                    if payload is not None:
-                        parts.append(payload.decode(charset, errors="replace"))
-        else:
-            charset = msg.get_content_charset() or "utf-8"
-            payload = msg.get_payload(decode=True)
-            if payload is not None:
-                parts.append(payload.decode(charset, errors="replace"))
-        return "\n".join(parts).strip()
+# Класс тот же, что и в CLI-версии: импортируем его, чтобы не держать две копии
+from mail_client_ref import MailClient
 
 
 # ===== Утилиты для интерактива =====
@@ -210,6 +92,8 @@ if __name__ == "__main__":
         imap_port=imap_port,
         smtp_use_tls=use_tls,
         timeout=timeout,
+        smtp_pool_size=1,  # SMTP-сессия остаётся открытой между отправками из меню
+        imap_pool_size=1,  # IMAP-сессия тоже: повторные запросы не логинятся заново
     )
 
     # Один и тот же client используется во всех действиях, пока программа не завершится.
@@ -252,6 +136,7 @@ if __name__ == "__main__":
                     mailbox=mailbox,
                     subject=subj or None,
                     unread_only=unread_only,
+                    mode="text",                   # вложения не скачиваются
                 )
             except imaplib.IMAP4.error as exc:
                 print(f"Ошибка IMAP: {exc}")
@@ -266,6 +151,7 @@ if __name__ == "__main__":
                 print("— Body:\n" + MailClient.extract_text(msg))
 
         elif choice == "0":
+            client.close()
             print("До встречи!")
             break
         else:
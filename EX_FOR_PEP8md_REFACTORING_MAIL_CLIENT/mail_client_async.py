@@ -0,0 +1,337 @@
+"""Асинхронный (asyncio) вариант MailClient: SMTP и IMAP поверх asyncio streams.
+
+Поверхность та же, что у MailClient: send_email, fetch_latest, extract_text, но
+методы send_email и fetch_latest — корутины. Все операции одного процесса могут
+выполняться в одном цикле событий, без выноса блокирующего smtplib/imaplib в потоки.
+Внешних зависимостей нет: протоколы реализованы в объёме, который нужен этим методам.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import email
+import re
+import ssl
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from typing import Iterable, Optional, Sequence, Tuple
+
+from mail_client_ref import AttachmentContent, MailClient, _smtp_chunks, build_message
+
+
+class AsyncSmtpError(Exception):
+    """Сервер SMTP ответил ошибкой (код и текст ответа — в args)."""
+
+    def __init__(self, code: int, message: bytes, command: str = "") -> None:
+        super().__init__(code, message, command)
+        self.code = code
+        self.message = message
+        self.command = command
+
+
+class AsyncImapError(Exception):
+    """Сервер IMAP ответил NO/BAD или закрыл соединение."""
+
+
+async def _close_writer(writer: asyncio.StreamWriter, timeout: Optional[float], *, abort: bool = False) -> None:
+    """Закрыть соединение: штатно, ожидая не дольше timeout секунд, или сразу обрывом (abort)."""
+    if not abort:
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), timeout)
+            return
+        except OSError:                                # в том числе TimeoutError
+            pass
+    writer.transport.abort()
+
+
+# ===== SMTP =====
+
+class _SmtpConnection:
+    """Одна SMTP-сессия поверх asyncio streams."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.features: set[str] = set()               # расширения ESMTP из ответа на EHLO (в нижнем регистре)
+
+    async def reply(self) -> Tuple[int, bytes]:
+        """Прочитать (возможно многострочный) ответ: "250-..." ... "250 ..."."""
+        lines = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError("SMTP server closed the connection")
+            lines.append(line[4:].rstrip(b"\r\n"))
+            if line[3:4] != b"-":
+                return int(line[:3]), b"\n".join(lines)
+
+    async def command(self, cmd: str, expect: Sequence[int] = (250,)) -> Tuple[int, bytes]:
+        """Отправить команду и проверить код ответа."""
+        self.writer.write(cmd.encode() + b"\r\n")
+        code, resp = await self.reply()
+        if code not in expect:
+            raise AsyncSmtpError(code, resp, cmd.split(" ", 1)[0])
+        return code, resp
+
+    async def ehlo(self, name: str = "localhost") -> None:
+        _, resp = await self.command(f"EHLO {name}")
+        self.features = {line.split(b" ", 1)[0].decode().lower() for line in resp.split(b"\n")[1:]}
+
+    async def close(self, timeout: Optional[float] = None, *, graceful: bool = True) -> None:
+        """Завершить сессию: QUIT и закрытие сокета, каждый шаг — не дольше timeout секунд.
+
+        graceful=False (после таймаута или сбоя операции), истёкший таймаут или
+        обрыв при QUIT — соединение обрывается без ожидания ответа сервера.
+        """
+        if graceful:
+            try:
+                await asyncio.wait_for(self.command("QUIT", expect=(221,)), timeout)
+            except AsyncSmtpError:
+                pass
+            except (ConnectionError, OSError):             # в том числе TimeoutError: сервер не отвечает
+                graceful = False
+        await _close_writer(self.writer, timeout, abort=not graceful)
+
+
+# ===== IMAP =====
+
+_LITERAL = re.compile(rb"\{(\d+)\}\r\n$")           # строка ответа, за которой следует литерал {N}
+
+
+class _ImapConnection:
+    """Одна IMAP-сессия поверх asyncio streams (подмножество RFC 3501)."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self._tag = 0
+
+    async def _read_line(self) -> list:
+        """Прочитать одну логическую строку ответа вместе с литералами.
+
+        Возвращает список: байтовые строки и содержимое литералов по порядку.
+        """
+        parts = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise AsyncImapError("IMAP server closed the connection")
+            m = _LITERAL.search(line)
+            if not m:
+                parts.append(line.rstrip(b"\r\n"))
+                return parts
+            parts.append(line[:m.start()])
+            parts.append(await self.reader.readexactly(int(m.group(1))))
+
+    async def greeting(self) -> None:
+        parts = await self._read_line()
+        if not parts[0].startswith(b"* OK") and not parts[0].startswith(b"* PREAUTH"):
+            raise AsyncImapError(parts[0].decode(errors="replace"))
+
+    async def command(self, cmd: str) -> list[list]:
+        """Выполнить команду и вернуть её непомеченные ответы ("* ...")."""
+        self._tag += 1
+        tag = f"A{self._tag:04d}".encode()
+        self.writer.write(tag + b" " + cmd.encode() + b"\r\n")
+        untagged = []
+        while True:
+            parts = await self._read_line()
+            if parts[0].startswith(tag + b" "):
+                status = parts[0][len(tag) + 1:]
+                if not status.startswith(b"OK"):
+                    raise AsyncImapError(f"{cmd.split(' ', 1)[0]}: {status.decode(errors='replace')}")
+                return untagged
+            untagged.append(parts)
+
+    async def close(self, timeout: Optional[float] = None, *, graceful: bool = True) -> None:
+        """Завершить сессию: LOGOUT и закрытие сокета (см. _SmtpConnection.close)."""
+        if graceful:
+            try:
+                await asyncio.wait_for(self.command("LOGOUT"), timeout)
+            except AsyncImapError:
+                pass
+            except (ConnectionError, OSError):
+                graceful = False
+        await _close_writer(self.writer, timeout, abort=not graceful)
+
+
+def _imap_quote(value: str) -> str:
+    """Строка IMAP в кавычках (как imaplib._quote)."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+@dataclass
+class AsyncMailClient:
+    """Асинхронный клиент почты: настройки как у MailClient, методы — корутины."""
+
+    username: str
+    password: str
+    smtp_server: str = "smtp.gmail.com"
+    smtp_port: int = 587
+    imap_server: str = "imap.gmail.com"
+    imap_port: int = 993
+    smtp_use_tls: bool = True
+    timeout: int = 60
+    imap_use_ssl: bool = True
+    max_connections: int = 100                          # сколько соединений клиент держит открытыми одновременно
+
+    _limit: Optional[asyncio.Semaphore] = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_client(cls, client: MailClient, **overrides) -> "AsyncMailClient":
+        """Создать асинхронный клиент с теми же настройками, что у MailClient."""
+        settings = dict(
+            username=client.username,
+            password=client.password,
+            smtp_server=client.smtp_server,
+            smtp_port=client.smtp_port,
+            imap_server=client.imap_server,
+            imap_port=client.imap_port,
+            smtp_use_tls=client.smtp_use_tls,
+            timeout=client.timeout,
+            imap_use_ssl=client.imap_use_ssl,
+        )
+        settings.update(overrides)
+        return cls(**settings)
+
+    @property
+    def limit(self) -> asyncio.Semaphore:
+        """Ограничитель числа одновременных соединений (создаётся при первом использовании)."""
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_connections)
+        return self._limit
+
+    # ---------- SMTP ----------
+    async def _smtp_connect(self) -> _SmtpConnection:
+        """Открыть SMTP-сессию: EHLO, (STARTTLS, EHLO), AUTH PLAIN."""
+        reader, writer = await asyncio.open_connection(self.smtp_server, self.smtp_port)
+        conn = _SmtpConnection(reader, writer)
+        try:
+            code, resp = await conn.reply()
+            if code != 220:
+                raise AsyncSmtpError(code, resp, "CONNECT")
+            await conn.ehlo()
+            if self.smtp_use_tls:
+                await conn.command("STARTTLS", expect=(220,))
+                await writer.start_tls(ssl.create_default_context(), server_hostname=self.smtp_server)
+                await conn.ehlo()
+            token = base64.b64encode(f"\0{self.username}\0{self.password}".encode()).decode()
+            await conn.command(f"AUTH PLAIN {token}", expect=(235,))
+        except BaseException:
+            writer.close()
+            raise
+        return conn
+
+    async def send_email(
+        self,
+        recipients: Sequence[str],
+        subject: str,
+        body: str,
+        *,
+        cc: Sequence[str] | None = None,
+        bcc: Sequence[str] | None = None,
+        attachments: Iterable[Tuple[str, AttachmentContent, str]] | None = None,
+    ) -> None:
+        """Отправить письмо (аргументы как у MailClient.send_email)."""
+        msg, rcpts = build_message(
+            self.username, recipients, subject, body, cc=cc, bcc=bcc, attachments=attachments,
+        )
+        await self.send_message(msg, rcpts)
+
+    async def send_message(self, msg: EmailMessage, rcpts: Sequence[str]) -> None:
+        """Отправить готовое письмо указанным адресатам."""
+        async with self.limit:
+            conn = await asyncio.wait_for(self._smtp_connect(), self.timeout)
+            done = False
+            try:
+                await asyncio.wait_for(self._transaction(conn, msg, rcpts), self.timeout)
+                done = True
+            finally:
+                # После ошибки, таймаута или отмены состояние сессии неизвестно — обрываем её без QUIT
+                await conn.close(self.timeout, graceful=done)
+
+    async def _transaction(self, conn: _SmtpConnection, msg: EmailMessage, rcpts: Sequence[str]) -> None:
+        """MAIL FROM / RCPT TO / DATA; при PIPELINING — конверт одной записью."""
+        commands = [f"MAIL FROM:<{self.username}>"] + [f"RCPT TO:<{r}>" for r in rcpts]
+        if "pipelining" in conn.features:
+            conn.writer.write("".join(c + "\r\n" for c in commands).encode())
+            replies = [await conn.reply() for _ in commands]
+        else:
+            replies = []
+            for c in commands:
+                conn.writer.write(c.encode() + b"\r\n")
+                replies.append(await conn.reply())
+        code, resp = replies[0]
+        if code != 250:
+            raise AsyncSmtpError(code, resp, "MAIL")
+        if not any(code in (250, 251) for code, _ in replies[1:]):
+            code, resp = replies[1] if len(replies) > 1 else (554, b"no recipients")
+            raise AsyncSmtpError(code, resp, "RCPT")
+        await conn.command("DATA", expect=(354,))
+        for chunk in _smtp_chunks(msg):                   # вложения из файлов — блоками, с ожиданием отправки
+            conn.writer.write(chunk)
+            await conn.writer.drain()
+        conn.writer.write(b".\r\n")
+        code, resp = await conn.reply()
+        if code != 250:
+            raise AsyncSmtpError(code, resp, "DATA")
+
+    # ---------- IMAP ----------
+    async def _imap_connect(self) -> _ImapConnection:
+        """Открыть IMAP-соединение и залогиниться."""
+        context = ssl.create_default_context() if self.imap_use_ssl else None
+        reader, writer = await asyncio.open_connection(self.imap_server, self.imap_port, ssl=context)
+        conn = _ImapConnection(reader, writer)
+        try:
+            await conn.greeting()
+            await conn.command(f"LOGIN {_imap_quote(self.username)} {_imap_quote(self.password)}")
+        except BaseException:
+            writer.close()
+            raise
+        return conn
+
+    async def fetch_latest(
+        self,
+        mailbox: str = "INBOX",
+        *,
+        subject: Optional[str] = None,
+        unread_only: bool = False,
+    ) -> Optional[email.message.Message]:
+        """Получить последнее письмо по критериям (или None, если не найдено)."""
+        async with self.limit:
+            conn = await asyncio.wait_for(self._imap_connect(), self.timeout)
+            done = False
+            try:
+                message = await asyncio.wait_for(
+                    self._fetch_latest(conn, mailbox, subject, unread_only), self.timeout,
+                )
+                done = True
+                return message
+            finally:
+                await conn.close(self.timeout, graceful=done)
+
+    async def _fetch_latest(self, conn, mailbox, subject, unread_only):
+        await conn.command(f"SELECT {_imap_quote(mailbox)}")
+
+        criteria = ["ALL"]
+        if unread_only:
+            criteria.append("UNSEEN")
+        if subject:
+            criteria.append(f"(HEADER Subject {_imap_quote(subject)})")
+        uids = []
+        for parts in await conn.command("UID SEARCH " + " ".join(criteria)):
+            if parts[0].startswith(b"* SEARCH"):
+                uids.extend(parts[0].split()[2:])
+        if not uids:
+            return None
+
+        latest_uid = uids[-1].decode()
+        for parts in await conn.command(f"UID FETCH {latest_uid} (RFC822)"):
+            if b"FETCH" in parts[0] and len(parts) > 1:
+                return email.message_from_bytes(parts[1])
+        return None
+
+    # ---------- Helpers ----------
+    extract_text = staticmethod(MailClient.extract_text)
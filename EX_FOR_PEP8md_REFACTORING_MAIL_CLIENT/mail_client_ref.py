@@ -2,12 +2,920 @@
 #===================Код после выполнения рефакторинга и разбора хардкорных участков кода=============
 from __future__ import annotations  # отложенная (ленивая) оценка аннотаций типов; полезно при перекрёстных ссылках и для совместимости
 
+import base64                       # декодирование частей письма, скачанных по отдельности (BODY[n])
+import binascii                     # декодирование начала base64-части без раскодирования всей части
+import codecs                       # поиск кодеков для charset (результат кэшируется)
 import email                        # стандартный модуль для работы с письмами (парсинг MIME и т.п.)
+import email.header                 # имена вложений в кодировке RFC 2047 из BODYSTRUCTURE
+import functools                    # кэш разбора Content-Type и поиска кодеков в extract_text
 import imaplib                      # IMAP-клиент из стандартной библиотеки (получение писем)
+import mmap                         # вложения из файлов кодируются прямо из отображения файла в память
+import os                           # пути к файлам вложений
+import quopri                       # декодирование quoted-printable частей
+import queue                        # передача строк от потока-читателя в режиме IMAP IDLE
+import re                           # нормализация концов строк и "dot-stuffing" тела письма для SMTP DATA
 import smtplib                      # SMTP-клиент из стандартной библиотеки (отправка писем)
-from dataclasses import dataclass   # декоратор для краткого объявления "контейнеров данных"
+import threading                    # блокировки для пула соединений (клиент может использоваться из нескольких потоков)
+import time                         # отметки времени простоя соединений в пуле
+import uuid                         # уникальные метки мест, куда при отправке подставляются вложения из файлов
+from concurrent.futures import ThreadPoolExecutor  # параллельные SMTP-сессии в send_many
+from contextlib import contextmanager  # удобное "взять соединение из пула — вернуть обратно"
+from dataclasses import dataclass, field  # декоратор для краткого объявления "контейнеров данных"
 from email.message import EmailMessage  # современный удобный класс для сборки письма (вместо старых MIME* модулей)
-from typing import Iterable, Optional, Sequence, Tuple  # типы для подсказок и читаемости
+from email.utils import getaddresses  # разбор адресов из заголовков To/Cc/Bcc готового письма
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Mapping, Optional, Sequence, Tuple, Union  # типы для подсказок и читаемости
+
+from mail_cache import MessageCache  # локальный SQLite-кэш писем для инкрементальной синхронизации IMAP
+from mail_index import MailIndex  # локальный полнотекстовый индекс (SQLite FTS5) по заголовкам и тексту писем
+from mail_queue import MailQueue, QueuedMessage, RetryPolicy  # надёжная очередь исходящих писем (SQLite)
+from mail_stream import READ_SIZE, MimeStreamParser  # потоковый разбор MIME без буферизации письма целиком
+
+
+def _is_connection_lost(exc: BaseException) -> bool:
+    """Ошибка означает потерю соединения, а не отказ сервера по конкретному письму.
+
+    smtplib.SMTPException наследует OSError, поэтому "просто OSError" здесь —
+    только сетевые ошибки сокета (обрыв, таймаут), а не ответы сервера.
+    """
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+def _is_permanent(exc: BaseException) -> bool:
+    """Отказ сервера окончательный (5xx): повтор того же письма ничего не изменит.
+
+    Ошибка входа сюда не относится: она не зависит от письма, и после
+    исправления пароля письма из очереди должны уйти.
+    """
+    if isinstance(exc, smtplib.SMTPAuthenticationError):
+        return False
+    return isinstance(exc, smtplib.SMTPResponseException) and 500 <= exc.smtp_code < 600
+
+
+class SmtpConnectionPool:
+    """Пул авторизованных SMTP-сессий, переиспользуемых между отправками.
+
+    Соединения создаёт factory() (уже после EHLO/STARTTLS/login). Перед выдачей
+    соединение, простоявшее дольше check_after секунд, проверяется командой NOOP;
+    разорванные соединения выбрасываются и заменяются новыми. Одновременно
+    открыто не более max_size соединений, лишние запросы ждут освобождения.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], smtplib.SMTP],           # функция, открывающая новую авторизованную сессию
+        max_size: int = 2,                             # максимум одновременно открытых соединений
+        *,
+        max_idle: float = 300.0,                       # соединение, простоявшее дольше, закрываем не проверяя
+        check_after: float = 5.0,                      # после такого простоя перед выдачей делаем NOOP
+    ) -> None:
+        self._factory = factory
+        self._max_idle = max_idle
+        self._check_after = check_after
+        self._slots = threading.BoundedSemaphore(max_size)  # ограничивает число соединений "на руках" и в пуле
+        self._lock = threading.Lock()                  # защищает список свободных соединений
+        self._idle: list[tuple[smtplib.SMTP, float]] = []  # (соединение, время возврата в пул); берём с конца (LIFO)
+        self.stats = {"created": 0, "reused": 0, "discarded": 0}  # счётчики для диагностики
+
+    @staticmethod
+    def _is_alive(conn: smtplib.SMTP) -> bool:
+        """Проверить соединение командой NOOP (сервер должен ответить 250)."""
+        try:
+            return conn.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _close_quietly(conn: smtplib.SMTP) -> None:
+        """Закрыть соединение, не обращая внимания на ошибки (оно могло уже порваться)."""
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+
+    def acquire(self) -> smtplib.SMTP:
+        """Взять живое соединение из пула или открыть новое."""
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, released_at = self._idle.pop()
+                idle_for = time.monotonic() - released_at
+                if idle_for <= self._max_idle and (idle_for < self._check_after or self._is_alive(conn)):
+                    self.stats["reused"] += 1
+                    return conn
+                self.stats["discarded"] += 1           # протухло или не ответило на NOOP — закрываем и берём следующее
+                self._close_quietly(conn)
+            conn = self._factory()
+            self.stats["created"] += 1
+            return conn
+        except BaseException:
+            self._slots.release()                      # не удалось выдать соединение — освобождаем место
+            raise
+
+    def release(self, conn: smtplib.SMTP, *, broken: bool = False) -> None:
+        """Вернуть соединение в пул (broken=True — закрыть его вместо возврата)."""
+        try:
+            if broken:
+                self.stats["discarded"] += 1
+                self._close_quietly(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as smtp: ... — соединение вернётся в пул само."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException as exc:
+            # Оборванную сессию в пул не возвращаем; после отказа сервера по письму она пригодна
+            self.release(conn, broken=_is_connection_lost(exc))
+            raise
+        else:
+            self.release(conn)
+
+    def close(self) -> None:
+        """Закрыть все свободные соединения пула."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+
+class ImapSessionPool:
+    """Пул авторизованных IMAP-сессий с привязкой к выбранной папке.
+
+    Сессия помнит, какая папка в ней выбрана (SELECT): если нужна та же папка,
+    повторный SELECT пропускается. Перед выдачей сессия, простоявшая дольше
+    check_after секунд, проверяется командой NOOP; ответ BYE, обрыв или таймаут
+    приводят к тому, что сессия выбрасывается и заменяется новой.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], imaplib.IMAP4],          # функция, открывающая новую залогиненную сессию
+        max_size: int = 2,                             # максимум одновременно открытых сессий
+        *,
+        max_idle: float = 600.0,                       # простоявшую дольше сессию закрываем не проверяя
+        check_after: float = 5.0,                      # после такого простоя перед выдачей делаем NOOP
+    ) -> None:
+        self._factory = factory
+        self._max_idle = max_idle
+        self._check_after = check_after
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle: list[tuple[imaplib.IMAP4, Optional[str], float]] = []  # (сессия, выбранная папка, время возврата)
+        self.stats = {"created": 0, "reused": 0, "selects": 0, "selects_skipped": 0, "discarded": 0}
+
+    @staticmethod
+    def _is_alive(imap: imaplib.IMAP4) -> bool:
+        """NOOP должен вернуть OK (на BYE/обрыв imaplib бросает IMAP4.abort)."""
+        try:
+            return imap.noop()[0] == "OK"
+        except (imaplib.IMAP4.error, OSError):
+            return False
+
+    @staticmethod
+    def _close_quietly(imap: imaplib.IMAP4) -> None:
+        try:
+            imap.logout()
+        except (imaplib.IMAP4.error, OSError):
+            imap.shutdown()
+
+    def _take_idle(self, mailbox: str):
+        """Снять из списка свободных сессию, предпочитая ту, где уже выбрана mailbox."""
+        with self._lock:
+            if not self._idle:
+                return None
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i][1] == mailbox:
+                    return self._idle.pop(i)
+            return self._idle.pop()
+
+    def acquire(self, mailbox: str) -> tuple[imaplib.IMAP4, Optional[str]]:
+        """Взять (сессия, выбранная в ней папка) — живую из пула или новую."""
+        self._slots.acquire()
+        try:
+            while (entry := self._take_idle(mailbox)) is not None:
+                imap, selected, released_at = entry
+                idle_for = time.monotonic() - released_at
+                if idle_for <= self._max_idle and (idle_for < self._check_after or self._is_alive(imap)):
+                    self.stats["reused"] += 1
+                    return imap, selected
+                self.stats["discarded"] += 1
+                self._close_quietly(imap)
+            imap = self._factory()
+            self.stats["created"] += 1
+            return imap, None
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, imap: imaplib.IMAP4, selected: Optional[str], *, broken: bool = False) -> None:
+        """Вернуть сессию в пул, запомнив выбранную папку (broken=True — закрыть)."""
+        try:
+            if broken:
+                self.stats["discarded"] += 1
+                self._close_quietly(imap)
+            else:
+                with self._lock:
+                    self._idle.append((imap, selected, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def session(self, mailbox: str):
+        """with pool.session("INBOX") as imap: ... — папка уже выбрана, сессия вернётся в пул."""
+        imap, selected = self.acquire(mailbox)
+        try:
+            if selected != mailbox:
+                status, _ = imap.select(mailbox)
+                self.stats["selects"] += 1
+                selected = mailbox if status == "OK" else None
+            else:
+                self.stats["selects_skipped"] += 1
+            yield imap
+        except BaseException as exc:
+            # Обрыв/BYE (IMAP4.abort) — сессию выбрасываем; прочие ошибки её не портят.
+            # GeneratorExit — потоковое чтение прервано на середине ответа, в сокете остались данные
+            broken = isinstance(exc, (imaplib.IMAP4.abort, OSError, GeneratorExit))
+            self.release(imap, selected, broken=broken)
+            raise
+        else:
+            self.release(imap, selected)
+
+    def close(self) -> None:
+        """Закрыть все свободные сессии пула."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for imap, _, _ in idle:
+            self._close_quietly(imap)
+
+
+@dataclass
+class SendResult:
+    """Итог отправки одного письма из send_many."""
+
+    index: int                                         # номер письма во входной последовательности
+    ok: bool                                           # принято ли письмо сервером
+    error: Optional[Exception] = None                  # исключение, если письмо не ушло
+    refused: dict = field(default_factory=dict)        # адресаты, отклонённые сервером при частичном успехе: {адрес: (код, ответ)}
+
+
+AttachmentContent = Union[bytes, str, "os.PathLike[str]", BinaryIO]  # байты, путь к файлу или открытый двоичный файл
+
+_B64_BLOCK = 57 * 1024                      # 57 байт — ровно одна строка base64 (76 символов), блок из целых строк
+
+
+class StreamingEmailMessage(EmailMessage):
+    """Письмо с вложениями из файлов: вместо содержимого в частях стоят метки.
+
+    Само письмо — небольшой "скелет"; при отправке (_smtp_chunks) метки
+    заменяются содержимым файлов, закодированным в base64 блоками, так что файл
+    целиком не оказывается в памяти ни в исходном, ни в закодированном виде.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.sources: dict[str, tuple[AttachmentContent, int]] = {}  # метка -> (путь или файл, начальная позиция)
+
+
+@dataclass(frozen=True)
+class PreparedMessage:
+    """Письмо, уже сериализованное для SMTP DATA (см. MessageTemplate.render); отправляется без сборки."""
+
+    data: bytes                                        # концы строк CRLF, точки в начале строк удвоены, в конце CRLF
+    rcpts: list[str]                                   # фактические адресаты SMTP (включая Bcc)
+
+
+def _iter_base64(source: AttachmentContent, start: int = 0) -> Iterator[bytes]:
+    """Содержимое файла в base64 строками по 76 символов с CRLF, блоками по _B64_BLOCK."""
+    def encode(block) -> bytes:
+        return base64.encodebytes(block).replace(b"\n", b"\r\n")
+
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return
+            # mmap: блоки кодируются прямо из страниц файла, без промежуточных копий read()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for offset in range(0, size, _B64_BLOCK):
+                    with view[offset:offset + _B64_BLOCK] as block:
+                        yield encode(block)
+        return
+
+    if start is not None:
+        source.seek(start)                                 # повторная отправка (после обрыва) — с того же места
+    rest = b""
+    while chunk := source.read(_B64_BLOCK):
+        data = rest + chunk
+        usable = len(data) - len(data) % 57                # короткое чтение: кодируем только целые строки
+        rest = data[usable:]
+        if usable:
+            yield encode(data[:usable])
+    if rest:
+        yield encode(rest)
+
+
+def _smtp_chunks(msg: EmailMessage) -> Iterator[bytes]:
+    """Письмо для SMTP DATA кусками (см. _smtp_data); вложения из файлов — потоком."""
+    if isinstance(msg, PreparedMessage):
+        yield msg.data
+        return
+    data = _smtp_data(msg)
+    if not isinstance(msg, StreamingEmailMessage):
+        yield data
+        return
+    for marker, (source, start) in msg.sources.items():
+        before, data = data.split(marker.encode() + b"\r\n", 1)
+        yield before
+        yield from _iter_base64(source, start)             # в base64 нет ".", удваивать точки не нужно
+    yield data
+
+
+def build_message(
+    from_addr: str,                         # адрес отправителя (заголовок From)
+    recipients: Sequence[str],              # список получателей (To)
+    subject: str,                           # тема письма
+    body: str,                              # текст письма (plain text)
+    *,
+    cc: Sequence[str] | None = None,        # получатели в копии (Cc)
+    bcc: Sequence[str] | None = None,       # получатели в скрытой копии (Bcc) — не попадают в заголовок письма
+    attachments: Iterable[Tuple[str, AttachmentContent, str]] | None = None,  # вложения: (имя файла, байты/путь/файл, MIME-тип)
+) -> Tuple[EmailMessage, list[str]]:
+    """Собрать письмо и список фактических SMTP-адресатов (аргументы как у send_email).
+
+    Если содержимое вложения — путь или открытый двоичный файл, возвращается
+    StreamingEmailMessage: файл читается только при отправке, блоками.
+    """
+    cc = cc or []                           # нормализуем None -> [] для единообразной обработки
+    bcc = bcc or []
+    attachments = list(attachments or [])
+
+    streaming = any(not isinstance(content, (bytes, bytearray)) for _, content, _ in attachments)
+    msg = StreamingEmailMessage() if streaming else EmailMessage()  # создаём объект письма
+    msg["From"] = from_addr                 # заголовок From
+    msg["To"] = ", ".join(recipients)       # заголовок To — строка с адресами через запятую
+    if cc:
+        msg["Cc"] = ", ".join(cc)           # заголовок Cc добавляем только если список непустой
+    msg["Subject"] = subject                # тема письма
+    msg.set_content(body)                   # тело письма как text/plain
+
+    for filename, content, mime_type in attachments:   # перебираем вложения
+        maintype, subtype = mime_type.split("/", 1)    # делим MIME-тип на основную и подтип (например, "text/plain")
+        streamed = not isinstance(content, (bytes, bytearray))
+        msg.add_attachment(
+            b"" if streamed else content,              # байтовое содержимое файла (для файлов — подставится при отправке)
+            maintype=maintype,                         # основная часть MIME-типа
+            subtype=subtype,                           # подтип MIME
+            filename=filename,                         # имя файла, которое увидит получатель
+        )
+        if streamed:
+            marker = f"=_attachment_{uuid.uuid4().hex}"
+            msg.get_payload()[-1].set_payload(marker + "\n")  # Content-Transfer-Encoding: base64 уже выставлен
+            start = content.tell() if not isinstance(content, (str, os.PathLike)) and content.seekable() else None
+            msg.sources[marker] = (content, start)
+
+    all_rcpts = list(recipients) + list(cc) + list(bcc)  # фактические адресаты SMTP (Bcc здесь обязателен, в заголовок не добавляется)
+    return msg, all_rcpts
+
+
+def _smtp_data(msg: EmailMessage) -> bytes:
+    """Письмо в виде, готовом для SMTP DATA: концы строк CRLF, точки в начале строк удвоены."""
+    data = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+    data = re.sub(rb"\r\n|\r|\n", b"\r\n", data)      # одинокие \n и \r → CRLF
+    data = re.sub(rb"(?m)^\.", b"..", data)              # "dot-stuffing" (RFC 5321, 4.5.2)
+    if not data.endswith(b"\r\n"):
+        data += b"\r\n"
+    return data
+
+
+class MessageTemplate:
+    """Шаблон письма для массовой рассылки: тело и общие вложения кодируются один раз.
+
+    При создании письмо собирается build_message и сериализуется для SMTP DATA
+    (set_content, base64 вложений, dot-stuffing); From и Subject кодируются
+    тогда же. render() лишь дописывает к готовым байтам заголовки адресатов —
+    варианты письма для тысяч получателей почти ничего не стоят. Вложения из
+    файлов читаются в шаблон один раз (в памяти — в закодированном виде).
+    """
+
+    def __init__(
+        self,
+        from_addr: str,
+        subject: str,
+        body: str,
+        *,
+        attachments: Iterable[Tuple[str, AttachmentContent, str]] | None = None,
+    ) -> None:
+        attachments = [(name, self._read(content), mime_type) for name, content, mime_type in attachments or []]
+        skeleton, _ = build_message(from_addr, [], subject, body, attachments=attachments)
+        self._policy = skeleton.policy.clone(linesep="\r\n")
+        self.from_addr = from_addr
+        self.subject = subject
+        self._from = self._header("From", from_addr)
+        self._subject = self._header("Subject", subject)
+        for name in ("From", "To", "Subject"):
+            del skeleton[name]
+        self._mime = _smtp_data(skeleton)                  # заголовки MIME, пустая строка и тело — неизменная часть
+
+    @staticmethod
+    def _read(content: AttachmentContent) -> bytes:
+        if isinstance(content, (bytes, bytearray)):
+            return bytes(content)
+        if isinstance(content, (str, os.PathLike)):
+            with open(content, "rb") as f:
+                return f.read()
+        return content.read()
+
+    def _header(self, name: str, value: str) -> bytes:
+        """Строка заголовка для DATA: ASCII без переносов — как есть, иначе через policy (RFC 2047, перенос строк)."""
+        if value.isascii() and len(name) + len(value) < 76 and "\n" not in value and "\r" not in value:
+            return f"{name}: {value}\r\n".encode()
+        return self._policy.header_factory(name, value).fold(policy=self._policy).encode("ascii")
+
+    def render(
+        self,
+        recipients: Sequence[str],
+        *,
+        cc: Sequence[str] | None = None,
+        bcc: Sequence[str] | None = None,               # в заголовки не попадают
+        subject: Optional[str] = None,                  # своя тема для этого варианта
+        headers: Mapping[str, str] | None = None,       # дополнительные заголовки (List-Unsubscribe и т.п.)
+    ) -> PreparedMessage:
+        """Вариант письма для конкретных адресатов (заголовки To/Cc и прочие — свои)."""
+        lines = [self._from, self._header("To", ", ".join(recipients))]
+        if cc:
+            lines.append(self._header("Cc", ", ".join(cc)))
+        lines.append(self._subject if subject is None else self._header("Subject", subject))
+        for name, value in (headers or {}).items():
+            lines.append(self._header(name, value))
+        lines.append(self._mime)
+        return PreparedMessage(b"".join(lines), list(recipients) + list(cc or []) + list(bcc or []))
+
+
+def _pipelined_send(
+    conn: smtplib.SMTP, from_addr: str, rcpts: Sequence[str], data: Union[bytes, Iterable[bytes]],
+) -> dict:
+    """Отправить одно письмо с ESMTP PIPELINING (RFC 2920).
+
+    MAIL FROM, все RCPT TO и DATA уходят одной записью в сокет, ответы читаются
+    после: два обмена с сервером на письмо вместо 3 + числа адресатов у smtplib.
+    Ошибки — те же исключения smtplib, что и у send_message; возвращает словарь
+    отклонённых адресатов при частичном успехе.
+    """
+    commands = [f"MAIL FROM:<{from_addr}>"] + [f"RCPT TO:<{r}>" for r in rcpts] + ["DATA"]
+    conn.send("".join(c + "\r\n" for c in commands))
+
+    mail_code, mail_resp = conn.getreply()
+    refused = {}
+    for rcpt in rcpts:
+        code, resp = conn.getreply()
+        if code not in (250, 251):
+            refused[rcpt] = (code, resp)
+    data_code, data_resp = conn.getreply()
+
+    failed = None
+    if mail_code != 250:
+        failed = smtplib.SMTPSenderRefused(mail_code, mail_resp, from_addr)
+    elif len(refused) == len(rcpts):
+        failed = smtplib.SMTPRecipientsRefused(refused)
+    elif data_code != 354:
+        failed = smtplib.SMTPDataError(data_code, data_resp)
+    if failed is not None:
+        if data_code == 354:
+            # Сервер всё же ждёт тело — завершаем пустым, чтобы сессия осталась в порядке
+            conn.send(b".\r\n")
+            conn.getreply()
+        conn.rset()
+        raise failed
+
+    _send_data(conn, data)
+    return refused
+
+
+def _send_data(conn: smtplib.SMTP, data: Union[bytes, Iterable[bytes]]) -> None:
+    """Тело письма после ответа 354 (целиком или кусками) и завершающая точка."""
+    if isinstance(data, bytes):
+        conn.send(data + b".\r\n")
+    else:
+        for chunk in data:
+            conn.send(chunk)
+        conn.send(b".\r\n")
+    code, resp = conn.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+
+
+def _send_chunks(conn: smtplib.SMTP, from_addr: str, rcpts: Sequence[str], data: Iterable[bytes]) -> dict:
+    """Как smtplib.SMTP.sendmail (без PIPELINING), но тело письма уходит кусками из data."""
+    code, resp = conn.mail(from_addr)
+    if code != 250:
+        conn.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {}
+    for rcpt in rcpts:
+        code, resp = conn.rcpt(rcpt)
+        if code not in (250, 251):
+            refused[rcpt] = (code, resp)
+    if len(refused) == len(rcpts):
+        conn.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    conn.putcmd("data")
+    code, resp = conn.getreply()
+    if code != 354:
+        conn.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    _send_data(conn, data)
+    return refused
+
+
+def _deliver(
+    conn: smtplib.SMTP, from_addr: str, msg: Union[EmailMessage, PreparedMessage], rcpts: Sequence[str],
+) -> dict:
+    """Отправить письмо по открытой сессии; вернуть отклонённых адресатов (частичный успех).
+
+    PIPELINING — если сервер его объявляет; письмо с вложениями из файлов и
+    готовое PreparedMessage отправляются кусками и без него. Остальное — обычным send_message.
+    """
+    if conn.has_extn("pipelining"):
+        return _pipelined_send(conn, from_addr, rcpts, _smtp_chunks(msg))
+    if isinstance(msg, (StreamingEmailMessage, PreparedMessage)):
+        return _send_chunks(conn, from_addr, rcpts, _smtp_chunks(msg))
+    return conn.send_message(msg, from_addr=from_addr, to_addrs=rcpts)
+
+
+# Лексемы ответа IMAP: скобки, строки в кавычках и атомы (в т.ч. "BODY[HEADER.FIELDS (FROM)]<0>")
+_IMAP_TOKEN = re.compile(
+    rb'\s*(?:(?P<open>\()|(?P<close>\))|"(?P<quoted>(?:[^"\\]|\\.)*)"'
+    rb'|(?P<atom>[^\s()"\[\]]+(?:\[[^\]]*\](?:<\d+>)?)?))'
+)
+_LITERAL_MARK = re.compile(rb"\{\d+\}$")              # "{N}" в конце строки перед литералом
+
+
+def _parse_imap_list(pieces: Sequence[tuple[str, bytes]]) -> list:
+    """Собрать вложенные списки из кусков ответа: ("text", строка) и ("literal", байты).
+
+    Атомы и строки остаются bytes, NIL становится None, литералы подставляются как есть.
+    """
+    stack: list[list] = [[]]
+    for kind, chunk in pieces:
+        if kind == "literal":
+            stack[-1].append(chunk)
+            continue
+        pos = 0
+        while True:
+            m = _IMAP_TOKEN.match(chunk, pos)
+            if not m:
+                break
+            pos = m.end()
+            if m.group("open"):
+                stack.append([])
+            elif m.group("close"):
+                if len(stack) > 1:
+                    done = stack.pop()
+                    stack[-1].append(done)
+            elif m.group("quoted") is not None:
+                stack[-1].append(re.sub(rb"\\(.)", rb"\1", m.group("quoted")))
+            else:
+                atom = m.group("atom")
+                stack[-1].append(None if atom.upper() == b"NIL" else atom)
+    return stack[0]
+
+
+def _parse_fetch(data: Sequence) -> list[dict]:
+    """Разобрать ответ imaplib на (UID) FETCH в список словарей по порядку писем.
+
+    Ключи: uid, flags (кортеж строк), modseq (CONDSTORE, иначе None), body —
+    содержимое BODY[] / RFC822, если оно запрашивалось, и items — все элементы
+    ответа по именам ("BODYSTRUCTURE", "BODY[1]", ...). imaplib отдаёт каждое
+    письмо как кортежи (строка до литерала, литерал) и строки-"хвосты" после
+    литерала; письма без литералов — просто строками.
+    """
+    responses = []
+    for part in data or []:
+        if part is None:
+            continue
+        meta, literal = part if isinstance(part, tuple) else (part, None)
+        if re.match(rb"\d+ \(", meta):
+            responses.append([])                           # начало ответа по новому письму: "<seq> (..."
+        elif not responses:
+            continue
+        if literal is None:
+            responses[-1].append(("text", meta))
+        else:
+            responses[-1].append(("text", _LITERAL_MARK.sub(b"", meta)))
+            responses[-1].append(("literal", literal))
+
+    messages = []
+    for pieces in responses:
+        parsed = _parse_imap_list(pieces)
+        pairs = parsed[1] if len(parsed) > 1 and isinstance(parsed[1], list) else []
+        items = {
+            pairs[i].decode().upper(): pairs[i + 1]
+            for i in range(0, len(pairs) - 1, 2) if isinstance(pairs[i], bytes)
+        }
+        modseq = items.get("MODSEQ")
+        messages.append({
+            "uid": int(items["UID"]) if items.get("UID") else None,
+            "flags": tuple(f.decode() for f in items.get("FLAGS") or ()),
+            "modseq": int(modseq[0]) if modseq else None,
+            "body": items.get("BODY[]", items.get("RFC822")),
+            "items": items,
+        })
+    return messages
+
+
+_SEARCH_WINDOW = 1000          # первое окно UID при поиске последнего письма без ESEARCH
+_SEARCH_CACHE_SIZE = 256       # сколько результатов поиска (папка, критерии) помнит клиент
+# Критерии, результат которых зависит от флагов; совпадение внутри строки темы лишь отключает кэш
+_FLAG_CRITERIA = re.compile(r"\b(?:UN)?(?:SEEN|ANSWERED|FLAGGED|DELETED|DRAFT|KEYWORD)\b|\b(?:NEW|OLD|RECENT)\b", re.I)
+
+
+def _uid_set(uids: Iterable[int]) -> str:
+    """Набор UID для команды IMAP: [1, 2, 3, 7, 9, 10] → "1:3,7,9:10"."""
+    ranges: list[list[int]] = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+
+@dataclass
+class MessagePart:
+    """Часть письма по BODYSTRUCTURE (без содержимого)."""
+
+    section: str                                       # номер части для BODY[...]: "1", "2.1", ...
+    content_type: str                                  # MIME-тип в нижнем регистре, например "text/plain"
+    params: dict = field(default_factory=dict)         # параметры Content-Type (charset, name, ...)
+    encoding: str = "7bit"                             # Content-Transfer-Encoding
+    size: int = 0                                      # размер в закодированном виде, байт
+    disposition: Optional[str] = None                  # "attachment" / "inline" / None
+    filename: Optional[str] = None                     # имя файла вложения (если есть)
+
+    @property
+    def is_attachment(self) -> bool:
+        return self.disposition == "attachment" or (self.filename is not None and self.disposition != "inline")
+
+
+def _decode_words(value: Any) -> str:
+    """Значение заголовка с "encoded words" RFC 2047 ("=?utf-8?...") → обычная строка."""
+    if value is None:
+        return ""
+    try:
+        return str(email.header.make_header(email.header.decode_header(str(value))))
+    except (ValueError, LookupError, UnicodeError):   # битая кодировка — оставляем как есть
+        return str(value)
+
+
+def _imap_text(value: Any) -> str:
+    return value.decode(errors="replace") if isinstance(value, bytes) else ""
+
+
+def _imap_params(value: Any) -> dict:
+    """Список ("ключ" "значение" ...) из BODYSTRUCTURE → словарь с ключами в нижнем регистре."""
+    if not isinstance(value, list):
+        return {}
+    return {_imap_text(value[i]).lower(): _imap_text(value[i + 1]) for i in range(0, len(value) - 1, 2)}
+
+
+def _is_multipart(node: list) -> bool:
+    """Разобранный BODYSTRUCTURE описывает multipart: (часть)(часть)... "subtype" ..."""
+    return bool(node) and isinstance(node[0], list)
+
+
+def _body_parts(node: list, section: str = "") -> list[MessagePart]:
+    """Листовые части письма из разобранного BODYSTRUCTURE (RFC 3501, 7.4.2) в порядке обхода."""
+    if _is_multipart(node):
+        parts = []
+        for i, child in enumerate(node, 1):
+            if not isinstance(child, list):
+                break
+            parts.extend(_body_parts(child, f"{section}.{i}" if section else str(i)))
+        return parts
+
+    content_type = f"{_imap_text(node[0])}/{_imap_text(node[1])}".lower()
+    params = _imap_params(node[2])
+    # Расширенные поля идут после базовых: у text/* есть число строк, у message/rfc822 — ещё конверт и тело
+    md5_index = 8 if content_type.startswith("text/") else 10 if content_type == "message/rfc822" else 7
+    disposition = node[md5_index + 1] if len(node) > md5_index + 1 else None
+    disposition = disposition if isinstance(disposition, list) and disposition else None
+    filename = _imap_params(disposition[1]).get("filename") if disposition and len(disposition) > 1 else None
+    filename = filename or params.get("name")
+    if filename:
+        filename = _decode_words(filename)             # RFC 2047 "=?utf-8?..."
+    return [MessagePart(
+        section=section or "1",                            # у не-multipart письма единственная часть — BODY[1]
+        content_type=content_type,
+        params=params,
+        encoding=_imap_text(node[5]).lower() or "7bit",
+        size=int(node[6] or 0),
+        disposition=_imap_text(disposition[0]).lower() if disposition else None,
+        filename=filename,
+    )]
+
+
+def _decode_part(raw: bytes, encoding: str) -> bytes:
+    """Снять Content-Transfer-Encoding с содержимого части."""
+    if encoding == "base64":
+        return base64.b64decode(raw)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(raw)
+    return raw
+
+
+@functools.lru_cache(maxsize=256)
+def _codec_name(charset: Optional[str]) -> str:
+    """Имя кодека для charset письма; неизвестная кодировка — utf-8."""
+    try:
+        return codecs.lookup(charset or "utf-8").name
+    except LookupError:
+        return "utf-8"
+
+
+@functools.lru_cache(maxsize=1024)
+def _content_info(header: str) -> tuple[str, Optional[str]]:
+    """(MIME-тип, charset) по значению Content-Type; у писем одного отправителя оно повторяется."""
+    probe = email.message.Message()
+    probe["Content-Type"] = header
+    return probe.get_content_type(), probe.get_content_charset()
+
+
+def _plain_parts(msg: email.message.Message) -> Iterator[tuple[email.message.Message, Optional[str]]]:
+    """(часть, charset) для частей, которые extract_text считает текстом письма."""
+    if not msg.is_multipart():                             # односоставное письмо — текст при любом типе
+        header = msg.get("Content-Type")
+        yield msg, _content_info(str(header))[1] if header is not None else msg.get_content_charset()
+        return
+    for part in msg.walk():
+        if part.is_multipart() or "attachment" in part.get("Content-Disposition", ""):
+            continue                                       # контейнеры и вложения не разбираем вовсе
+        header = part.get("Content-Type")
+        if header is None:                                 # тип по умолчанию зависит от родителя (multipart/digest)
+            ctype, charset = part.get_content_type(), part.get_content_charset()
+        else:
+            ctype, charset = _content_info(str(header))
+        if ctype == "text/plain":
+            yield part, charset
+
+
+def _payload_prefix(part: email.message.Message, size: int) -> Optional[bytes]:
+    """Не меньше size первых байт содержимого base64 / quoted-printable части; None — часть короче или кодировка иная."""
+    cte = str(part.get("Content-Transfer-Encoding", "")).strip().lower()
+    if cte not in ("base64", "quoted-printable"):
+        return None
+    payload = part.get_payload()
+    if not isinstance(payload, str):
+        return None
+    try:
+        if cte == "base64":
+            raw = payload[:(size // 3 + 1) * 4 * 80 // 76 + 80]  # с запасом на переводы строк
+            if len(raw) >= len(payload):
+                return None
+            data = "".join(raw.split())
+            return binascii.a2b_base64(data[:len(data) - len(data) % 4])
+        if cte == "quoted-printable":
+            raw = payload[:size * 3 + 80]
+            end = raw.rfind("\n") + 1                      # "=XX" и мягкий перенос не разрываем
+            if len(raw) >= len(payload) or not end:
+                return None
+            return quopri.decodestring(raw[:end].encode("ascii", "surrogateescape"))
+    except (binascii.Error, UnicodeError):                # необычное содержимое — декодируем часть целиком
+        return None
+    return None
+
+
+def _decode_text(
+    part: email.message.Message, charset: Optional[str], limit: Optional[int],
+) -> tuple[Optional[str], bool]:
+    """(текст части, обрезан ли он); при limit декодируется только начало части длиной больше limit."""
+    codec = _codec_name(charset)
+    need = limit + 8 if limit is not None else None    # запас: последний символ обрезанного начала может быть битым
+    if need is not None:
+        prefix = _payload_prefix(part, need * 4)           # до 4 байт на символ
+        if prefix is not None and len(text := prefix.decode(codec, errors="replace")) >= need:
+            return text, True
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return None, False
+    if need is not None and len(payload) > need * 4:       # 7bit/8bit: перекодируем в str только начало
+        if len(text := payload[:need * 4].decode(codec, errors="replace")) >= need:
+            return text, True
+    return payload.decode(codec, errors="replace"), False
+
+
+HEADER_FIELDS = ("From", "To", "Cc", "Subject", "Date", "Message-ID")  # заголовки для частичной загрузки
+
+
+class LazyMessage:
+    """Письмо, загруженное частично: заголовки сразу, остальные части — при обращении.
+
+    Поддерживает чтение заголовков как email.message.Message (get, [], in).
+    Структура (parts), текст (text) и содержимое частей (part_bytes) скачиваются
+    с сервера при первом обращении через BODY.PEEK[...] и запоминаются; message —
+    письмо целиком (через fetch_uid, то есть с учётом локального кэша).
+    """
+
+    def __init__(
+        self,
+        client: "MailClient",
+        mailbox: str,
+        uid: int,
+        headers: bytes,
+        parts: Optional[list[MessagePart]] = None,
+        multipart: bool = True,                            # parts получены из multipart-BODYSTRUCTURE
+    ) -> None:
+        self._client = client
+        self.mailbox = mailbox
+        self.uid = uid
+        self.headers = email.message_from_bytes(headers)
+        self._parts = parts
+        self._multipart = multipart
+        self._loaded: dict[str, bytes] = {}                # section -> содержимое в закодированном виде
+        self._message: Optional[email.message.Message] = None
+
+    def __repr__(self) -> str:
+        return f"<LazyMessage {self.mailbox!r} uid={self.uid} subject={self.get('Subject')!r}>"
+
+    def get(self, name: str, failobj: Any = None) -> Any:
+        return self.headers.get(name, failobj)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.headers[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.headers
+
+    @property
+    def parts(self) -> list[MessagePart]:
+        """Листовые части письма по BODYSTRUCTURE."""
+        if self._parts is None:
+            structure = self._client._fetch_items(self.mailbox, self.uid, "BODYSTRUCTURE").get("BODYSTRUCTURE") or []
+            self._parts, self._multipart = _body_parts(structure), _is_multipart(structure)
+        return self._parts
+
+    @property
+    def text_parts(self) -> list[MessagePart]:
+        """Части, которые extract_text считает текстом: у односоставного письма — единственная при любом типе."""
+        parts = self.parts
+        if not self._multipart:                            # то же правило, что в _plain_parts
+            return parts
+        return [p for p in parts if p.content_type == "text/plain" and not p.is_attachment]
+
+    @property
+    def attachments(self) -> list[MessagePart]:
+        return [p for p in self.parts if p.is_attachment]
+
+    def load(self, sections: Iterable[str], imap: Optional[imaplib.IMAP4] = None) -> None:
+        """Скачать недостающие части одним запросом (imap — уже открытая сессия с выбранной папкой)."""
+        missing = [s for s in sections if s not in self._loaded]
+        if missing:
+            request = " ".join(f"BODY.PEEK[{s}]" for s in missing)
+            if imap is not None:
+                items = self._client._uid_fetch_items(imap, self.uid, request)
+            else:
+                items = self._client._fetch_items(self.mailbox, self.uid, request)
+            self._fill(missing, items)
+
+    def _fill(self, sections: Iterable[str], items: Mapping) -> None:
+        """Запомнить части из элементов ответа FETCH ("BODY[1]" -> содержимое)."""
+        for s in sections:
+            self._loaded[s] = items.get(f"BODY[{s}]") or b""
+
+    def part_bytes(self, part: Union[MessagePart, str]) -> bytes:
+        """Содержимое части (по MessagePart или номеру section) без Content-Transfer-Encoding."""
+        if isinstance(part, str):
+            part = next(p for p in self.parts if p.section == part)
+        self.load([part.section])
+        return _decode_part(self._loaded[part.section], part.encoding)
+
+    @property
+    def text(self) -> str:
+        """Текстовые части (text/plain без вложений; у односоставного письма — любая) — как MailClient.extract_text."""
+        return self._text(self.text_parts)
+
+    def _text(self, text_parts: list[MessagePart]) -> str:
+        self.load(p.section for p in text_parts)
+        chunks = [self.part_bytes(p).decode(_codec_name(p.params.get("charset")), errors="replace")
+                  for p in text_parts]                     # неизвестная кодировка — utf-8
+        return "\n".join(chunks).strip()
+
+    @property
+    def message(self) -> Optional[email.message.Message]:
+        """Письмо целиком (скачивается один раз)."""
+        if self._message is None:
+            self._message = self._client.fetch_uid(self.uid, self.mailbox)
+        return self._message
 
 
 @dataclass
@@ -23,70 +931,447 @@ class MailClient:
     imap_port: int = 993                        # порт IMAP (993 — IMAPS/SSL)
     smtp_use_tls: bool = True                   # использовать ли STARTTLS при отправке
     timeout: int = 60                           # таймаут сетевых операций в секундах
+    smtp_pool_size: int = 0                     # >0 — держать до стольких SMTP-сессий открытыми между отправками
+    imap_use_ssl: bool = True                   # IMAPS (993); False — обычный IMAP без шифрования (локальные/тестовые серверы)
+    imap_pool_size: int = 0                     # >0 — держать до стольких IMAP-сессий залогиненными между вызовами
+    cache_path: Optional[str] = None            # файл SQLite-кэша писем (":memory:" — в памяти); None — без кэша
+    index_path: Optional[str] = None            # файл полнотекстового индекса (можно общий для нескольких аккаунтов)
+    queue_path: Optional[str] = None            # файл очереди исходящих писем (можно общий для нескольких процессов)
+
+    # служебное поле: пул создаётся лениво при первой отправке; в __init__/__repr__/__eq__ не участвует
+    _smtp_pool: Optional[SmtpConnectionPool] = field(default=None, init=False, repr=False, compare=False)
+    _imap_pool: Optional[ImapSessionPool] = field(default=None, init=False, repr=False, compare=False)
+    _cache: Optional[MessageCache] = field(default=None, init=False, repr=False, compare=False)
+    _index: Optional[MailIndex] = field(default=None, init=False, repr=False, compare=False)
+    # (папка, критерии) -> (отпечаток папки, наибольший UID), см. _latest_uid
+    _search_cache: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+    _queue: Optional[MailQueue] = field(default=None, init=False, repr=False, compare=False)
+    # фоновые отправители очереди, их собственный пул (если у клиента пула нет) и события остановки/пробуждения
+    _queue_workers: list = field(default_factory=list, init=False, repr=False, compare=False)
+    _queue_pool: Optional[SmtpConnectionPool] = field(default=None, init=False, repr=False, compare=False)
+    _queue_stop: threading.Event = field(default_factory=threading.Event, init=False, repr=False, compare=False)
+    _queue_wakeup: threading.Event = field(default_factory=threading.Event, init=False, repr=False, compare=False)
+
+    # ---------- Жизненный цикл ----------
+    def close(self) -> None:
+        """Закрыть соединения, которые клиент держит открытыми (фоновые отправители, пулы, файлы кэша, индекса и очереди)."""
+        self.stop_queue_workers()
+        if self._smtp_pool is not None:
+            self._smtp_pool.close()
+        if self._imap_pool is not None:
+            self._imap_pool.close()
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        if self._queue is not None:
+            self._queue.close()
+            self._queue = None
+
+    def __enter__(self) -> "MailClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
     # ---------- SMTP ----------
+    def _smtp_connect(self) -> smtplib.SMTP:
+        """Открыть SMTP-сессию: EHLO, (STARTTLS, EHLO), login."""
+        s = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        try:
+            s.ehlo()                                       # приветствуем сервер и объявляем себя (идентификация клиента)
+            if self.smtp_use_tls:
+                s.starttls()                               # переключаемся на защищённый канал (STARTTLS)
+                s.ehlo()                                   # повторная идентификация после установки TLS
+            s.login(self.username, self.password)          # аутентификация на SMTP-сервере
+        except BaseException:
+            s.close()                                      # не оставляем полуоткрытый сокет
+            raise
+        return s
+
+    @property
+    def smtp_pool(self) -> Optional[SmtpConnectionPool]:
+        """Пул SMTP-сессий (None, если smtp_pool_size == 0)."""
+        if self._smtp_pool is None and self.smtp_pool_size > 0:
+            self._smtp_pool = SmtpConnectionPool(self._smtp_connect, self.smtp_pool_size)
+        return self._smtp_pool
+
+    def _send_message(
+        self,
+        msg: Union[EmailMessage, PreparedMessage],
+        rcpts: Sequence[str],
+        *,
+        pool: Optional[SmtpConnectionPool] = None,     # другой пул вместо пула клиента (фоновые отправители очереди)
+    ) -> dict:
+        """Отправить готовое письмо: через пул или по отдельному соединению; вернуть отклонённых адресатов."""
+        pool = pool or self.smtp_pool
+        if pool is None:
+            # Создаём SMTP-соединение только на это письмо; контекстный менеджер гарантирует закрытие
+            with self._smtp_connect() as s:
+                # явным образом передаём список адресатов (включая Bcc); From/To — из заголовков msg
+                return _deliver(s, self.username, msg, rcpts)
+        try:
+            with pool.connection() as s:
+                return _deliver(s, self.username, msg, rcpts)
+        except Exception as exc:
+            if not _is_connection_lost(exc):
+                raise
+            # Сервер закрыл сессию между проверкой и отправкой — одна повторная попытка на новом соединении
+            with pool.connection() as s:
+                return _deliver(s, self.username, msg, rcpts)
+
+    def build_message(
+        self,
+        recipients: Sequence[str],
+        subject: str,
+        body: str,
+        *,
+        cc: Sequence[str] | None = None,
+        bcc: Sequence[str] | None = None,
+        attachments: Iterable[Tuple[str, AttachmentContent, str]] | None = None,
+    ) -> Tuple[EmailMessage, list[str]]:
+        """Собрать письмо от имени self.username (см. функцию build_message)."""
+        return build_message(
+            self.username, recipients, subject, body, cc=cc, bcc=bcc, attachments=attachments,
+        )
+
     def send_email(
         self,
-        recipients: Sequence[str],              # список получателей (To)
-        subject: str,                           # тема письма
-        body: str,                              # текст письма (plain text)
+        recipients: Sequence[str],
+        subject: str,
+        body: str,
         *,
-        cc: Sequence[str] | None = None,        # получатели в копии (Cc)
-        bcc: Sequence[str] | None = None,       # получатели в скрытой копии (Bcc) — не попадают в заголовок письма
-        attachments: Iterable[Tuple[str, bytes, str]] | None = None,  # вложения: (имя файла, содержимое байтами, MIME-тип)
+        cc: Sequence[str] | None = None,
+        bcc: Sequence[str] | None = None,
+        attachments: Iterable[Tuple[str, AttachmentContent, str]] | None = None,
     ) -> None:
         """Отправить письмо.
 
-        attachments: итерируемый набор кортежей (filename, content_bytes, mime_type)
-                     например: [("readme.txt", b"...", "text/plain")]
+        attachments: итерируемый набор кортежей (filename, content, mime_type)
+                     например: [("readme.txt", b"...", "text/plain")];
+                     content — байты, путь к файлу или открытый двоичный файл
+                     (файлы читаются и кодируются блоками прямо при отправке)
         """
-        cc = cc or []                           # нормализуем None -> [] для единообразной обработки
-        bcc = bcc or []
-        attachments = attachments or []
+        msg, all_rcpts = self.build_message(
+            recipients, subject, body, cc=cc, bcc=bcc, attachments=attachments,
+        )
+        self._send_message(msg, all_rcpts)                 # при smtp_pool_size > 0 сессия берётся из пула
 
-        msg = EmailMessage()                    # создаём объект письма
-        msg["From"] = self.username             # заголовок From
-        msg["To"] = ", ".join(recipients)       # заголовок To — строка с адресами через запятую
-        if cc:
-            msg["Cc"] = ", ".join(cc)           # заголовок Cc добавляем только если список непустой
-        msg["Subject"] = subject                # тема письма
-        msg.set_content(body)                   # тело письма как text/plain
-
-        for filename, content, mime_type in attachments:   # перебираем вложения
-            maintype, subtype = mime_type.split("/", 1)    # делим MIME-тип на основную и подтип (например, "text/plain")
-            msg.add_attachment(
-                content,                                   # байтовое содержимое файла
-                maintype=maintype,                         # основная часть MIME-типа
-                subtype=subtype,                           # подтип MIME
-                filename=filename,                         # имя файла, которое увидит получатель
-            )
+    def template(
+        self,
+        subject: str,
+        body: str,
+        *,
+        attachments: Iterable[Tuple[str, AttachmentContent, str]] | None = None,
+    ) -> MessageTemplate:
+        """Шаблон письма от имени self.username для рассылки (см. MessageTemplate)."""
+        return MessageTemplate(self.username, subject, body, attachments=attachments)
 
-        all_rcpts = list(recipients) + list(cc) + list(bcc)  # фактические адресаты SMTP (Bcc здесь обязателен, в заголовок не добавляется)
+    def send_template(
+        self,
+        template: MessageTemplate,
+        recipients: Sequence[str],
+        *,
+        cc: Sequence[str] | None = None,
+        bcc: Sequence[str] | None = None,
+        headers: Mapping[str, str] | None = None,
+    ) -> None:
+        """Отправить вариант шаблона этим адресатам (аргументы как у MessageTemplate.render)."""
+        prepared = template.render(recipients, cc=cc, bcc=bcc, headers=headers)
+        self._send_message(prepared, prepared.rcpts)
 
-        # Создаём SMTP-соединение с таймаутом; контекстный менеджер гарантирует закрытие соединения
-        with smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout) as s:
-            s.ehlo()                                       # приветствуем сервер и объявляем себя (идентификация клиента)
-            if self.smtp_use_tls:
-                s.starttls()                               # переключаемся на защищённый канал (STARTTLS)
-                s.ehlo()                                   # повторная идентификация после установки TLS
-            s.login(self.username, self.password)          # аутентификация на SMTP-сервере
-            # send_message сам подставит From/To из msg, но мы явным образом передаём список адресатов (включая Bcc)
-            s.send_message(msg, from_addr=self.username, to_addrs=all_rcpts)
+    def _prepare_outgoing(
+        self, item: Union[EmailMessage, PreparedMessage, Mapping[str, Any]],
+    ) -> Tuple[Union[EmailMessage, PreparedMessage], list[str]]:
+        """Привести элемент send_many к паре (письмо, адресаты SMTP)."""
+        if isinstance(item, PreparedMessage):              # вариант шаблона — уже готов к отправке
+            return item, item.rcpts
+        if isinstance(item, EmailMessage):
+            # Готовое письмо: адресаты берутся из заголовков, Bcc из копии письма удаляется
+            headers = item.get_all("To", []) + item.get_all("Cc", []) + item.get_all("Bcc", [])
+            rcpts = [addr for _, addr in getaddresses(headers)]
+            if "Bcc" in item:
+                item = email.message_from_bytes(item.as_bytes(), _class=EmailMessage, policy=item.policy)
+                del item["Bcc"]
+            if "From" not in item:
+                item["From"] = self.username
+            return item, rcpts
+        return self.build_message(**item)                  # словарь с аргументами send_email
+
+    def send_many(
+        self,
+        messages: Iterable[Union[EmailMessage, PreparedMessage, Mapping[str, Any]]],  # письма, варианты шаблона или словари аргументов send_email
+        *,
+        concurrency: int = 1,                              # сколько SMTP-сессий использовать параллельно
+    ) -> list[SendResult]:
+        """Отправить пачку писем по нескольким долгоживущим SMTP-сессиям.
+
+        Письма раздаются concurrency потокам, у каждого — своя сессия на всё время
+        пачки (из пула клиента, если он включён, иначе из временного пула). Если
+        сервер объявляет PIPELINING, конверт письма отправляется одной записью
+        (см. _pipelined_send, _deliver), иначе — обычным send_message. Ошибка одного письма
+        не останавливает пачку: для каждого письма возвращается SendResult в порядке
+        входа. При обрыве сессии письмо один раз повторяется на новом соединении.
+        """
+        pool = self.smtp_pool
+        own_pool = pool is None
+        if own_pool:
+            pool = SmtpConnectionPool(self._smtp_connect, concurrency)
+        else:
+            concurrency = min(concurrency, self.smtp_pool_size)  # больше сессий, чем в пуле, всё равно не получить
+
+        items = iter(enumerate(messages))
+        items_lock = threading.Lock()
+        results: dict[int, SendResult] = {}
+
+        def next_item():
+            with items_lock:
+                return next(items, None)
+
+        def worker() -> None:
+            conn = None
+            try:
+                while (entry := next_item()) is not None:
+                    index, item = entry
+                    try:
+                        msg, rcpts = self._prepare_outgoing(item)
+                        for attempt in (1, 2):
+                            if conn is None:
+                                conn = pool.acquire()
+                            try:
+                                refused = _deliver(conn, self.username, msg, rcpts)
+                                break
+                            except Exception as exc:
+                                if not _is_connection_lost(exc):
+                                    raise                      # сервер отказал именно этому письму
+                                pool.release(conn, broken=True)  # сессия умерла — берём новую и пробуем ещё раз
+                                conn = None
+                                if attempt == 2:
+                                    raise
+                        results[index] = SendResult(index, True, refused=refused)
+                    except Exception as exc:  # noqa: BLE001 — ошибка письма попадает в результат, пачка продолжается
+                        results[index] = SendResult(index, False, error=exc)
+            finally:
+                if conn is not None:
+                    pool.release(conn)
+
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for future in [executor.submit(worker) for _ in range(concurrency)]:
+                    future.result()
+        finally:
+            if own_pool:
+                pool.close()
+        return [results[i] for i in sorted(results)]
+
+    # ---------- Очередь отправки ----------
+    @property
+    def queue(self) -> Optional[MailQueue]:
+        """Очередь исходящих писем (None, если queue_path не задан); открывается при первом обращении."""
+        if self._queue is None and self.queue_path is not None:
+            self._queue = MailQueue(self.queue_path)
+        return self._queue
+
+    @property
+    def _queue_server(self) -> str:
+        return f"{self.smtp_server}:{self.smtp_port}"  # ключ ограничения скорости и выборки писем из очереди
+
+    def enqueue(self, message: Union[EmailMessage, PreparedMessage, Mapping[str, Any]]) -> int:
+        """Поставить письмо в очередь (элемент как у send_many); вернуть его id в очереди.
+
+        Письмо сразу сериализуется для SMTP DATA (вложения из файлов читаются
+        сейчас), сама постановка — одна вставка в SQLite. Отправляют письма
+        process_queue и фоновые потоки start_queue_workers.
+        """
+        queue = self.queue
+        if queue is None:
+            raise ValueError("enqueue() requires queue_path")
+        msg, rcpts = self._prepare_outgoing(message)
+        data = msg.data if isinstance(msg, PreparedMessage) else b"".join(_smtp_chunks(msg))
+        msg_id = queue.enqueue(self.username, self._queue_server, self.username, rcpts, data)
+        self._queue_wakeup.set()                           # фоновые отправители не ждут poll_interval
+        return msg_id
+
+    def process_queue(
+        self,
+        *,
+        policy: RetryPolicy = RetryPolicy(),           # повторы и задержки при временных ошибках
+        rate: Optional[float] = None,                  # не больше стольких писем в секунду на SMTP-сервер
+        limit: Optional[int] = None,                   # обработать не больше стольких писем
+        stop: Optional[threading.Event] = None,        # прерваться между письмами, когда событие установлено
+        pool: Optional[SmtpConnectionPool] = None,     # пул SMTP-сессий вместо пула клиента
+    ) -> int:
+        """Отправить письма очереди этого аккаунта, срок которых подошёл; вернуть число попыток.
+
+        Временные ошибки (обрыв, ответы 4xx, ошибка входа) откладывают письмо по
+        policy, окончательные отказы (5xx) и исчерпанные попытки переводят его в
+        dead. Если сервер отверг часть адресатов, письмо остаётся в очереди только
+        для отвергнутых временно, а отвергнутые окончательно уходят в dead отдельным письмом.
+        """
+        queue = self.queue
+        if queue is None:
+            raise ValueError("process_queue() requires queue_path")
+        interval = 1.0 / rate if rate else 0.0
+        done = 0
+        while (limit is None or done < limit) and not (stop is not None and stop.is_set()):
+            item = queue.claim(self.username, self._queue_server, interval=interval)
+            if item is None:
+                break
+            self._send_queued(queue, item, policy, pool)
+            done += 1
+        return done
+
+    def _send_queued(
+        self, queue: MailQueue, item: QueuedMessage, policy: RetryPolicy, pool: Optional[SmtpConnectionPool],
+    ) -> None:
+        """Одна попытка отправить письмо из очереди; итог записывается в очередь."""
+        try:
+            refused = self._send_message(PreparedMessage(item.data, item.rcpts), item.rcpts, pool=pool)
+        except smtplib.SMTPRecipientsRefused as exc:
+            refused = exc.recipients                       # не принят ни один адресат — разбираем как частичный отказ
+        except Exception as exc:  # noqa: BLE001 — ошибка остаётся в очереди, а не у вызывающего кода
+            if _is_permanent(exc) or item.attempts >= policy.max_attempts:
+                queue.bury(item.id, repr(exc))
+            else:
+                queue.retry(item.id, repr(exc), policy.delay(item.attempts))
+            return
+        if not refused:
+            queue.complete(item.id)
+            return
+        error = "; ".join(f"{addr}: {code} {reply.decode(errors='replace')}" for addr, (code, reply) in refused.items())
+        temporary = [addr for addr, (code, _) in refused.items() if code < 500]
+        permanent = [addr for addr in refused if addr not in temporary]
+        if len(permanent) == len(item.rcpts):
+            queue.bury(item.id, error)                     # всё письмо отвергнуто окончательно
+            return
+        if permanent:
+            queue.bounce(item.id, permanent, error)
+        if not temporary:
+            queue.complete(item.id)
+        elif item.attempts >= policy.max_attempts:
+            queue.bury(item.id, error, rcpts=temporary)
+        else:
+            queue.retry(item.id, error, policy.delay(item.attempts), rcpts=temporary)
+
+    def start_queue_workers(
+        self,
+        workers: int = 2,
+        *,
+        policy: RetryPolicy = RetryPolicy(),
+        rate: Optional[float] = None,                  # писем в секунду на SMTP-сервер (общее для всех процессов очереди)
+        poll_interval: float = 5.0,                    # как часто проверять очередь, если никто не разбудил
+    ) -> None:
+        """Запустить фоновые потоки, отправляющие письма очереди (остановка — stop_queue_workers или close).
+
+        Потоки берут SMTP-сессии из пула клиента, а если его нет — из своего пула
+        на workers сессий. enqueue этого клиента будит их сразу; письма,
+        поставленные другими процессами, подхватываются не позже чем через
+        poll_interval секунд. Одну очередь могут разбирать несколько процессов.
+        """
+        queue = self.queue
+        if queue is None:
+            raise ValueError("start_queue_workers() requires queue_path")
+        if self._queue_workers:
+            raise RuntimeError("queue workers are already running")
+        pool = self.smtp_pool
+        if pool is None:
+            pool = self._queue_pool = SmtpConnectionPool(self._smtp_connect, workers)
+        self._queue_stop.clear()
+
+        def worker() -> None:
+            while True:
+                # Сброс — до проверки очереди: enqueue после него разбудит wait ниже, письмо до него увидит process_queue
+                self._queue_wakeup.clear()
+                if self._queue_stop.is_set():
+                    return
+                try:
+                    if self.process_queue(policy=policy, rate=rate, stop=self._queue_stop, pool=pool):
+                        continue
+                    wait = queue.wait_time(self.username, self._queue_server)
+                except Exception:  # noqa: BLE001 — база очереди занята или недоступна: попробуем позже
+                    wait = poll_interval
+                self._queue_wakeup.wait(poll_interval if wait is None else min(max(wait, 0.01), poll_interval))
+
+        self._queue_workers = [
+            threading.Thread(target=worker, name=f"mail-queue-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._queue_workers:
+            thread.start()
+
+    def stop_queue_workers(self, timeout: Optional[float] = None) -> None:
+        """Остановить фоновые отправители; начатые отправки дорабатывают, письма остаются в очереди."""
+        self._queue_stop.set()
+        self._queue_wakeup.set()
+        for thread in self._queue_workers:
+            thread.join(timeout)
+        self._queue_workers = []
+        if self._queue_pool is not None:
+            self._queue_pool.close()
+            self._queue_pool = None
 
     # ---------- IMAP ----------
+    def _imap_connect(self) -> imaplib.IMAP4:
+        """Открыть IMAP-соединение (IMAPS или обычное, см. imap_use_ssl) и залогиниться."""
+        if self.imap_use_ssl:
+            imap = imaplib.IMAP4_SSL(self.imap_server, self.imap_port, timeout=self.timeout)
+        else:
+            imap = imaplib.IMAP4(self.imap_server, self.imap_port, timeout=self.timeout)
+        try:
+            imap.login(self.username, self.password)       # логин на IMAP-сервере
+        except BaseException:
+            imap.shutdown()                                # не оставляем открытый сокет при неудачном логине
+            raise
+        return imap
+
+    @property
+    def imap_pool(self) -> Optional[ImapSessionPool]:
+        """Пул IMAP-сессий (None, если imap_pool_size == 0); его stats — статистика переиспользования."""
+        if self._imap_pool is None and self.imap_pool_size > 0:
+            self._imap_pool = ImapSessionPool(self._imap_connect, self.imap_pool_size)
+        return self._imap_pool
+
+    def _with_mailbox(self, mailbox: str, action: Callable[[imaplib.IMAP4], Any]) -> Any:
+        """Выполнить action(imap) в сессии с выбранной папкой mailbox.
+
+        Без пула — отдельное соединение на вызов (как раньше). С пулом — сессия
+        из пула; если сервер прислал BYE или соединение оборвалось, действие
+        один раз повторяется на новой сессии.
+        """
+        pool = self.imap_pool
+        if pool is None:
+            # Контекстный менеджер закроет соединение
+            with self._imap_connect() as imap:
+                imap.select(mailbox)                       # выбираем почтовый ящик/папку
+                return action(imap)
+        try:
+            with pool.session(mailbox) as imap:
+                return action(imap)
+        except (imaplib.IMAP4.abort, OSError):
+            with pool.session(mailbox) as imap:            # повтор на свежей сессии
+                return action(imap)
+
     def fetch_latest(
         self,
         mailbox: str = "INBOX",                            # папка почты (в Gmail регистрозависимая: "INBOX")
         *,
         subject: Optional[str] = None,                     # необязательный фильтр по теме (точнее — по заголовку Subject)
         unread_only: bool = False,                         # если True — искать только непрочитанные
-    ) -> Optional[email.message.Message]:
-        """Получить последнее письмо по критериям (или None, если не найдено)."""
-        # Используем IMAP по SSL (IMAPS). Контекстный менеджер закроет соединение.
-        with imaplib.IMAP4_SSL(self.imap_server, self.imap_port) as imap:
-            imap.login(self.username, self.password)       # логин на IMAP-сервере
-            imap.select(mailbox)                           # выбираем почтовый ящик/папку
+        mode: str = "full",                                # "full" — письмо целиком; "headers" / "text" — частично (LazyMessage)
+    ) -> Optional[Union[email.message.Message, LazyMessage]]:
+        """Получить последнее письмо по критериям (или None, если не найдено).
+
+        mode="full" скачивает письмо целиком (RFC822) со всеми вложениями.
+        mode="headers" — только заголовки HEADER_FIELDS; mode="text" — заголовки,
+        BODYSTRUCTURE и текстовые части. В этих режимах возвращается LazyMessage:
+        остальные части докачиваются при обращении. Письмо, уже лежащее в
+        локальном кэше, возвращается целиком в любом режиме.
+        """
+        if mode not in ("full", "headers", "text"):
+            raise ValueError(f"unknown fetch mode: {mode!r}")
 
+        def action(imap: imaplib.IMAP4) -> Optional[Union[email.message.Message, LazyMessage]]:
             criteria = ["ALL"]                             # базовый критерий поиска: все письма
             if unread_only:
                 criteria.append("UNSEEN")                  # добавляем фильтр непрочитанных
@@ -95,38 +1380,651 @@ class MailClient:
                 criteria.append(f'(HEADER Subject "{safe_subject}")')  # фильтр по заголовку Subject
 
             search_query = " ".join(criteria)              # собираем финальную строку критериев
-            status, data = imap.uid("search", None, search_query)  # ищем по UIDs; data[0] — байтовая строка с uid через пробел
-            if status != "OK" or not data or not data[0]:  # если ошибка или ничего не найдено
+            latest_uid = self._latest_uid(imap, mailbox, search_query)  # наибольший UID (последнее по времени письмо)
+            if latest_uid is None:                         # ничего не найдено
                 return None
 
-            latest_uid = data[0].split()[-1]               # берём последний UID из результата (последнее по времени письмо)
-            status, fetched = imap.uid("fetch", latest_uid, "(RFC822)")  # запрашиваем целиком сырой RFC822 контент
+            if cache is not None:
+                uidvalidity = self._uidvalidity(imap, mailbox)
+                cache.validate(mailbox, uidvalidity)       # при смене UIDVALIDITY старые письма папки удаляются
+                raw_email = cache.get(mailbox, uidvalidity, latest_uid)
+                if raw_email is not None:                  # письмо уже скачивали — тело с диска, без FETCH
+                    return email.message_from_bytes(raw_email)
+
+            if mode != "full":
+                return self._fetch_lazy(imap, mailbox, latest_uid, with_text=mode == "text")
+
+            status, fetched = imap.uid("fetch", str(latest_uid), "(RFC822)")  # запрашиваем целиком сырой RFC822 контент
             if status != "OK" or not fetched or not fetched[0]:
                 return None
 
             raw_email = fetched[0][1]                      # bytes с содержимым письма
+            if cache is not None:
+                cache.store(mailbox, uidvalidity, [{"uid": latest_uid, "body": raw_email}])
             return email.message_from_bytes(raw_email)     # парсим в объект email.message.Message
 
+        cache = self.cache
+
+        return self._with_mailbox(mailbox, action)         # по умолчанию IMAPS; с imap_pool_size > 0 — сессия из пула
+
+    # ---------- Поиск последнего письма ----------
+    @staticmethod
+    def _mailbox_state(imap: imaplib.IMAP4) -> Optional[tuple]:
+        """Отпечаток выбранной папки (UIDVALIDITY, UIDNEXT, EXISTS, HIGHESTMODSEQ) из ответа на SELECT.
+
+        Значения изымаются из untagged_responses: сессия пула, где папка выбрана
+        раньше, вернёт None, а не устаревший отпечаток.
+        """
+        if "UIDNEXT" not in imap.untagged_responses:
+            return None
+        _, uidnext = imap.response("UIDNEXT")
+        _, exists = imap.response("EXISTS")
+        _, modseq = imap.response("HIGHESTMODSEQ")         # есть только у серверов с CONDSTORE
+        uidvalidity = imap.untagged_responses.get("UIDVALIDITY") or [None]  # остаётся для _uidvalidity
+        return uidvalidity[-1], int(uidnext[-1]), exists[-1], modseq[-1]
+
+    def _latest_uid(self, imap: imaplib.IMAP4, mailbox: str, criteria: str) -> Optional[int]:
+        """Наибольший UID по критериям; результат запоминается до изменения папки.
+
+        Отпечаток папки (_mailbox_state) меняется с приходом и удалением писем
+        (UIDNEXT, EXISTS) и, при CONDSTORE, с любым изменением флагов (HIGHESTMODSEQ).
+        Без CONDSTORE результаты критериев по флагам не запоминаются.
+        """
+        state = self._mailbox_state(imap)
+        if criteria == "ALL":                              # последний UID папки узнаётся за один дешёвый запрос
+            return self._search_max(imap, criteria, state and state[1])
+        key = (mailbox, criteria)
+        cached = self._search_cache.get(key)
+        if state is None and cached is not None:
+            imap.select(mailbox)                           # SELECT дешевле повторного поиска по всей папке
+            state = self._mailbox_state(imap)
+        cacheable = state is not None and (state[3] is not None or not _FLAG_CRITERIA.search(criteria))
+        if cacheable and cached is not None and cached[0] == state:
+            return cached[1]
+
+        uid = self._search_max(imap, criteria, state and state[1])
+        if cacheable:
+            if len(self._search_cache) >= _SEARCH_CACHE_SIZE and key not in self._search_cache:
+                self._search_cache.pop(next(iter(self._search_cache)), None)  # вытесняем самый старый
+            self._search_cache[key] = (state, uid)
+        return uid
+
+    @staticmethod
+    def _search_max(imap: imaplib.IMAP4, criteria: str, uidnext: Optional[int] = None) -> Optional[int]:
+        """Наибольший UID по критериям, не получая список всех найденных UID.
+
+        ESEARCH (RFC 4731) — сервер сам возвращает только максимум: RETURN (MAX).
+        Иначе поиск идёт окнами UID от конца папки (_SEARCH_WINDOW, затем вдвое
+        больше), пока не найдётся письмо или не кончится папка: в ответе —
+        только UID из окна. Обычный SORT выигрыша не даёт (он тоже возвращает
+        весь список), а серверы с ESORT всегда объявляют и ESEARCH.
+        """
+        if "ESEARCH" in imap.capabilities:
+            status, _ = imap.uid("search", None, f"RETURN (MAX) {criteria}")
+            if status != "OK":
+                return None
+            _, data = imap.response("ESEARCH")             # "(TAG "A5") UID MAX 123"; без MAX — ничего не найдено
+            found = [re.search(rb"\bMAX (\d+)", line) for line in data if line]
+            return max((int(m.group(1)) for m in found if m), default=None)
+
+        def search(query: str) -> list[int]:
+            status, data = imap.uid("search", None, query)
+            return [int(uid) for uid in data[0].split()] if status == "OK" and data and data[0] else []
+
+        if criteria == "ALL":
+            return max(search("UID *"), default=None)      # "*" — последнее письмо папки
+        top = uidnext - 1 if uidnext else max(search("UID *"), default=0)
+        window, high = _SEARCH_WINDOW, "*"                 # первое окно открыто сверху: письма, пришедшие после SELECT
+        low = max(1, top - window + 1)
+        while True:
+            uids = search(f"UID {low}:{high} {criteria}")
+            if uids:
+                return max(uids)
+            if low <= 1:
+                return None
+            window *= 2
+            high, low = low - 1, max(1, low - window)
+
+    # ---------- Частичная загрузка ----------
+    @staticmethod
+    def _uid_fetch_items(imap: imaplib.IMAP4, uid: int, items: str) -> dict:
+        """UID FETCH одного письма; элементы ответа по именам (см. _parse_fetch)."""
+        status, data = imap.uid("fetch", str(uid), f"(UID {items})")
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data!r}")
+        for message in _parse_fetch(data):
+            if message["uid"] == uid:
+                return message["items"]
+        return {}
+
+    def _fetch_items(self, mailbox: str, uid: int, items: str) -> dict:
+        """То же, что _uid_fetch_items, в сессии клиента (для докачки частей LazyMessage)."""
+        return self._with_mailbox(mailbox, lambda imap: self._uid_fetch_items(imap, uid, items))
+
+    @staticmethod
+    def _lazy_request(with_text: bool) -> str:
+        """Элементы FETCH для LazyMessage: заголовки HEADER_FIELDS и, для режима "text", структура."""
+        fields = " ".join(f.upper() for f in HEADER_FIELDS)
+        return f"BODY.PEEK[HEADER.FIELDS ({fields})]" + (" BODYSTRUCTURE" if with_text else "")
+
+    def _lazy_from_items(self, mailbox: str, uid: int, items: Mapping) -> LazyMessage:
+        headers = next((v for k, v in items.items() if k.startswith("BODY[HEADER")), None) or b""
+        structure = items.get("BODYSTRUCTURE")
+        if not structure:
+            return LazyMessage(self, mailbox, uid, headers)
+        return LazyMessage(self, mailbox, uid, headers, _body_parts(structure), _is_multipart(structure))
+
+    def _fetch_lazy(self, imap: imaplib.IMAP4, mailbox: str, uid: int, *, with_text: bool) -> LazyMessage:
+        """Заголовки (и при with_text — структура и текстовые части) письма без вложений."""
+        lazy = self._lazy_from_items(mailbox, uid, self._uid_fetch_items(imap, uid, self._lazy_request(with_text)))
+        if with_text:
+            lazy.load((p.section for p in lazy.text_parts), imap=imap)  # текст — тем же соединением, вторым запросом
+        return lazy
+
+    # ---------- Пакетная загрузка ----------
+    @staticmethod
+    def _stream_fetch(imap: imaplib.IMAP4, uid_set: str, items: str) -> Iterator[dict]:
+        """UID FETCH с разбором ответа по мере чтения: письма выдаются по одному.
+
+        imaplib копит в памяти весь ответ команды, поэтому команда отправляется
+        вручную, а ответ читается построчно (литералы {N} — через imap.read).
+        Элементы — словари как у _parse_fetch.
+        """
+        tag = MailClient._send_tagged(imap, f"UID FETCH {uid_set} (UID {items})")
+        while True:
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during FETCH")
+            if line.startswith(tag + b" "):
+                if not line[len(tag) + 1:].startswith(b"OK"):
+                    raise imaplib.IMAP4.error(f"UID FETCH failed: {line.decode(errors='replace').strip()}")
+                return
+            if line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort(line.decode(errors="replace").strip())
+            fetch = re.match(rb"\* (\d+ )FETCH ", line)
+            data = []
+            while True:
+                literal = re.search(rb"\{(\d+)\}\r\n$", line)
+                if not literal:
+                    data.append(line.rstrip(b"\r\n"))
+                    break
+                data.append((line.rstrip(b"\r\n"), imap.read(int(literal.group(1)))))
+                line = imap.readline()                     # продолжение ответа после литерала
+            if fetch:                                      # прочие непомеченные ответы (EXISTS, FLAGS...) пропускаем
+                first = data[0]
+                head = first[0] if isinstance(first, tuple) else first
+                head = fetch.group(1) + head[fetch.end():]  # "* 5 FETCH (..." → "5 (..." — как в ответах imaplib
+                data[0] = (head, first[1]) if isinstance(first, tuple) else head
+                yield from _parse_fetch(data)
+
+    @staticmethod
+    def _send_tagged(imap: imaplib.IMAP4, command: str) -> bytes:
+        """Отправить команду в обход imaplib (ответ читает вызывающий); вернуть её тег."""
+        tag = b"F%d" % int(time.monotonic() * 1000)
+        imap.send(tag + b" " + command.encode() + b"\r\n")
+        return tag
+
+    @contextmanager
+    def _mailbox_session(self, mailbox: str):
+        """Сессия с выбранной папкой на всё время итерации (для методов-генераторов)."""
+        pool = self.imap_pool
+        if pool is None:
+            with self._imap_connect() as imap:
+                imap.select(mailbox)
+                yield imap
+            return
+        with pool.session(mailbox) as imap:
+            yield imap
+
+    def search(self, criteria: str = "ALL", mailbox: str = "INBOX") -> list[int]:
+        """UID писем папки по критериям IMAP SEARCH (по возрастанию)."""
+        def action(imap: imaplib.IMAP4) -> list[int]:
+            status, data = imap.uid("search", None, criteria)
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"UID SEARCH failed: {data!r}")
+            return sorted(int(uid) for uid in data[0].split()) if data and data[0] else []
+
+        return self._with_mailbox(mailbox, action)
+
+    def fetch_many(
+        self,
+        criteria: str = "ALL",                             # критерии IMAP SEARCH, например 'UNSEEN SINCE 1-Jan-2024'
+        mailbox: str = "INBOX",
+        *,
+        limit: Optional[int] = None,                       # только последние limit писем
+        mode: str = "full",                                # как у fetch_latest: "full" / "headers" / "text"
+        batch_size: int = 1000,                            # UID в одной команде FETCH
+    ) -> Iterator[Union[email.message.Message, LazyMessage]]:
+        """Выдавать письма по критериям по одному, в порядке возрастания UID.
+
+        Один UID SEARCH и по одному UID FETCH на batch_size писем (вместо запроса
+        на каждое письмо); ответ разбирается по мере чтения, так что в памяти
+        одновременно только текущее письмо. mode="full" скачивает письма через
+        BODY.PEEK[] (флаг \\Seen не ставится); письма из локального кэша берутся
+        с диска. Сессия занята до конца итерации; прерванная итерация закрывает её.
+        """
+        if mode not in ("full", "headers", "text"):
+            raise ValueError(f"unknown fetch mode: {mode!r}")
+        with self._mailbox_session(mailbox) as imap:
+            status, data = imap.uid("search", None, criteria)
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"UID SEARCH failed: {data!r}")
+            uids = sorted(int(uid) for uid in data[0].split()) if data and data[0] else []
+            if limit is not None:
+                uids = uids[-limit:] if limit > 0 else []
+            yield from self._fetch_uids(imap, mailbox, uids, mode, batch_size)
+
+    def fetch_range(
+        self,
+        first: int,                                        # первый UID диапазона
+        last: Optional[int] = None,                        # последний UID; None — до конца папки ("first:*")
+        mailbox: str = "INBOX",
+        *,
+        mode: str = "full",
+        batch_size: int = 1000,
+    ) -> Iterator[Union[email.message.Message, LazyMessage]]:
+        """Выдавать письма с UID из диапазона first..last по одному (см. fetch_many)."""
+        if mode not in ("full", "headers", "text"):
+            raise ValueError(f"unknown fetch mode: {mode!r}")
+        with self._mailbox_session(mailbox) as imap:
+            status, data = imap.uid("search", None, f"UID {first}:{'*' if last is None else last}")
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"UID SEARCH failed: {data!r}")
+            # "n:*" при отсутствии писем с UID >= n возвращает последнее — отфильтровываем
+            uids = sorted(
+                uid for uid in map(int, data[0].split() if data and data[0] else [])
+                if uid >= first and (last is None or uid <= last)
+            )
+            yield from self._fetch_uids(imap, mailbox, uids, mode, batch_size)
+
+    def _fetch_uids(self, imap, mailbox, uids, mode, batch_size) -> Iterator:
+        """Скачать письма с заданными UID пачками по batch_size."""
+        cache = self.cache
+        uidvalidity = self._uidvalidity(imap, mailbox) if cache is not None else None
+        if cache is not None:
+            cache.validate(mailbox, uidvalidity)
+        for start in range(0, len(uids), batch_size):
+            batch = uids[start:start + batch_size]
+            if mode == "full":
+                yield from self._fetch_full_batch(imap, mailbox, batch, uidvalidity)
+                continue
+
+            messages = (
+                self._lazy_from_items(mailbox, m["uid"], m["items"])
+                for m in self._stream_fetch(imap, _uid_set(batch), self._lazy_request(mode == "text"))
+            )
+            if mode == "headers":
+                yield from messages
+                continue
+            # mode="text": текстовые части у писем разные ("1", "1.1", ...) — по одному FETCH на каждый вариант
+            messages = list(messages)
+            groups: dict[tuple[str, ...], dict[int, LazyMessage]] = {}
+            for lazy in messages:
+                sections = tuple(p.section for p in lazy.text_parts)
+                if sections:
+                    groups.setdefault(sections, {})[lazy.uid] = lazy
+            for sections, by_uid in groups.items():
+                request = " ".join(f"BODY.PEEK[{s}]" for s in sections)
+                for m in self._stream_fetch(imap, _uid_set(by_uid), request):
+                    if m["uid"] in by_uid:
+                        by_uid[m["uid"]]._fill(sections, m["items"])
+            yield from messages
+
+    def _fetch_full_batch(self, imap, mailbox, batch, uidvalidity) -> Iterator[email.message.Message]:
+        """Письма целиком: закэшированные — с диска, остальные — одним потоковым FETCH."""
+        cache = self.cache
+        cached = {}
+        if cache is not None:
+            for uid in batch:
+                raw = cache.get(mailbox, uidvalidity, uid)
+                if raw is not None:
+                    cached[uid] = raw
+        missing = [uid for uid in batch if uid not in cached]
+        stream = self._stream_fetch(imap, _uid_set(missing), "FLAGS BODY.PEEK[]") if missing else iter(())
+        pending = next(stream, None)
+        for uid in batch:                                  # ответы сервера идут по возрастанию UID — сливаем с кэшем
+            if uid in cached:
+                yield email.message_from_bytes(cached[uid])
+                continue
+            while pending is not None and (pending["uid"] or 0) < uid:
+                pending = next(stream, None)
+            if pending is not None and pending["uid"] == uid and pending["body"] is not None:
+                if cache is not None:
+                    cache.store(mailbox, uidvalidity, [pending])
+                yield email.message_from_bytes(pending["body"])
+                pending = next(stream, None)
+        for _ in stream:                                   # дочитываем ответ, чтобы сессия осталась пригодной
+            pass
+
+    # ---------- Потоковый разбор ----------
+    def stream_message(
+        self,
+        uid: int,                                          # UID письма
+        parser: MimeStreamParser,                          # куда направлять письмо: вложения — в файлы/колбэк, см. mail_stream
+        mailbox: str = "INBOX",
+        *,
+        chunk_size: int = READ_SIZE,                       # сколько байт читать из сокета за раз
+    ) -> Iterator[str]:
+        """Скачать письмо и разобрать его по мере чтения из сокета; выдавать фрагменты текста.
+
+        Письмо не собирается в памяти ни как bytes, ни как дерево email.message:
+        литерал BODY[] читается кусками по chunk_size и сразу передаётся в parser.
+        Заголовки и вложения после итерации — в parser.headers и parser.attachments
+        (headers остаётся None, если письма с таким UID нет).
+        """
+        with self._mailbox_session(mailbox) as imap:
+            tag = self._send_tagged(imap, f"UID FETCH {uid} (UID BODY.PEEK[])")
+            while True:
+                line = imap.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("connection closed during FETCH")
+                if line.startswith(tag + b" "):
+                    if not line[len(tag) + 1:].startswith(b"OK"):
+                        raise imaplib.IMAP4.error(f"UID FETCH failed: {line.decode(errors='replace').strip()}")
+                    return
+                if line.startswith(b"* BYE"):
+                    raise imaplib.IMAP4.abort(line.decode(errors="replace").strip())
+                literal = re.search(rb"BODY\[\] \{(\d+)\}\r\n$", line)
+                if not literal:
+                    continue                               # прочие строки ответа (EXISTS, хвост ")" и т.п.)
+                remaining = int(literal.group(1))
+                while remaining:
+                    chunk = imap.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise imaplib.IMAP4.abort("connection closed during FETCH")
+                    remaining -= len(chunk)
+                    yield from parser.feed(chunk)
+                yield from parser.close()
+
+    # ---------- Локальный кэш ----------
+    @property
+    def cache(self) -> Optional[MessageCache]:
+        """Кэш писем (None, если cache_path не задан); открывается при первом обращении."""
+        if self._cache is None and self.cache_path is not None:
+            self._cache = MessageCache(self.cache_path)
+        return self._cache
+
+    @staticmethod
+    def _uidvalidity(imap: imaplib.IMAP4, mailbox: str) -> int:
+        """UIDVALIDITY выбранной папки из ответа на SELECT.
+
+        imaplib хранит его в untagged_responses до следующего SELECT; если сессия
+        из пула выбрала папку давно и ответ уже вытеснен, папка выбирается заново.
+        """
+        values = imap.untagged_responses.get("UIDVALIDITY")
+        if not values:
+            imap.select(mailbox)
+            values = imap.untagged_responses.get("UIDVALIDITY")
+        if not values:
+            raise imaplib.IMAP4.error(f"server did not report UIDVALIDITY for {mailbox!r}")
+        return int(values[-1])
+
+    def sync(self, mailbox: str = "INBOX", *, bodies: bool = True, batch_size: int = 500) -> list[int]:
+        """Инкрементально синхронизировать папку с локальным кэшем; вернуть UID новых писем.
+
+        Скачиваются только письма с UID больше последнего синхронизированного
+        (BODY.PEEK[] — флаг \\Seen не ставится; bodies=False — только флаги),
+        пачками по batch_size: ответ читается потоково (см. _stream_fetch), каждая
+        пачка сразу пишется в кэш, и прерванная синхронизация продолжается с
+        последней сохранённой пачки.
+        Если сервер поддерживает CONDSTORE (RFC 7162), флаги уже известных писем
+        обновляются запросом CHANGEDSINCE — сервер присылает только изменившиеся.
+        При смене UIDVALIDITY кэш папки сбрасывается и синхронизация идёт с нуля.
+        """
+        cache = self.cache
+        if cache is None:
+            raise ValueError("sync() requires cache_path")
+
+        def action(imap: imaplib.IMAP4) -> list[int]:
+            uidvalidity = self._uidvalidity(imap, mailbox)
+            last_uid, modseq = cache.validate(mailbox, uidvalidity)
+            condstore = "CONDSTORE" in imap.capabilities
+
+            new, new_modseq = [], 0
+            new_uids = self._uids_after(imap, last_uid)    # дешёвый SEARCH: "n:*" без новых писем вернул бы последнее
+            items = "FLAGS" + (" MODSEQ" if condstore else "") + (" BODY.PEEK[]" if bodies else "")
+            for start in range(0, len(new_uids), batch_size):
+                batch = [
+                    m for m in self._stream_fetch(imap, _uid_set(new_uids[start:start + batch_size]), items)
+                    if m["uid"] is not None and m["uid"] > last_uid
+                ]
+                cache.store(mailbox, uidvalidity, batch)
+                # modseq не двигаем до проверки флагов старых писем ниже — иначе прерванный sync пропустил бы их
+                cache.advance(mailbox, max([last_uid] + [m["uid"] for m in batch]))
+                new.extend(m["uid"] for m in batch)
+                new_modseq = max([new_modseq] + [m["modseq"] or 0 for m in batch])
+
+            changed = []
+            if condstore and modseq and last_uid:
+                status, data = imap.uid("fetch", f"1:{last_uid}", f"(UID FLAGS) (CHANGEDSINCE {modseq})")
+                if status == "OK":
+                    changed = [m for m in _parse_fetch(data) if m["uid"] is not None]
+
+            cache.store(mailbox, uidvalidity, changed)
+            cache.advance(mailbox, max([last_uid] + new), max([modseq, new_modseq] + [m["modseq"] or 0 for m in changed]))
+            return new
+
+        return self._with_mailbox(mailbox, action)
+
+    def fetch_uid(self, uid: int, mailbox: str = "INBOX") -> Optional[email.message.Message]:
+        """Получить письмо по UID; закэшированное читается с диска без обращения к серверу.
+
+        Кэш сверяется с UIDVALIDITY, полученным при последнем sync/fetch; чтобы
+        заметить его смену на сервере, периодически вызывайте sync().
+        """
+        cache = self.cache
+        state = cache.state(mailbox) if cache is not None else None
+        if state is not None:
+            raw = cache.get(mailbox, state[0], uid)
+            if raw is not None:
+                return email.message_from_bytes(raw)
+
+        def action(imap: imaplib.IMAP4) -> Optional[email.message.Message]:
+            status, fetched = imap.uid("fetch", str(uid), "(UID FLAGS BODY.PEEK[])")
+            if status != "OK":
+                return None
+            found = [m for m in _parse_fetch(fetched) if m["uid"] == uid and m["body"] is not None]
+            if not found:
+                return None
+            if cache is not None:
+                uidvalidity = self._uidvalidity(imap, mailbox)
+                cache.validate(mailbox, uidvalidity)
+                cache.store(mailbox, uidvalidity, found)
+            return email.message_from_bytes(found[0]["body"])
+
+        return self._with_mailbox(mailbox, action)
+
+    # ---------- Полнотекстовый индекс ----------
+    @property
+    def index(self) -> Optional[MailIndex]:
+        """Полнотекстовый индекс (None, если index_path не задан); открывается при первом обращении."""
+        if self._index is None and self.index_path is not None:
+            self._index = MailIndex(self.index_path)
+        return self._index
+
+    def update_index(self, mailbox: str = "INBOX", *, batch_size: int = 500) -> int:
+        """Проиндексировать письма папки, пришедшие после последнего проиндексированного; вернуть их число.
+
+        Письма скачиваются в режиме "text" (заголовки и текстовые части, без
+        вложений) и записываются в индекс пачками по batch_size под аккаунтом
+        username. Поиск затем идёт локально: client.index.search(...).
+        """
+        index = self.index
+        if index is None:
+            raise ValueError("update_index() requires index_path")
+        added = 0
+        with self._mailbox_session(mailbox) as imap:
+            uidvalidity = self._uidvalidity(imap, mailbox)
+            last_uid = index.validate(self.username, mailbox, uidvalidity)
+            documents = []
+            for msg in self._fetch_uids(imap, mailbox, self._uids_after(imap, last_uid), "text", batch_size):
+                documents.append({
+                    "uid": msg.uid,
+                    "subject": _decode_words(msg.get("Subject")),
+                    "sender": _decode_words(msg.get("From")),
+                    "date": str(msg.get("Date") or ""),
+                    "body": self.extract_text(msg),
+                })
+                if len(documents) >= batch_size:
+                    added += index.add(self.username, mailbox, uidvalidity, documents)
+                    documents = []
+            added += index.add(self.username, mailbox, uidvalidity, documents)
+        return added
+
+    # ---------- IMAP IDLE ----------
+    @staticmethod
+    def _last_uid(imap: imaplib.IMAP4) -> int:
+        """Наибольший UID в выбранной папке: из UIDNEXT ответа SELECT или поиском."""
+        _, data = imap.response("UIDNEXT")                 # [OK UIDNEXT n] из ответа на SELECT
+        if data and data[0]:
+            return int(data[0]) - 1
+        status, data = imap.uid("search", None, "ALL")
+        uids = data[0].split() if status == "OK" and data and data[0] else []
+        return int(uids[-1]) if uids else 0
+
+    @staticmethod
+    def _uids_after(imap: imaplib.IMAP4, last_uid: int) -> list[int]:
+        """UID писем, пришедших после last_uid (по возрастанию)."""
+        status, data = imap.uid("search", None, f"UID {last_uid + 1}:*")
+        if status != "OK" or not data or not data[0]:
+            return []
+        # "n:*" при отсутствии новых писем возвращает последнее имеющееся — отфильтровываем
+        return sorted(uid for uid in map(int, data[0].split()) if uid > last_uid)
+
+    @staticmethod
+    def _idle_wait(imap: imaplib.IMAP4, stop: threading.Event, refresh: float) -> bool:
+        """Один цикл IDLE (RFC 2177): ждать EXISTS, stop или истечения refresh секунд.
+
+        imaplib не поддерживает IDLE, поэтому команда отправляется вручную, а
+        строки ответа читает отдельный поток (блокирующий readline нельзя прервать
+        таймаутом без порчи файла сокета). Возвращает True, если пришли письма.
+        """
+        tag = b"IDLE%d" % int(time.monotonic() * 1000)
+        imap.send(tag + b" IDLE\r\n")
+        first = imap.readline()
+        if not first.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {first!r}")
+
+        lines: queue.Queue = queue.Queue()
+
+        def reader() -> None:
+            try:
+                while True:
+                    line = imap.readline()
+                    lines.put(line)
+                    if not line or line.startswith(tag + b" "):
+                        return
+            except Exception as exc:  # noqa: BLE001 — передаём ошибку в основной поток
+                lines.put(exc)
+
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+
+        deadline = time.monotonic() + refresh
+        arrived = False
+        done_sent = False
+        while True:
+            if not done_sent and (arrived or stop.is_set() or time.monotonic() >= deadline):
+                imap.send(b"DONE\r\n")                    # выходим из IDLE; дальше ждём помеченный ответ
+                done_sent = True
+            try:
+                item = lines.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if isinstance(item, Exception) or not item:
+                raise imaplib.IMAP4.abort(f"connection lost during IDLE: {item!r}")
+            if item.startswith(tag + b" "):
+                thread.join()
+                return arrived
+            if item.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort(item.decode(errors="replace").strip())
+            if re.match(rb"\* \d+ EXISTS", item):
+                arrived = True
+
+    def watch(
+        self,
+        mailbox: str = "INBOX",                            # папка, за которой следим
+        callback: Optional[Callable[[int], Any]] = None,   # вызывать для каждого нового UID; None — вернуть итератор
+        *,
+        stop: Optional[threading.Event] = None,            # установить событие — и наблюдение завершится
+        poll_interval: float = 30.0,                       # период опроса NOOP, если сервер не умеет IDLE
+        idle_refresh: float = 29 * 60,                     # перезапуск IDLE (RFC 2177: не дольше 29 минут)
+    ) -> Optional[Iterator[int]]:
+        """Следить за папкой и выдавать UID только что пришедших писем.
+
+        Если сервер объявляет IDLE, используется IMAP IDLE (RFC 2177): сервер сам
+        сообщает о новых письмах (EXISTS), задержка — доли секунды. Иначе — опрос
+        командой NOOP раз в poll_interval секунд. Для наблюдения открывается
+        отдельная сессия (не из пула): в режиме IDLE она занята целиком.
+
+        Без callback возвращает итератор UID (закрывается через close() или stop);
+        с callback блокируется и вызывает callback(uid), пока не установлен stop.
+        """
+        uids = self._watch(mailbox, stop or threading.Event(), poll_interval, idle_refresh)
+        if callback is None:
+            return uids
+        try:
+            for uid in uids:
+                callback(uid)
+        finally:
+            uids.close()
+        return None
+
+    def _watch(self, mailbox, stop, poll_interval, idle_refresh) -> Iterator[int]:
+        imap = self._imap_connect()
+        try:
+            imap.select(mailbox)
+            last_uid = self._last_uid(imap)
+            use_idle = "IDLE" in imap.capabilities
+            while not stop.is_set():
+                if use_idle:
+                    if not self._idle_wait(imap, stop, idle_refresh):
+                        continue
+                else:
+                    if stop.wait(poll_interval):
+                        break
+                    imap.noop()                            # даёт серверу сообщить об изменениях в папке
+                for uid in self._uids_after(imap, last_uid):
+                    last_uid = uid
+                    yield uid
+        finally:
+            ImapSessionPool._close_quietly(imap)
+
     # ---------- Helpers ----------
     @staticmethod
-    def extract_text(msg: email.message.Message) -> str:
-        """Достать текстовую часть письма (text/plain) без вложений."""
+    def extract_text(
+        msg: Union[email.message.Message, LazyMessage],
+        *,
+        first_only: bool = False,                          # только первая текстовая часть
+        max_length: Optional[int] = None,                  # не больше стольких символов
+    ) -> str:
+        """Достать текстовую часть письма (text/plain) без вложений.
+
+        Вложения и контейнеры multipart пропускаются без разбора заголовков и
+        декодирования; разбор Content-Type и поиск кодеков кэшируются. С
+        max_length из base64 / quoted-printable декодируется только начало
+        части, а следующие части не читаются, если текста уже достаточно.
+        """
+        if isinstance(msg, LazyMessage):                   # частично загруженное письмо скачивает только текстовые части
+            text = msg._text(msg.text_parts[:1]) if first_only else msg.text
+            return text[:max_length] if max_length is not None else text
         parts: list[str] = []                              # копим фрагменты текста (если multipart может быть несколько)
-        if msg.is_multipart():                             # если письмо многочастное (multipart/*)
-            for part in msg.walk():                        # обходим все части (вложенные секции MIME)
-                ctype = part.get_content_type()            # MIME-тип части
-                disp = part.get("Content-Disposition", "") # Content-Disposition (attachment/inline/пусто)
-                if ctype == "text/plain" and "attachment" not in disp:  # отбираем только текст без вложений
-                    charset = part.get_content_charset() or "utf-8"     # кодировка, по умолчанию utf-8
-                    payload = part.get_payload(decode=True)             # берём байты содержимого
-                    if payload is not None:
-                        parts.append(payload.decode(charset, errors="replace"))  # декодируем с заменой битых символов
-        else:                                              # односоставное письмо (без multipart)
-            charset = msg.get_content_charset() or "utf-8"
-            payload = msg.get_payload(decode=True)
-            if payload is not None:
-                parts.append(payload.decode(charset, errors="replace"))
-        return "\n".join(parts).strip()                    # объединяем все найденные текстовые части в одну строку
+        truncated = False                                  # последняя часть декодирована не целиком
+        for part, charset in _plain_parts(msg):            # text/plain без вложений (или единственная часть письма)
+            text, truncated = _decode_text(part, charset, max_length)
+            if text is None:
+                continue
+            parts.append(text)
+            if first_only or truncated:
+                break
+            if max_length is not None and len("\n".join(parts).strip()) >= max_length:
+                break                                      # дальнейшие части не попадут в результат
+        result = "\n".join(parts).strip()                  # объединяем все найденные текстовые части в одну строку
+        if max_length is None:
+            return result
+        if truncated and len(result) < max_length:         # начало части — сплошь пробелы: декодируем целиком
+            return MailClient.extract_text(msg, first_only=first_only)[:max_length]
+        return result[:max_length]
 
 
 if __name__ == "__main__":                                 # исполняем только при запуске файла как скрипта (не при импорте как модуля)
@@ -134,7 +2032,7 @@ if __name__ == "__main__":                                 # исполняем
     # Пароли лучше передавать как APP PASSWORD (для Gmail) и не хранить в коде.
     import argparse                                        # парсер аргументов командной строки
     import getpass                                         # безопасный ввод пароля без эха
-    import os                                              # доступ к переменным окружения
+    import sys                                             # коды завершения и вывод ошибок в stderr
 
     parser = argparse.ArgumentParser(description="SMTP/IMAP почтовый клиент")  # создаём парсер CLI
     parser.add_argument(
@@ -155,8 +2053,13 @@ if __name__ == "__main__":                                 # исполняем
     parser.add_argument("--imap", default=os.environ.get("IMAP_SERVER", "imap.gmail.com"))  # IMAP-хост
     parser.add_argument("--imap-port", type=int, default=int(os.environ.get("IMAP_PORT", 993)))  # IMAP-порт
     parser.add_argument("--no-tls", action="store_true", help="не использовать STARTTLS для SMTP")  # флаг для отключения TLS
+    parser.add_argument(
+        "--queue",
+        default=os.environ.get("MAIL_QUEUE"),              # файл очереди можно задать через MAIL_QUEUE
+        help="файл очереди исходящих писем: send не теряет письмо при сбое SMTP",
+    )
 
-    sub = parser.add_subparsers(dest="cmd", required=True)  # подкоманды: send/recv (обязательны)
+    sub = parser.add_subparsers(dest="cmd", required=True)  # подкоманды: send/recv/queue (обязательны)
 
     p_send = sub.add_parser("send", help="отправить письмо")  # описываем подкоманду send
     p_send.add_argument("--to", nargs="+", required=True, help="получатели")            # один или несколько адресатов
@@ -165,12 +2068,18 @@ if __name__ == "__main__":                                 # исполняем
     p_send.add_argument("--subject", required=True)                                     # тема
     p_send.add_argument("--body", required=True)                                        # тело письма (plain text)
 
+    p_queue = sub.add_parser("queue", help="отправить письма из очереди и показать недоставленные")
+    p_queue.add_argument("--requeue", nargs="*", type=int, default=[], metavar="ID",
+                         help="вернуть недоставленные письма с этими id в очередь")
+
     p_recv = sub.add_parser("recv", help="получить последнее письмо")  # описываем подкоманду recv
     p_recv.add_argument("--mailbox", default="INBOX")                                  # папка (INBOX по умолчанию)
     p_recv.add_argument("--subject", help="фильтр по теме (HEADER Subject ...)")       # фильтр по теме (опционально)
     p_recv.add_argument("--unread", action="store_true", help="только непрочитанные")  # только непрочитанные
 
     args = parser.parse_args()                                # разбираем аргументы командной строки
+    if args.cmd == "queue" and not args.queue:
+        parser.error("команде queue нужен --queue или MAIL_QUEUE")
 
     if not args.username:                                     # если логин не пришёл ни из CLI, ни из окружения —
         args.username = input("Email login: ").strip()        # спросим интерактивно
@@ -186,22 +2095,49 @@ if __name__ == "__main__":                                 # исполняем
         imap_server=args.imap,
         imap_port=args.imap_port,
         smtp_use_tls=not args.no_tls,                         # если указан --no-tls, то tls=False
+        queue_path=args.queue,                                # очередь исходящих (None — отправка напрямую)
     )
 
-    if args.cmd == "send":                                    # обработка подкоманды отправки
-        client.send_email(
-            recipients=args.to,
-            subject=args.subject,
-            body=args.body,
-            cc=args.cc,
-            bcc=args.bcc,
-        )
+    if args.cmd == "send" and client.queue is None:           # отправка без очереди: ошибка — сообщение и код 1
+        try:
+            client.send_email(
+                recipients=args.to,
+                subject=args.subject,
+                body=args.body,
+                cc=args.cc,
+                bcc=args.bcc,
+            )
+        except (smtplib.SMTPException, OSError) as exc:
+            sys.exit(f"Письмо не отправлено: {exc!r}")
         print("Письмо отправлено.")                           # уведомление об успешной отправке
+    elif args.cmd == "send":                                  # через очередь: письмо сохраняется до отправки
+        msg_id = client.enqueue({
+            "recipients": args.to, "subject": args.subject, "body": args.body, "cc": args.cc, "bcc": args.bcc,
+        })
+        client.process_queue()                                # заодно уходят и отложенные ранее письма
+        item = client.queue.get(msg_id)
+        if item is None:
+            print("Письмо отправлено.")
+        elif item.status == "dead":
+            sys.exit(f"Письмо не доставлено: {item.last_error}")
+        else:
+            print(f"Письмо оставлено в очереди (id {msg_id}): {item.last_error}. "
+                  f"Повторить отправку: команда queue.")
+            sys.exit(75)                                      # EX_TEMPFAIL — временная ошибка, как у sendmail
+    elif args.cmd == "queue":                                 # разбор очереди и список недоставленных писем
+        for msg_id in args.requeue:
+            if not client.queue.requeue(msg_id):
+                print(f"Недоставленного письма с id {msg_id} нет.", file=sys.stderr)
+        sent = client.process_queue()
+        print(f"Попыток отправки: {sent}; в очереди: {client.queue.count()}.")
+        for item in client.queue.dead_letters(client.username):
+            print(f"— dead {item.id}: {', '.join(item.rcpts)} — {item.last_error}")
     elif args.cmd == "recv":                                  # обработка подкоманды получения
         msg = client.fetch_latest(
             mailbox=args.mailbox,
             subject=args.subject,
             unread_only=args.unread,
+            mode="text",                                      # печатаем только заголовки и текст — вложения не качаем
         )
         if msg is None:                                       # если ничего не нашли по критериям
             print("Писем по заданным критериям не найдено.")
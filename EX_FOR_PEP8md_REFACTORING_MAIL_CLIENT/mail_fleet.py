@@ -0,0 +1,150 @@
+"""Параллельное получение писем из многих ящиков (аккаунтов и папок).
+
+MailboxFleet раздаёт цели (FetchTarget: клиент, папка, критерии) пулу потоков
+ограниченного размера и выдаёт результаты по мере готовности — общая задержка
+определяется самым медленным ящиком, а не суммой всех. Число одновременных
+соединений с одним IMAP-сервером ограничено (per_server), у каждой цели —
+собственный таймаут.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Optional
+
+from mail_client_ref import MailClient
+
+
+@dataclass(frozen=True)
+class FetchTarget:
+    """Что получить: последнее письмо (как fetch_latest) или письма по критериям (как fetch_many)."""
+
+    client: MailClient                                 # аккаунт; один клиент может входить в несколько целей
+    mailbox: str = "INBOX"
+    subject: Optional[str] = None                      # фильтр fetch_latest по теме
+    unread_only: bool = False                          # фильтр fetch_latest: только непрочитанные
+    criteria: Optional[str] = None                     # критерии IMAP SEARCH — тогда fetch_many(criteria, limit=limit)
+    limit: int = 1
+    mode: str = "full"                                 # "full" / "headers" / "text", см. fetch_latest
+    key: Any = None                                    # произвольная метка цели для вызывающего кода
+
+
+@dataclass
+class FetchResult:
+    """Итог одной цели: найденные письма или ошибка."""
+
+    target: FetchTarget
+    messages: list = field(default_factory=list)      # письма (пустой список — ничего не найдено)
+    error: Optional[BaseException] = None              # исключение клиента или TimeoutError
+    elapsed: float = 0.0                               # секунд от начала обработки цели
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def message(self):
+        """Последнее найденное письмо или None."""
+        return self.messages[-1] if self.messages else None
+
+
+class MailboxFleet:
+    """Параллельный сборщик писем с ограничениями на сервер и таймаутами."""
+
+    def __init__(self, max_workers: int = 16, *, per_server: int = 4, timeout: float = 60.0) -> None:
+        self.max_workers = max_workers
+        self.per_server = per_server                   # одновременных соединений с одним (хост, порт)
+        self.timeout = timeout                         # секунд на одну цель, включая ожидание слота сервера
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mailbox-fleet")
+        self._limits: dict[tuple[str, int], threading.BoundedSemaphore] = {}
+        self._limits_lock = threading.Lock()
+
+    def __enter__(self) -> "MailboxFleet":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Не брать новые цели; уже начатые дорабатывают в фоне (до таймаута сокета клиента)."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _server_limit(self, client: MailClient) -> threading.BoundedSemaphore:
+        key = (client.imap_server, client.imap_port)
+        with self._limits_lock:
+            if key not in self._limits:
+                self._limits[key] = threading.BoundedSemaphore(self.per_server)
+            return self._limits[key]
+
+    def _run(self, target: FetchTarget, started: dict, index: int) -> FetchResult:
+        start = started[index] = time.monotonic()
+        limit = self._server_limit(target.client)
+        if not limit.acquire(timeout=self.timeout):
+            raise TimeoutError(f"no free connection slot for {target.client.imap_server} in {self.timeout} s")
+        try:
+            client = target.client
+            if target.criteria is None:
+                message = client.fetch_latest(
+                    target.mailbox, subject=target.subject, unread_only=target.unread_only, mode=target.mode,
+                )
+                messages = [] if message is None else [message]
+            else:
+                messages = list(client.fetch_many(target.criteria, target.mailbox, limit=target.limit,
+                                                  mode=target.mode))
+        finally:
+            limit.release()
+        return FetchResult(target, messages, elapsed=time.monotonic() - start)
+
+    def fetch(self, targets: Iterable[FetchTarget]) -> Iterator[FetchResult]:
+        """Выдавать FetchResult по мере готовности (порядок — порядок завершения).
+
+        Ошибки не прерывают итерацию: они попадают в FetchResult.error. Цель, не
+        уложившаяся в timeout с момента начала обработки, сразу возвращается с
+        TimeoutError, её поток дорабатывает в фоне.
+        """
+        results = self._fetch_indexed(list(targets))
+        try:
+            for _, result in results:
+                yield result
+        finally:
+            results.close()                            # отмена ещё не начатых целей, если итерацию прервали
+
+    def _fetch_indexed(self, targets: list[FetchTarget]) -> Iterator[tuple[int, FetchResult]]:
+        """Как fetch, но с номером цели: одна и та же цель может встречаться в targets несколько раз."""
+        started: dict[int, float] = {}                 # индекс цели -> время начала обработки
+        futures: dict[Future, int] = {
+            self._executor.submit(self._run, target, started, i): i for i, target in enumerate(targets)
+        }
+        pending = set(futures)
+        try:
+            while pending:
+                deadlines = [started[futures[f]] + self.timeout for f in pending if futures[f] in started]
+                wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else self.timeout
+                done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as exc:  # noqa: BLE001 — ошибка цели попадает в результат
+                        elapsed = time.monotonic() - started.get(index, time.monotonic())
+                        result = FetchResult(targets[index], error=exc, elapsed=elapsed)
+                    yield index, result
+
+                now = time.monotonic()
+                for future in [f for f in pending if futures[f] in started]:
+                    index = futures[future]
+                    if now - started[index] >= self.timeout:
+                        pending.discard(future)
+                        error = TimeoutError(f"{targets[index].client.imap_server}: no result in {self.timeout} s")
+                        yield index, FetchResult(targets[index], error=error, elapsed=now - started[index])
+        finally:
+            for future in pending:                     # итерацию прервали — ещё не начатые цели не запускаем
+                future.cancel()
+
+    def fetch_all(self, targets: Iterable[FetchTarget]) -> list[FetchResult]:
+        """Все результаты в порядке целей."""
+        indexed = sorted(self._fetch_indexed(list(targets)), key=lambda item: item[0])
+        return [result for _, result in indexed]
@@ -0,0 +1,184 @@
+"""Локальный полнотекстовый индекс писем (SQLite FTS5): поиск по теме, отправителю и тексту без сервера.
+
+Ключ письма — (аккаунт, папка, UIDVALIDITY, UID), как в mail_cache.py; один
+файл индекса может обслуживать несколько аккаунтов и папок. Индекс пополняет
+MailClient.update_index: скачиваются только письма с UID больше последнего
+проиндексированного, при смене UIDVALIDITY записи папки удаляются.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Iterable, Mapping, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    account     TEXT NOT NULL,
+    mailbox     TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    last_uid    INTEGER NOT NULL DEFAULT 0,   -- до какого UID папка проиндексирована
+    PRIMARY KEY (account, mailbox)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    id          INTEGER PRIMARY KEY,          -- rowid строки в documents_fts
+    account     TEXT NOT NULL,
+    mailbox     TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid         INTEGER NOT NULL,
+    sender      TEXT NOT NULL DEFAULT '',
+    subject     TEXT NOT NULL DEFAULT '',
+    date        TEXT NOT NULL DEFAULT '',
+    UNIQUE (account, mailbox, uidvalidity, uid)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    subject, sender, body,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'                            -- быстрые запросы по префиксу: "отч*"
+);
+"""
+
+
+@dataclass(frozen=True)
+class IndexHit:
+    """Найденное письмо: где оно лежит на сервере и его основные заголовки."""
+
+    account: str
+    mailbox: str
+    uid: int
+    uidvalidity: int
+    subject: str
+    sender: str
+    date: str
+    snippet: str = ""                                  # фрагмент текста с найденными словами в [скобках]
+
+
+class MailIndex:
+    """Потокобезопасный полнотекстовый индекс в файле SQLite (":memory:" — в памяти процесса).
+
+    search() принимает запрос FTS5: слова (все должны встретиться), "фразы в
+    кавычках", префиксы (отч*), OR/NOT и ограничение по полю (subject: отчёт).
+    Текст, введённый пользователем, безопасно превращается в запрос методом terms().
+    """
+
+    def __init__(self, path: str = ":memory:") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)  # файл могут делить несколько клиентов
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self.stats = {"added": 0, "queries": 0, "resets": 0}
+
+    def validate(self, account: str, mailbox: str, uidvalidity: int) -> int:
+        """Сверить UIDVALIDITY папки и вернуть последний проиндексированный UID.
+
+        Если UIDVALIDITY изменился, записи папки удаляются и индексация начнётся с нуля.
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT uidvalidity, last_uid FROM folders WHERE account = ? AND mailbox = ?", (account, mailbox),
+            ).fetchone()
+            if row is not None and row[0] == uidvalidity:
+                return row[1]
+            if row is not None:
+                self.stats["resets"] += 1
+            self._db.execute(
+                "DELETE FROM documents_fts WHERE rowid IN "
+                "(SELECT id FROM documents WHERE account = ? AND mailbox = ?)", (account, mailbox),
+            )
+            self._db.execute("DELETE FROM documents WHERE account = ? AND mailbox = ?", (account, mailbox))
+            self._db.execute(
+                "INSERT OR REPLACE INTO folders (account, mailbox, uidvalidity) VALUES (?, ?, ?)",
+                (account, mailbox, uidvalidity),
+            )
+            return 0
+
+    def add(self, account: str, mailbox: str, uidvalidity: int, documents: Iterable[Mapping]) -> int:
+        """Проиндексировать письма: словари с ключами uid, subject, sender, date, body.
+
+        Повторно добавленное письмо заменяет прежнюю запись; last_uid папки растёт
+        до наибольшего добавленного UID. Возвращает число записей.
+        """
+        count, last_uid = 0, 0
+        with self._lock, self._db:
+            for doc in documents:
+                fields = [str(doc.get(name) or "") for name in ("sender", "subject", "date")]
+                row = self._db.execute(
+                    "SELECT id FROM documents WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?",
+                    (account, mailbox, uidvalidity, doc["uid"]),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("DELETE FROM documents_fts WHERE rowid = ?", row)
+                    self._db.execute("UPDATE documents SET sender = ?, subject = ?, date = ? WHERE id = ?",
+                                     (*fields, row[0]))
+                    doc_id = row[0]
+                else:
+                    doc_id = self._db.execute(
+                        "INSERT INTO documents (account, mailbox, uidvalidity, uid, sender, subject, date) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", (account, mailbox, uidvalidity, doc["uid"], *fields),
+                    ).lastrowid
+                self._db.execute(
+                    "INSERT INTO documents_fts (rowid, subject, sender, body) VALUES (?, ?, ?, ?)",
+                    (doc_id, fields[1], fields[0], str(doc.get("body") or "")),
+                )
+                count += 1
+                last_uid = max(last_uid, doc["uid"])
+            self._db.execute(
+                "UPDATE folders SET last_uid = MAX(last_uid, ?) "
+                "WHERE account = ? AND mailbox = ? AND uidvalidity = ?",
+                (last_uid, account, mailbox, uidvalidity),
+            )
+            self.stats["added"] += count
+        return count
+
+    @staticmethod
+    def terms(text: str) -> str:
+        """Запрос FTS5 из произвольного текста: каждое слово в кавычках, все слова обязательны."""
+        return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+    def search(
+        self,
+        query: str,                                    # запрос FTS5, например 'subject:отчёт бюджет*'
+        *,
+        account: Optional[str] = None,                 # только письма этого аккаунта
+        mailbox: Optional[str] = None,                 # только письма этой папки
+        limit: int = 20,
+        newest_first: bool = False,                    # по убыванию UID вместо релевантности (bm25)
+    ) -> list[IndexHit]:
+        """Найти письма; неверный синтаксис запроса — sqlite3.OperationalError."""
+        sql = (
+            "SELECT d.account, d.mailbox, d.uid, d.uidvalidity, d.subject, d.sender, d.date, "
+            "snippet(documents_fts, 2, '[', ']', '...', 12) "
+            "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid WHERE documents_fts MATCH ?"
+        )
+        args: list = [query]
+        if account is not None:
+            sql += " AND d.account = ?"
+            args.append(account)
+        if mailbox is not None:
+            sql += " AND d.mailbox = ?"
+            args.append(mailbox)
+        sql += (" ORDER BY d.uid DESC" if newest_first else " ORDER BY rank") + " LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            self.stats["queries"] += 1
+            rows = self._db.execute(sql, args).fetchall()
+        return [IndexHit(*row) for row in rows]
+
+    def count(self, account: Optional[str] = None, mailbox: Optional[str] = None) -> int:
+        """Число проиндексированных писем (всего, аккаунта или папки аккаунта)."""
+        sql, args = "SELECT COUNT(*) FROM documents WHERE 1", []
+        if account is not None:
+            sql += " AND account = ?"
+            args.append(account)
+        if mailbox is not None:
+            sql += " AND mailbox = ?"
+            args.append(mailbox)
+        with self._lock:
+            return self._db.execute(sql, args).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,242 @@
+"""Надёжная очередь исходящих писем в SQLite: письмо не теряется при падении процесса или сбое SMTP.
+
+В очередь кладётся письмо, уже готовое для SMTP DATA (CRLF, dot-stuffing), вместе
+с конвертом (отправитель, адресаты) — постановка в очередь стоит одну вставку в
+базу. Отправляют письма MailClient.process_queue и фоновые потоки
+MailClient.start_queue_workers; одну очередь могут разбирать несколько процессов.
+Взятое в работу письмо «арендуется» на lease секунд: если отправитель упал, не
+успев отчитаться, письмо снова становится доступным. Время следующей отправки на
+сервер хранится в той же базе, поэтому ограничение скорости общее для всех
+потоков и процессов. Письма, исчерпавшие попытки или окончательно отвергнутые
+сервером (5xx), получают статус dead — их можно просмотреть и вернуть в очередь.
+"""
+
+from __future__ import annotations
+
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id          INTEGER PRIMARY KEY,
+    account     TEXT NOT NULL,                -- чьими учётными данными отправлять
+    server      TEXT NOT NULL,                -- SMTP-сервер "хост:порт"
+    mail_from   TEXT NOT NULL,
+    rcpts       TEXT NOT NULL,                -- адресаты SMTP через перевод строки (включая Bcc)
+    data        BLOB NOT NULL,                -- письмо для DATA: CRLF, точки удвоены, в конце CRLF
+    status      TEXT NOT NULL DEFAULT 'queued',  -- queued / dead
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    next_try    REAL NOT NULL,                -- не раньше этого времени (time.time()): срок попытки или конец аренды
+    created     REAL NOT NULL,
+    last_error  TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, account, server, next_try);
+CREATE TABLE IF NOT EXISTS servers (
+    server      TEXT PRIMARY KEY,
+    next_send   REAL NOT NULL DEFAULT 0       -- раньше этого времени на сервер не отправлять (ограничение скорости)
+);
+"""
+
+_COLUMNS = "id, account, server, mail_from, rcpts, data, status, attempts, next_try, created, last_error"
+
+
+@dataclass(frozen=True)
+class QueuedMessage:
+    """Письмо из очереди: конверт, готовые байты и история попыток."""
+
+    id: int
+    account: str
+    server: str
+    mail_from: str
+    rcpts: list[str]
+    data: bytes
+    status: str                                        # "queued" или "dead"
+    attempts: int                                      # сколько раз письмо брали в отправку
+    next_try: float
+    created: float
+    last_error: str
+
+    @classmethod
+    def _from_row(cls, row: tuple) -> "QueuedMessage":
+        row = list(row)
+        row[4] = row[4].split("\n")
+        return cls(*row)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Повторы при временных ошибках: экспоненциальная задержка со случайным разбросом."""
+
+    max_attempts: int = 8                              # после стольких попыток письмо уходит в dead
+    backoff: float = 30.0                              # задержка после первой неудачи, секунд; дальше удваивается
+    max_backoff: float = 3600.0                        # потолок задержки
+    jitter: float = 0.5                                # доля задержки, на которую она случайно укорачивается
+
+    def delay(self, attempts: int) -> float:
+        """Задержка перед следующей попыткой после attempts неудачных."""
+        delay = min(self.max_backoff, self.backoff * 2 ** max(0, attempts - 1))
+        return delay * (1 - self.jitter * random.random())  # разброс: повторы разных писем не совпадают во времени
+
+
+class MailQueue:
+    """Потокобезопасная очередь исходящих писем в файле SQLite (":memory:" — в памяти процесса).
+
+    По умолчанию база пишется в режиме WAL с synchronous=NORMAL: письмо
+    переживает падение процесса, а постановка в очередь не ждёт fsync (порядка
+    сотни микросекунд). fsync=True — каждая запись сбрасывается на диск и
+    переживает отключение питания, ценой миллисекунд на письмо.
+    """
+
+    def __init__(self, path: str = ":memory:", *, fsync: bool = False) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        # Транзакции открываем сами (BEGIN IMMEDIATE): выдача письма должна быть атомарной и между процессами
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self._db.executescript(_SCHEMA)
+        self.stats = {"enqueued": 0, "sent": 0, "retries": 0, "dead": 0}
+
+    @contextmanager
+    def _transaction(self):
+        self._db.execute("BEGIN IMMEDIATE")            # сразу берём блокировку записи — без гонок с другими процессами
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def enqueue(self, account: str, server: str, mail_from: str, rcpts: Iterable[str], data: bytes) -> int:
+        """Поставить готовое письмо в очередь; вернуть его id."""
+        now = time.time()
+        with self._lock:
+            msg_id = self._db.execute(
+                "INSERT INTO outbox (account, server, mail_from, rcpts, data, next_try, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (account, server, mail_from, "\n".join(rcpts), data, now, now),
+            ).lastrowid
+            self.stats["enqueued"] += 1
+        return msg_id
+
+    def claim(
+        self,
+        account: str,
+        server: str,
+        *,
+        interval: float = 0.0,                         # не чаще одного письма в interval секунд на сервер
+        lease: float = 600.0,                          # на сколько секунд письмо скрывается от других отправителей
+    ) -> Optional[QueuedMessage]:
+        """Взять в отправку письмо, срок которого подошёл; None — таких нет или сервер ещё «занят».
+
+        Счётчик попыток увеличивается сразу: письмо, на котором отправитель
+        падает, не будет выдаваться бесконечно.
+        """
+        with self._lock, self._transaction():
+            now = time.time()
+            if interval > 0:
+                row = self._db.execute("SELECT next_send FROM servers WHERE server = ?", (server,)).fetchone()
+                if row is not None and row[0] > now:
+                    return None
+            row = self._db.execute(
+                "UPDATE outbox SET attempts = attempts + 1, next_try = ? WHERE id = ("
+                "SELECT id FROM outbox WHERE status = 'queued' AND account = ? AND server = ? AND next_try <= ? "
+                f"ORDER BY next_try, id LIMIT 1) RETURNING {_COLUMNS}",
+                (now + lease, account, server, now),
+            ).fetchone()
+            if row is not None and interval > 0:
+                self._db.execute(
+                    "INSERT INTO servers (server, next_send) VALUES (?, ?) "
+                    "ON CONFLICT (server) DO UPDATE SET next_send = excluded.next_send", (server, now + interval),
+                )
+        return None if row is None else QueuedMessage._from_row(row)
+
+    def wait_time(self, account: str, server: str) -> Optional[float]:
+        """Через сколько секунд claim() сможет выдать письмо (0 — уже); None — очередь пуста."""
+        with self._lock:
+            due = self._db.execute(
+                "SELECT MIN(next_try) FROM outbox WHERE status = 'queued' AND account = ? AND server = ?",
+                (account, server),
+            ).fetchone()[0]
+            if due is None:
+                return None
+            row = self._db.execute("SELECT next_send FROM servers WHERE server = ?", (server,)).fetchone()
+        return max(0.0, max(due, row[0] if row else 0.0) - time.time())
+
+    def complete(self, msg_id: int) -> None:
+        """Письмо принято сервером — убрать его из очереди."""
+        with self._lock:
+            self._db.execute("DELETE FROM outbox WHERE id = ?", (msg_id,))
+            self.stats["sent"] += 1
+
+    def retry(self, msg_id: int, error: str, delay: float, *, rcpts: Optional[Iterable[str]] = None) -> None:
+        """Повторить отправку через delay секунд (rcpts — только этим адресатам)."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET next_try = ?, last_error = ?, rcpts = COALESCE(?, rcpts) WHERE id = ?",
+                (time.time() + delay, error, None if rcpts is None else "\n".join(rcpts), msg_id),
+            )
+            self.stats["retries"] += 1
+
+    def bury(self, msg_id: int, error: str, *, rcpts: Optional[Iterable[str]] = None) -> None:
+        """Перевести письмо в dead (rcpts — сохранить только этих адресатов)."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'dead', last_error = ?, rcpts = COALESCE(?, rcpts) WHERE id = ?",
+                (error, None if rcpts is None else "\n".join(rcpts), msg_id),
+            )
+            self.stats["dead"] += 1
+
+    def bounce(self, msg_id: int, rcpts: Iterable[str], error: str) -> int:
+        """Отделить адресатов, окончательно отвергнутых сервером, в новое dead-письмо; вернуть его id."""
+        with self._lock:
+            dead_id = self._db.execute(
+                "INSERT INTO outbox (account, server, mail_from, rcpts, data, status, attempts, next_try, created, "
+                "last_error) SELECT account, server, mail_from, ?, data, 'dead', attempts, next_try, created, ? "
+                "FROM outbox WHERE id = ?", ("\n".join(rcpts), error, msg_id),
+            ).lastrowid
+            self.stats["dead"] += 1
+        return dead_id
+
+    def get(self, msg_id: int) -> Optional[QueuedMessage]:
+        """Письмо очереди по id (None — отправлено или не существует)."""
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM outbox WHERE id = ?", (msg_id,)).fetchone()
+        return None if row is None else QueuedMessage._from_row(row)
+
+    def dead_letters(self, account: Optional[str] = None) -> list[QueuedMessage]:
+        """Письма со статусом dead (старые первыми)."""
+        sql, args = f"SELECT {_COLUMNS} FROM outbox WHERE status = 'dead'", []
+        if account is not None:
+            sql += " AND account = ?"
+            args.append(account)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY id", args).fetchall()
+        return [QueuedMessage._from_row(row) for row in rows]
+
+    def requeue(self, msg_id: int) -> bool:
+        """Вернуть dead-письмо в очередь с обнулённым счётчиком попыток."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE outbox SET status = 'queued', attempts = 0, next_try = ?, last_error = '' "
+                "WHERE id = ? AND status = 'dead'", (time.time(), msg_id),
+            )
+        return cursor.rowcount == 1
+
+    def count(self, status: str = "queued", account: Optional[str] = None) -> int:
+        """Число писем с этим статусом (всего или аккаунта)."""
+        sql, args = "SELECT COUNT(*) FROM outbox WHERE status = ?", [status]
+        if account is not None:
+            sql += " AND account = ?"
+            args.append(account)
+        with self._lock:
+            return self._db.execute(sql, args).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
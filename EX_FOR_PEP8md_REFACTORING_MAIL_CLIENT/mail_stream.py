@@ -0,0 +1,284 @@
+"""Потоковый разбор MIME: письмо читается кусками, память не зависит от размера письма.
+
+email.parser.BytesFeedParser принимает письмо кусками, но всё равно собирает
+в памяти дерево со всеми содержимыми частей. Здесь BytesFeedParser разбирает
+только заголовки (письма и каждой части), а тела частей проходят через поиск
+границ multipart и потоковые декодеры base64 / quoted-printable: текстовые
+части выдаются по мере чтения, вложения пишутся во временные файлы или
+передаются в колбэк кусками.
+"""
+
+from __future__ import annotations
+
+import binascii
+import codecs
+import os
+import tempfile
+from dataclasses import dataclass, field
+from email.message import Message
+from email.parser import BytesFeedParser
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Union
+
+READ_SIZE = 64 * 1024       # размер куска при чтении из файла
+_MAX_LINE = 64 * 1024       # длиннее — строка не может быть границей, отдаём её как есть, не дожидаясь конца
+
+
+@dataclass
+class Attachment:
+    """Нетекстовая часть письма (или text/plain с Content-Disposition: attachment)."""
+
+    headers: Message                                   # заголовки части
+    content_type: str                                  # MIME-тип в нижнем регистре
+    filename: Optional[str] = None                     # имя файла из Content-Disposition / Content-Type
+    size: int = 0                                      # размер после декодирования, байт
+    path: Optional[str] = None                         # временный файл с содержимым (если не задан on_attachment)
+    complete: bool = field(default=False, repr=False)  # часть дочитана до конца
+
+
+class _Base64Decoder:
+    def __init__(self) -> None:
+        self._rest = b""
+
+    def decode(self, data: bytes) -> bytes:
+        data = self._rest + data.translate(None, b" \t\r\n")
+        usable = len(data) - len(data) % 4
+        self._rest = data[usable:]
+        return binascii.a2b_base64(data[:usable]) if usable else b""
+
+    def flush(self) -> bytes:
+        rest, self._rest = self._rest, b""
+        try:
+            return binascii.a2b_base64(rest + b"=" * (-len(rest) % 4)) if rest else b""
+        except binascii.Error:                         # обрезанный base64 — хвост отбрасываем
+            return b""
+
+
+class _QuotedPrintableDecoder:
+    """Декодирует только полные строки: мягкий перенос "=" в конце строки зависит от следующей."""
+
+    def __init__(self) -> None:
+        self._rest = b""
+
+    def decode(self, data: bytes) -> bytes:
+        data = self._rest + data
+        end = data.rfind(b"\n") + 1
+        self._rest = data[end:]
+        return binascii.a2b_qp(data[:end]) if end else b""
+
+    def flush(self) -> bytes:
+        rest, self._rest = self._rest, b""
+        return binascii.a2b_qp(rest)
+
+
+class _PlainDecoder:
+    def decode(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+_DECODERS = {"base64": _Base64Decoder, "quoted-printable": _QuotedPrintableDecoder}
+
+
+class MimeStreamParser:
+    """Разбор письма по кускам байт.
+
+    feed(data) возвращает список новых фрагментов текста (text/plain без вложений),
+    close() — оставшиеся. Заголовки письма — в headers (после их прочтения),
+    вложения — в attachments. Вложения пишутся во временные файлы в attachment_dir
+    (удаляются методом cleanup) или, если задан on_attachment, передаются в него
+    кусками: on_attachment(attachment, chunk); окончание части — вызов с chunk=b"".
+    """
+
+    def __init__(
+        self,
+        *,
+        attachment_dir: Optional[str] = None,
+        on_attachment: Optional[Callable[[Attachment, bytes], None]] = None,
+    ) -> None:
+        self.headers: Optional[Message] = None
+        self.attachments: list[Attachment] = []
+        self._attachment_dir = attachment_dir
+        self._on_attachment = on_attachment
+
+        self._buffer = b""                 # неполная последняя строка
+        self._continued = False            # начало буфера — продолжение длинной строки (не граница)
+        self._state = "headers"            # "headers" — заголовки части, "body" — тело листовой части, "skip" — пролог/эпилог
+        self._header_lines: list[bytes] = []
+        self._boundaries: list[bytes] = []  # стек границ вложенных multipart
+        self._body_lines: list[bytes] = []  # строки тела, ещё не переданные декодеру
+        self._pending_eol = b""            # перевод строки в конце тела: относится к границе, если она следует
+        self._decoder = None
+        self._text_decoder = None          # инкрементальный декодер кодировки для текстовой части
+        self._text_cr = ""                 # "\r" в конце предыдущего фрагмента текста
+        self._attachment: Optional[Attachment] = None
+        self._file: Optional[BinaryIO] = None
+        self._out: list[str] = []
+
+    # ---------- приём данных ----------
+    def feed(self, data: bytes) -> list[str]:
+        """Передать очередной кусок письма; вернуть появившиеся фрагменты текста."""
+        lines = (self._buffer + data).split(b"\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            self._line(line + b"\n")
+        if len(self._buffer) > _MAX_LINE and self._state != "headers":
+            self._line(self._buffer)
+            self._buffer = b""
+            self._continued = True
+        self._flush_body(boundary=False)
+        out, self._out = self._out, []
+        return out
+
+    def close(self) -> list[str]:
+        """Конец письма: дочитать хвост и завершить текущую часть."""
+        if self._buffer:
+            self._line(self._buffer)
+            self._buffer = b""
+        if self._state == "headers" and self._header_lines:
+            self._start_part()                             # письмо без тела — только заголовки
+        self._end_part(boundary=False)
+        out, self._out = self._out, []
+        return out
+
+    def parse(self, source: Union[bytes, BinaryIO, Iterable[bytes]]) -> Iterator[str]:
+        """Разобрать письмо из байт, файла (read) или итерируемого кусков; выдавать фрагменты текста."""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            chunks: Iterable[bytes] = (bytes(source),)
+        elif hasattr(source, "read"):
+            chunks = iter(lambda: source.read(READ_SIZE), b"")
+        else:
+            chunks = source
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.close()
+
+    def cleanup(self) -> None:
+        """Удалить временные файлы вложений."""
+        for attachment in self.attachments:
+            if attachment.path and os.path.exists(attachment.path):
+                os.remove(attachment.path)
+
+    # ---------- разбор строк ----------
+    def _line(self, line: bytes) -> None:
+        continued, self._continued = self._continued, False
+        if self._state == "headers":
+            if line in (b"\r\n", b"\n"):
+                self._start_part()
+            else:
+                self._header_lines.append(line)
+            return
+        if line.startswith(b"--") and not continued and self._boundaries and self._boundary(line):
+            return
+        if self._state == "body":
+            self._body_lines.append(line)
+
+    def _boundary(self, line: bytes) -> bool:
+        """Обработать строку-границу (RFC 2046, 5.1.1); False — это не граница."""
+        marker = line[2:].rstrip(b" \t\r\n")
+        for depth in range(len(self._boundaries) - 1, -1, -1):
+            boundary = self._boundaries[depth]
+            if marker == boundary or marker == boundary + b"--":
+                self._end_part(boundary=True)
+                del self._boundaries[depth + 1:]
+                if marker == boundary:
+                    self._state = "headers"                # следующая часть этого multipart
+                else:
+                    self._boundaries.pop()                 # закрывающая граница: дальше эпилог
+                    self._state = "skip"
+                return True
+        return False
+
+    def _start_part(self) -> None:
+        parser = BytesFeedParser()
+        parser.feed(b"".join(self._header_lines))
+        self._header_lines = []
+        headers = parser.close()
+        if self.headers is None:
+            self.headers = headers
+
+        if headers.get_content_maintype() == "multipart" and headers.get_boundary():
+            self._boundaries.append(headers.get_boundary().encode("latin-1"))
+            self._state = "skip"                           # пролог до первой границы
+            return
+
+        self._state = "body"
+        self._decoder = _DECODERS.get(str(headers.get("Content-Transfer-Encoding", "")).strip().lower(),
+                                      _PlainDecoder)()
+        disposition = headers.get_content_disposition()
+        if headers.get_content_type() == "text/plain" and disposition != "attachment":
+            charset = headers.get_content_charset() or "utf-8"
+            try:
+                self._text_decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+            except LookupError:                            # неизвестная кодировка
+                self._text_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            return
+
+        self._attachment = Attachment(
+            headers=headers,
+            content_type=headers.get_content_type(),
+            filename=headers.get_filename(),
+        )
+        self.attachments.append(self._attachment)
+        if self._on_attachment is None:
+            self._file = tempfile.NamedTemporaryFile(dir=self._attachment_dir, prefix="att-", delete=False)
+            self._attachment.path = self._file.name
+
+    # ---------- тело части ----------
+    def _flush_body(self, *, boundary: bool) -> None:
+        """Передать накопленные строки тела декодеру.
+
+        Последний перевод строки придерживается: если за ним граница, он ей и
+        принадлежит (RFC 2046), иначе будет выдан со следующим куском.
+        """
+        if self._state != "body" and not self._body_lines:
+            return
+        data = self._pending_eol + b"".join(self._body_lines)
+        self._body_lines = []
+        eol = b"\r\n" if data.endswith(b"\r\n") else b"\n" if data.endswith(b"\n") else b""
+        if eol:
+            data = data[:-len(eol)]
+        self._pending_eol = b"" if boundary else eol
+        if data:
+            self._write(self._decoder.decode(data))
+
+    def _end_part(self, *, boundary: bool) -> None:
+        if self._state != "body":
+            return
+        self._flush_body(boundary=boundary)
+        if not boundary and self._pending_eol:           # конец письма: перевод строки — часть тела
+            self._write(self._decoder.decode(self._pending_eol))
+        self._pending_eol = b""
+        self._write(self._decoder.flush())
+
+        if self._text_decoder is not None:
+            self._emit_text(self._text_decoder.decode(b"", final=True) + self._text_cr)
+            self._text_decoder, self._text_cr = None, ""
+        if self._attachment is not None:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            else:
+                self._on_attachment(self._attachment, b"")
+            self._attachment.complete = True
+            self._attachment = None
+        self._state = "skip"
+
+    def _write(self, data: bytes) -> None:
+        if not data:
+            return
+        if self._text_decoder is not None:
+            text = self._text_cr + self._text_decoder.decode(data)
+            self._text_cr = "\r" if text.endswith("\r") else ""  # "\r\n" может разорваться между кусками
+            self._emit_text(text[:-1] if self._text_cr else text)
+        elif self._attachment is not None:
+            self._attachment.size += len(data)
+            if self._file is not None:
+                self._file.write(data)
+            else:
+                self._on_attachment(self._attachment, data)
+
+    def _emit_text(self, text: str) -> None:
+        if text:
+            self._out.append(text.replace("\r\n", "\n"))
@@ -0,0 +1,1297 @@
+import unittest
+import unittest.mock
+import asyncio
+import base64
+import email
+import email.policy
+import imaplib
+import io
+import os, sys
+import re
+import select
+import shlex
+import smtplib
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import tracemalloc
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from email.message import EmailMessage
+
+import mail_client_ref
+from mail_client_ref import MailClient
+from mail_client_async import AsyncMailClient, AsyncSmtpError
+from mail_fleet import FetchTarget, MailboxFleet
+from mail_queue import RetryPolicy
+from mail_stream import MimeStreamParser
+
+
+# === ЛОКАЛЬНЫЙ ПОДСТАВНОЙ SMTP-СЕРВЕР ===
+# Понимает ровно столько SMTP, сколько нужно smtplib: EHLO, AUTH PLAIN, MAIL/RCPT/DATA,
+# NOOP, RSET, QUIT. Считает соединения и логины, чтобы проверять переиспользование сессий.
+class FakeSmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, text: str) -> None:
+        self.wfile.write(text.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        # Ответы на конвейерные команды идут отдельными мелкими записями — без TCP_NODELAY
+        # алгоритм Нейгла задерживал бы каждую до подтверждения предыдущей
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with server.lock:
+            server.connections += 1
+            server.sockets.append(self.connection)
+        self.reply("220 fake ESMTP")
+        mail_from, rcpts = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode().rstrip("\r\n")
+            verb = cmd.split(" ", 1)[0].upper()
+            if verb == server.stall:                            # «зависший» сервер: команды читает, не отвечает
+                while self.rfile.readline():
+                    pass
+                return
+            if verb == "EHLO":
+                extra = "250-PIPELINING\r\n" if server.pipelining else ""
+                self.reply("250-fake\r\n" + extra + "250-AUTH PLAIN\r\n250 8BITMIME")
+            elif verb == "AUTH":
+                # AUTH PLAIN <base64("\0user\0password")>
+                _, user, password = base64.b64decode(cmd.split()[2]).split(b"\0")
+                if (user.decode(), password.decode()) != (server.username, server.password):
+                    self.reply("535 bad credentials")
+                    continue
+                with server.lock:
+                    server.logins += 1
+                self.reply("235 ok")
+            elif verb == "MAIL":
+                mail_from, rcpts = cmd[10:].strip("<>"), []
+                self.reply("250 ok")
+            elif verb == "RCPT":
+                rcpt = cmd[8:].strip("<>")
+                if rcpt.startswith("reject"):
+                    self.reply("550 no such user")  # адреса reject* сервер отклоняет
+                    continue
+                if rcpt.startswith("busy"):
+                    self.reply("450 mailbox busy")  # адреса busy* — временный отказ
+                    continue
+                rcpts.append(rcpt)
+                self.reply("250 ok")
+            elif verb == "DATA":
+                if not rcpts:
+                    self.reply("554 no valid recipients")
+                    continue
+                self.reply("354 go ahead")
+                data, size = [], 0
+                while True:
+                    chunk = self.rfile.readline()
+                    if chunk in (b".\r\n", b""):
+                        break
+                    size += len(chunk)
+                    if server.keep_data:                        # без keep_data запоминаем только размер письма
+                        data.append(chunk[1:] if chunk.startswith(b"..") else chunk)  # снимаем dot-stuffing
+                with server.lock:
+                    server.messages.append((mail_from, rcpts, b"".join(data) if server.keep_data else size))
+                self.reply("250 queued")
+            elif verb in ("NOOP", "RSET"):
+                with server.lock:
+                    server.noops += verb == "NOOP"
+                self.reply("250 ok")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class FakeSmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, username="user@example.com", password="secret", pipelining=True):
+        super().__init__(("127.0.0.1", 0), FakeSmtpHandler)
+        self.username, self.password = username, password
+        self.pipelining = pipelining
+        self.keep_data = True
+        self.stall = None                                       # команда, после которой сервер перестаёт отвечать
+        self.lock = threading.Lock()
+        self.connections = self.logins = self.noops = 0
+        self.messages = []
+        self.sockets = []
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def drop_connections(self) -> None:
+        # Имитация обрыва: сервер закрывает все открытые сессии
+        with self.lock:
+            sockets, self.sockets = self.sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.drop_connections()
+        self.server_close()
+
+
+# === ЛОКАЛЬНЫЙ ПОДСТАВНОЙ IMAP-СЕРВЕР ===
+# Подмножество RFC 3501, которого хватает imaplib и AsyncMailClient: CAPABILITY, LOGIN,
+# SELECT, UID SEARCH (ALL / UNSEEN / HEADER Subject), UID FETCH (RFC822), NOOP, LOGOUT.
+def make_raw_message(subject: str, body: str = "text", sender: str = "from@example.com") -> bytes:
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = "user@example.com"
+    msg["Subject"] = subject
+    msg.set_content(body)
+    return msg.as_bytes()
+
+
+class FakeImapHandler(socketserver.StreamRequestHandler):
+    def send(self, data) -> None:
+        self.wfile.write(data if isinstance(data, bytes) else data.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with server.lock:
+            server.connections += 1
+            server.sockets.append(self.connection)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        self.send("* OK fake IMAP4rev1 ready")
+        selected = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            time.sleep(server.delay)                    # имитация медленного сервера
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            cmd, _, args = rest.partition(" ")
+            cmd = cmd.upper()
+            with server.lock:
+                server.commands.append(rest)
+            if cmd == "UID":
+                sub, _, args = args.partition(" ")
+                cmd = "UID " + sub.upper()
+            if cmd == server.stall:
+                while self.rfile.readline():
+                    pass
+                return
+            if cmd == "CAPABILITY":
+                self.send("* CAPABILITY " + " ".join(server.capabilities))
+            elif cmd == "LOGIN":
+                user, password = shlex.split(args)
+                if (user, password) != (server.username, server.password):
+                    self.send(f"{tag} NO [AUTHENTICATIONFAILED] bad credentials")
+                    continue
+                with server.lock:
+                    server.logins += 1
+            elif cmd in ("SELECT", "EXAMINE"):
+                selected = shlex.split(args)[0]
+                box = server.mailboxes.setdefault(selected, [])
+                self.send(f"* {len(box)} EXISTS")
+                self.send(f"* OK [UIDVALIDITY {server.uidvalidity}] UIDs valid")
+                self.send(f"* OK [UIDNEXT {server.uidnext(selected)}] next")
+                if "CONDSTORE" in server.capabilities:
+                    self.send(f"* OK [HIGHESTMODSEQ {server.modseq}] modseq")
+            elif cmd == "UID SEARCH":
+                if args.upper().startswith("RETURN (MAX) ") and "ESEARCH" in server.capabilities:
+                    uids = [m["uid"] for m in server.search(selected, args[len("RETURN (MAX) "):])]
+                    self.send(f'* ESEARCH (TAG "{tag}") UID' + (f" MAX {max(uids)}" if uids else ""))
+                else:
+                    uids = [str(m["uid"]) for m in server.search(selected, args)]
+                    self.send("* SEARCH" + "".join(" " + u for u in uids))
+            elif cmd == "UID FETCH":
+                uid_set, _, items = args.partition(" ")
+                changed = re.search(r"\s*\(CHANGEDSINCE (\d+)\)$", items)  # модификатор CONDSTORE
+                if changed:
+                    items = items[:changed.start()] + " MODSEQ"
+                box = server.mailboxes.get(selected, [])
+                for seq, m in enumerate(box, 1):
+                    if not server.uid_in_set(m["uid"], uid_set, box):
+                        continue
+                    if changed and m["modseq"] <= int(changed.group(1)):
+                        continue
+                    self.send(f"* {seq} FETCH (".encode() + server.fetch_items(m, items) + b")\r\n")
+            elif cmd == "IDLE" and "IDLE" in server.capabilities:
+                # Ждём DONE, а о новых письмах в выбранной папке сообщаем через EXISTS
+                self.send("+ idling")
+                known = len(server.mailboxes.get(selected, []))
+                while True:
+                    readable, _, _ = select.select([self.connection], [], [], 0.02)
+                    count = len(server.mailboxes.get(selected, []))
+                    if count > known:
+                        self.send(f"* {count} EXISTS")
+                        known = count
+                    if readable:
+                        if not self.rfile.readline():
+                            return
+                        break
+            elif cmd == "LOGOUT":
+                self.send("* BYE logging out")
+                self.send(f"{tag} OK LOGOUT completed")
+                return
+            elif cmd not in ("NOOP", "CHECK"):
+                self.send(f"{tag} BAD unknown command")
+                continue
+            self.send(f"{tag} OK {cmd} completed")
+
+    def finish(self):
+        with self.server.lock:
+            self.server.active -= 1
+        super().finish()
+
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, username="user@example.com", password="secret"):
+        super().__init__(("127.0.0.1", 0), FakeImapHandler)
+        self.username, self.password = username, password
+        self.capabilities = ["IMAP4rev1"]
+        self.lock = threading.Lock()
+        self.connections = self.logins = self.bytes_sent = 0
+        self.active = self.max_active = 0               # открытые сейчас / максимум одновременных соединений
+        self.delay = 0                                  # задержка перед ответом на каждую команду, с
+        self.stall = None                               # команда, после которой сервер перестаёт отвечать
+        self.commands = []
+        self.sockets = []
+        self.uidvalidity = 1
+        self.modseq = 0
+        self.mailboxes = {"INBOX": []}
+
+    port = FakeSmtpServer.port
+    drop_connections = FakeSmtpServer.drop_connections
+    __enter__ = FakeSmtpServer.__enter__
+    __exit__ = FakeSmtpServer.__exit__
+
+    def add_message(self, raw: bytes, mailbox: str = "INBOX", seen: bool = False) -> int:
+        with self.lock:
+            box = self.mailboxes.setdefault(mailbox, [])
+            uid = self.uidnext(mailbox)
+            self.modseq += 1
+            box.append({"uid": uid, "raw": raw, "seen": seen, "modseq": self.modseq})
+            return uid
+
+    def set_seen(self, uid: int, mailbox: str = "INBOX", seen: bool = True) -> None:
+        with self.lock:
+            for m in self.mailboxes[mailbox]:
+                if m["uid"] == uid:
+                    self.modseq += 1
+                    m["seen"], m["modseq"] = seen, self.modseq
+
+    def fetch_items(self, m, items: str) -> bytes:
+        # Элементы ответа FETCH; литерал с телом — последним, как делают многие серверы
+        names = re.findall(r"BODY(?:\.PEEK)?\[[^\]]*\]|[A-Z0-9.]+", items.upper())
+        out, literals = [f"UID {m['uid']}"], []
+        for name in dict.fromkeys(names):
+            if name == "FLAGS":
+                out.append("FLAGS (\\Seen)" if m["seen"] else "FLAGS ()")
+            elif name == "MODSEQ":
+                out.append(f"MODSEQ ({m['modseq']})")
+            elif name == "BODYSTRUCTURE":
+                out.append("BODYSTRUCTURE " + self.bodystructure(email.message_from_bytes(m["raw"])))
+            elif name.startswith("BODY"):
+                section = name[name.index("[") + 1:-1]
+                data = self.section(m["raw"], section) if section else m["raw"]
+                reply_name = "BODY[" + section + "]"
+                literals.append(f" {reply_name} {{{len(data)}}}\r\n".encode() + data)
+            elif name == "RFC822":
+                literals.append(f" RFC822 {{{len(m['raw'])}}}\r\n".encode() + m["raw"])
+        with self.lock:
+            self.bytes_sent += sum(len(x) for x in literals)
+        return " ".join(out).encode() + b"".join(literals)
+
+    @staticmethod
+    def section(raw: bytes, section: str) -> bytes:
+        # BODY[HEADER.FIELDS (...)] и BODY[1], BODY[2.1] ... (содержимое в закодированном виде)
+        msg = email.message_from_bytes(raw)
+        fields = re.match(r"HEADER\.FIELDS \((.*)\)$", section)
+        if fields:
+            wanted = set(fields.group(1).lower().split())
+            lines = [f"{k}: {v}" for k, v in msg.items() if k.lower() in wanted]
+            return ("\r\n".join(lines) + "\r\n\r\n").encode()
+        for number in section.split("."):
+            if msg.is_multipart():
+                msg = msg.get_payload()[int(number) - 1]
+        return msg.get_payload().encode()
+
+    @classmethod
+    def bodystructure(cls, part) -> str:
+        if part.is_multipart():
+            return "(" + "".join(cls.bodystructure(p) for p in part.get_payload()) + f' "{part.get_content_subtype()}")'
+        params = " ".join(f'"{k}" "{v}"' for k, v in part.get_params()[1:]) if part.get_params() else ""
+        payload = part.get_payload().encode()
+        fields = (f'"{part.get_content_maintype()}" "{part.get_content_subtype()}" ({params or "NIL"}) NIL NIL '
+                  f'"{part.get("Content-Transfer-Encoding", "7bit")}" {len(payload)}')
+        if part.get_content_maintype() == "text":
+            fields += " " + str(payload.count(b"\n"))
+        disposition = part.get_content_disposition()
+        if disposition:
+            filename = part.get_param("filename", header="Content-Disposition")
+            fields += f' NIL ("{disposition}" ' + (f'("filename" "{filename}")' if filename else "NIL") + ")"
+        return "(" + fields + ")"
+
+    def uidnext(self, mailbox: str) -> int:
+        box = self.mailboxes.get(mailbox, [])
+        return box[-1]["uid"] + 1 if box else 1
+
+    def search(self, mailbox, criteria: str):
+        found = []
+        subject = re.search(r'HEADER Subject "((?:[^"\\]|\\.)*)"', criteria, re.I)
+        # "UID n:*" при отсутствии писем с UID >= n даёт последнее письмо (как у настоящих серверов)
+        uid_set = re.match(r"UID ([\d:*,]+)", criteria)
+        box = self.mailboxes.get(mailbox, [])
+        for m in box:
+            if uid_set and not self.uid_in_set(m["uid"], uid_set.group(1), box):
+                continue
+            if "UNSEEN" in criteria.upper() and m["seen"]:
+                continue
+            if subject:
+                msg = email.message_from_bytes(m["raw"])
+                needle = subject.group(1).replace('\\"', '"').lower()
+                if needle not in str(msg.get("Subject", "")).lower():
+                    continue
+            found.append(m)
+        return found
+
+    @staticmethod
+    def uid_in_set(uid: int, uid_set: str, box) -> bool:
+        top = box[-1]["uid"] if box else 0
+        for part in uid_set.split(","):
+            lo, _, hi = part.partition(":")
+            lo = top if lo == "*" else int(lo)
+            hi = lo if not hi else (top if hi == "*" else int(hi))
+            if min(lo, hi) <= uid <= max(lo, hi):
+                return True
+        return False
+
+
+def make_client(server: FakeSmtpServer = None, imap: FakeImapServer = None, **kwargs) -> MailClient:
+    # Клиент без TLS, направленный на локальные подставные серверы
+    base = server or imap
+    return MailClient(
+        username=base.username,
+        password=base.password,
+        smtp_server="127.0.0.1",
+        smtp_port=server.port if server else 0,
+        imap_server="127.0.0.1",
+        imap_port=imap.port if imap else 0,
+        smtp_use_tls=False,
+        imap_use_ssl=False,
+        timeout=5,
+        **kwargs,
+    )
+
+
+# === ТЕСТЫ ОТПРАВКИ ===
+class TestSendEmail(unittest.TestCase):
+    def test_without_pool_connects_per_message(self):
+        with FakeSmtpServer() as server:
+            client = make_client(server)
+            client.send_email(["a@example.com"], "s1", "b1", bcc=["hidden@example.com"])
+            client.send_email(["a@example.com"], "s2", "b2")
+            self.assertEqual((server.connections, server.logins), (2, 2))
+            # Bcc попадает в список адресатов SMTP, но не в заголовки письма
+            _, rcpts, data = server.messages[0]
+            self.assertEqual(rcpts, ["a@example.com", "hidden@example.com"])
+            self.assertNotIn(b"hidden@example.com", data)
+
+    def test_pool_reuses_session(self):
+        with FakeSmtpServer() as server:
+            with make_client(server, smtp_pool_size=1) as client:
+                for i in range(5):
+                    client.send_email(["a@example.com"], f"s{i}", "body")
+                self.assertEqual(len(server.messages), 5)
+                self.assertEqual((server.connections, server.logins), (1, 1))
+                self.assertEqual(client.smtp_pool.stats["reused"], 4)
+
+    def test_pool_reconnects_after_drop(self):
+        with FakeSmtpServer() as server:
+            with make_client(server, smtp_pool_size=1) as client:
+                client.send_email(["a@example.com"], "s1", "body")
+                server.drop_connections()
+                # Разрыв замечается при отправке, письмо уходит по новой сессии
+                client.send_email(["a@example.com"], "s2", "body")
+                self.assertEqual(len(server.messages), 2)
+                self.assertEqual(server.connections, 2)
+
+    def test_pool_checks_idle_session_with_noop(self):
+        with FakeSmtpServer() as server:
+            with make_client(server, smtp_pool_size=1) as client:
+                client.send_email(["a@example.com"], "s1", "body")
+                client.smtp_pool._check_after = 0  # проверять NOOP при каждой выдаче
+                client.send_email(["a@example.com"], "s2", "body")
+                self.assertEqual(server.noops, 1)
+                server.drop_connections()
+                client.send_email(["a@example.com"], "s3", "body")
+                self.assertEqual(client.smtp_pool.stats["discarded"], 1)
+                self.assertEqual(len(server.messages), 3)
+
+
+class TestFileAttachments(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def write_file(self, name, data):
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_path_and_file_object(self):
+        content = os.urandom(200_001)                          # не кратно 57 — проверяем хвост base64
+        path = self.write_file("a.bin", content)
+        for pipelining in (True, False):
+            with self.subTest(pipelining=pipelining), FakeSmtpServer(pipelining=pipelining) as server, \
+                    open(path, "rb") as f:
+                client = make_client(server)
+                attachments = [("a.bin", path, "application/octet-stream"),
+                               ("b.bin", f, "application/octet-stream"),
+                               ("c.txt", b"small", "text/plain")]
+                client.send_email(["a@example.com"], "files", "see attached", attachments=attachments)
+                msg = email.message_from_bytes(server.messages[0][2])
+                parts = msg.get_payload()
+                self.assertEqual(MailClient.extract_text(msg), "see attached")
+                self.assertEqual([p.get_filename() for p in parts[1:]], ["a.bin", "b.bin", "c.txt"])
+                self.assertEqual(parts[1].get_payload(decode=True), content)
+                self.assertEqual(parts[2].get_payload(decode=True), content)
+                self.assertEqual(parts[3].get_payload(decode=True), b"small")
+
+    def test_memory_does_not_grow_with_attachment(self):
+        path = self.write_file("big.bin", os.urandom(3_000_000))
+        with FakeSmtpServer() as server:
+            server.keep_data = False
+            client = make_client(server)
+            tracemalloc.start()
+            try:
+                client.send_email(["a@example.com"], "big", "body", attachments=[("big.bin", path, "application/zip")])
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertGreater(server.messages[0][2], 3_000_000 * 4 // 3)
+            self.assertLess(peak, 1_000_000)                    # вложение 3 МБ (4 МБ в base64) в памяти целиком не бывает
+
+
+class TestSendMany(unittest.TestCase):
+    def make_batch(self, n):
+        batch = [{"recipients": [f"user{i}@example.com"], "subject": f"s{i}", "body": f"line\n.{i}"}
+                 for i in range(n)]
+        batch[3]["recipients"] = ["reject@example.com"]                  # отклонённое письмо
+        batch[5]["recipients"] = ["reject@example.com", "ok@example.com"]  # частичный успех
+        return batch
+
+    def check_batch(self, server, results, n):
+        self.assertEqual([r.index for r in results], list(range(n)))
+        self.assertFalse(results[3].ok)
+        self.assertIsInstance(results[3].error, smtplib.SMTPRecipientsRefused)
+        self.assertTrue(results[5].ok)
+        self.assertEqual(list(results[5].refused), ["reject@example.com"])
+        self.assertEqual(sum(r.ok for r in results), n - 1)
+        self.assertEqual(len(server.messages), n - 1)
+
+    def test_pipelined_batch(self):
+        with FakeSmtpServer() as server:
+            client = make_client(server)
+            results = client.send_many(self.make_batch(20), concurrency=3)
+            self.check_batch(server, results, 20)
+            self.assertLessEqual(server.logins, 3)
+            # Строка, начинающаяся с точки, пережила dot-stuffing
+            self.assertTrue(any(b"\r\n.1\r\n" in data for _, _, data in server.messages))
+
+    def test_without_pipelining(self):
+        with FakeSmtpServer(pipelining=False) as server:
+            client = make_client(server)
+            results = client.send_many(self.make_batch(10), concurrency=2)
+            self.check_batch(server, results, 10)
+
+    def test_ready_messages_and_client_pool(self):
+        msg = EmailMessage()
+        msg["To"] = "a@example.com"
+        msg["Bcc"] = "hidden@example.com"
+        msg["Subject"] = "готовое письмо"
+        msg.set_content("текст")
+        with FakeSmtpServer() as server:
+            with make_client(server, smtp_pool_size=1) as client:
+                results = client.send_many([msg, msg], concurrency=4)
+                self.assertTrue(all(r.ok for r in results))
+                self.assertEqual(server.connections, 1)
+            _, rcpts, data = server.messages[0]
+            self.assertEqual(rcpts, ["a@example.com", "hidden@example.com"])
+            self.assertNotIn(b"hidden@example.com", data)
+
+
+class TestMessageTemplate(unittest.TestCase):
+    attachments = [("отчёт.pdf", b"%PDF" + bytes(range(256)) * 40, "application/pdf")]
+
+    def test_render_matches_build_message(self):
+        template = mail_client_ref.MessageTemplate("Отправитель <user@example.com>", "Новости за октябрь",
+                                                   "Привет!\n.строка с точкой\n", attachments=self.attachments)
+        prepared = template.render(["a@example.com"], cc=["c@example.com"], bcc=["hidden@example.com"],
+                                   headers={"List-Unsubscribe": "<mailto:unsub@example.com>"})
+        expected, rcpts = mail_client_ref.build_message("Отправитель <user@example.com>", ["a@example.com"],
+                                                       "Новости за октябрь", "Привет!\n.строка с точкой\n",
+                                                       cc=["c@example.com"], bcc=["hidden@example.com"],
+                                                       attachments=self.attachments)
+        self.assertEqual(prepared.rcpts, rcpts)
+        self.assertTrue(prepared.data.endswith(b"\r\n"))
+        self.assertNotIn(b"hidden@example.com", prepared.data)
+        self.assertIn(b"\r\n..\xd1\x81", prepared.data)         # точка в начале строки уже удвоена
+        parsed = email.message_from_bytes(prepared.data.replace(b"\r\n..", b"\r\n."),
+                                          policy=email.policy.default)
+        for name in ("From", "To", "Cc", "Subject"):
+            self.assertEqual(str(parsed[name]), str(expected[name]))
+        self.assertEqual(parsed["List-Unsubscribe"], "<mailto:unsub@example.com>")
+        self.assertEqual(parsed.get_body(("plain",)).get_content().replace("\r\n", "\n"),
+                         expected.get_body(("plain",)).get_content())
+        [part] = parsed.iter_attachments()
+        self.assertEqual(part.get_filename(), "отчёт.pdf")
+        self.assertEqual(part.get_content(), self.attachments[0][1])
+
+    def test_send_rendered_variants(self):
+        for pipelining in (True, False):
+            with self.subTest(pipelining=pipelining), FakeSmtpServer(pipelining=pipelining) as server:
+                client = make_client(server)
+                template = client.template("Рассылка", "текст\n", attachments=self.attachments)
+                batch = [template.render([f"user{i}@example.com"]) for i in range(5)]
+                batch[2] = template.render(["reject@example.com"])
+                results = client.send_many(batch, concurrency=2)
+                self.assertEqual([r.ok for r in results], [True, True, False, True, True])
+                client.send_template(template, ["last@example.com"], bcc=["hidden@example.com"])
+                self.assertEqual(len(server.messages), 5)
+                _, rcpts, data = server.messages[-1]
+                self.assertEqual(rcpts, ["last@example.com", "hidden@example.com"])
+                self.assertIn(b"To: last@example.com\r\n", data)
+                self.assertNotIn(b"hidden@example.com", data)
+
+
+class TestMailQueue(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.queue_path = os.path.join(tmp.name, "outbox.sqlite")
+
+    def wait_empty(self, client, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while client.queue.count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(client.queue.count(), 0)
+
+    def test_background_workers_drain_queue(self):
+        with FakeSmtpServer() as server:
+            with make_client(server, queue_path=self.queue_path) as client:
+                client.start_queue_workers(2)
+                template = client.template("Рассылка", "текст\n.точка\n")
+                ids = [client.enqueue({"recipients": [f"user{i}@example.com"], "subject": f"s{i}", "body": "b"})
+                       for i in range(5)]
+                ids += [client.enqueue(template.render([f"t{i}@example.com"])) for i in range(5)]
+                self.assertEqual(len(set(ids)), 10)
+                self.wait_empty(client)
+                client.stop_queue_workers()
+                self.assertFalse(client._queue_workers)
+            self.assertEqual(len(server.messages), 10)
+            self.assertLessEqual(server.logins, 2)                # сессии переиспользуются между письмами
+            self.assertTrue(any(b"\r\n.\xd1\x82" in data for _, _, data in server.messages))
+
+    def test_wakeup_between_workers_not_lost(self):
+        # enqueue срабатывает сразу после того, как один из отправителей проснулся:
+        # письмо уходит без ожидания poll_interval
+        with FakeSmtpServer() as server:
+            with make_client(server, queue_path=self.queue_path) as client:
+                wakeup = client._queue_wakeup
+                pending = ["second"]
+
+                class RacingEvent(threading.Event):
+                    def wait(self, timeout=None):
+                        woken = wakeup.wait(timeout)
+                        if woken and pending:
+                            client.enqueue({"recipients": ["b@example.com"], "subject": pending.pop(), "body": "b"})
+                        return woken
+
+                    def set(self):
+                        wakeup.set()
+
+                    def clear(self):
+                        wakeup.clear()
+
+                client._queue_wakeup = RacingEvent()
+                client.start_queue_workers(2, poll_interval=30)
+                client.enqueue({"recipients": ["a@example.com"], "subject": "first", "body": "b"})
+                self.wait_empty(client, timeout=2)
+                self.assertFalse(pending)
+            self.assertEqual(len(server.messages), 2)
+
+    def test_retries_and_dead_letters(self):
+        policy = RetryPolicy(max_attempts=2, backoff=0.05, jitter=0)
+        with FakeSmtpServer() as server:
+            # Письмо переживает сбой: неверный пароль — ошибка временная, письмо ждёт в очереди
+            with make_client(server, queue_path=self.queue_path) as client:
+                client.password = "wrong"
+                msg_id = client.enqueue({"recipients": ["a@example.com"], "subject": "s", "body": "b"})
+                self.assertEqual(client.process_queue(policy=policy), 1)
+                item = client.queue.get(msg_id)
+                self.assertEqual((item.status, item.attempts), ("queued", 1))
+                self.assertIn("535", item.last_error)
+                self.assertEqual(client.process_queue(policy=policy), 0)  # срок повтора ещё не подошёл
+            with make_client(server, queue_path=self.queue_path) as client:  # новый процесс с верным паролем
+                time.sleep(0.06)
+                self.assertEqual(client.process_queue(policy=policy), 1)
+                self.assertIsNone(client.queue.get(msg_id))
+                self.assertEqual(len(server.messages), 1)
+
+                # Частичный отказ: reject — окончательно (dead), busy — повтор, потом dead по числу попыток
+                msg_id = client.enqueue({"recipients": ["ok@example.com", "reject@example.com", "busy@example.com"],
+                                         "subject": "s", "body": "b"})
+                client.process_queue(policy=policy)
+                self.assertEqual(server.messages[-1][1], ["ok@example.com"])
+                self.assertEqual(client.queue.get(msg_id).rcpts, ["busy@example.com"])
+                time.sleep(0.06)
+                client.process_queue(policy=policy)
+                busy, reject = sorted(client.queue.dead_letters(), key=lambda d: d.rcpts)
+                self.assertEqual((busy.rcpts, reject.rcpts), (["busy@example.com"], ["reject@example.com"]))
+                self.assertIn("450", busy.last_error)
+                self.assertIn("550", reject.last_error)
+                self.assertEqual(len(server.messages), 1 + 1)      # ok@ получил письмо один раз
+
+                # Письмо, отвергнутое целиком кодом 5xx, сразу уходит в dead; requeue возвращает его
+                msg_id = client.enqueue({"recipients": ["reject@example.com"], "subject": "s", "body": "b"})
+                client.process_queue(policy=policy)
+                self.assertEqual((client.queue.get(msg_id).status, client.queue.get(msg_id).attempts), ("dead", 1))
+                self.assertTrue(client.queue.requeue(msg_id))
+                self.assertEqual(client.queue.count(), 1)
+
+    def test_rate_limit_per_server(self):
+        with FakeSmtpServer() as server:
+            with make_client(server, queue_path=self.queue_path, smtp_pool_size=1) as client:
+                for i in range(5):
+                    client.enqueue({"recipients": [f"u{i}@example.com"], "subject": "s", "body": "b"})
+                start = time.monotonic()
+                client.start_queue_workers(3, rate=25)
+                self.wait_empty(client)
+                self.assertGreaterEqual(time.monotonic() - start, 4 / 25 - 0.01)
+            self.assertEqual(len(server.messages), 5)
+
+
+# === ТЕСТЫ ПОЛУЧЕНИЯ ===
+class TestFetchLatest(unittest.TestCase):
+    def test_fetch_latest_with_filters(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("Monthly Report", "old"), seen=True)
+            imap.add_message(make_raw_message("Other"))
+            imap.add_message(make_raw_message("Monthly Report", "new"))
+            client = make_client(imap=imap)
+            self.assertEqual(client.fetch_latest()["Subject"], "Monthly Report")
+            msg = client.fetch_latest(subject="monthly")
+            self.assertEqual(MailClient.extract_text(msg), "new")
+            self.assertEqual(client.fetch_latest(unread_only=True, subject="Other")["Subject"], "Other")
+            self.assertIsNone(client.fetch_latest(subject="missing"))
+
+    def test_imap_pool_reuses_session_and_selection(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("a"))
+            imap.add_message(make_raw_message("b"), mailbox="Archive")
+            with make_client(imap=imap, imap_pool_size=1) as client:
+                for _ in range(3):
+                    self.assertEqual(client.fetch_latest()["Subject"], "a")
+                self.assertEqual(client.fetch_latest("Archive")["Subject"], "b")
+                self.assertEqual((imap.connections, imap.logins), (1, 1))
+                selects = [c for c in imap.commands if c.startswith("SELECT")]
+                self.assertEqual(len(selects), 2)        # INBOX один раз, затем Archive
+                self.assertEqual(client.imap_pool.stats["selects_skipped"], 2)
+
+    def test_imap_pool_reconnects_after_drop(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("a"))
+            with make_client(imap=imap, imap_pool_size=1) as client:
+                client.fetch_latest()
+                imap.drop_connections()
+                self.assertEqual(client.fetch_latest()["Subject"], "a")
+                self.assertEqual(imap.logins, 2)
+                self.assertEqual(client.imap_pool.stats["discarded"], 1)
+
+    def searches(self, imap):
+        return [c for c in imap.commands if c.upper().startswith("UID SEARCH")]
+
+    def test_esearch_returns_only_max(self):
+        with FakeImapServer() as imap:
+            imap.capabilities.append("ESEARCH")
+            for i in range(5):
+                imap.add_message(make_raw_message("Report" if i % 2 else "Other", f"r{i}"))
+            client = make_client(imap=imap)
+            self.assertEqual(client.extract_text(client.fetch_latest(subject="report")), "r3")
+            self.assertIsNone(client.fetch_latest(subject="missing"))
+            self.assertTrue(all(c.startswith("UID SEARCH RETURN (MAX) ") for c in self.searches(imap)))
+
+    def test_fallback_searches_recent_uid_windows(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("Report", "old"))
+            for i in range(19):
+                imap.add_message(make_raw_message(f"other{i}"))
+            client = make_client(imap=imap)
+            with unittest.mock.patch.object(mail_client_ref, "_SEARCH_WINDOW", 4):
+                self.assertEqual(client.extract_text(client.fetch_latest(subject="report")), "old")
+                self.assertIsNone(client.fetch_latest(subject="missing"))
+            # Окна 17:*, 9:16, 1:8 — каждый ответ содержит не больше UID, чем окно
+            self.assertEqual([c.split()[3] for c in self.searches(imap)[:3]], ["17:*", "9:16", "1:8"])
+
+    def test_search_result_cache_invalidation(self):
+        with FakeImapServer() as imap:
+            imap.capabilities.append("CONDSTORE")
+            imap.add_message(make_raw_message("Report", "first"))
+            second = imap.add_message(make_raw_message("Report", "second"))
+            client = make_client(imap=imap)
+            latest_unread = lambda: client.extract_text(client.fetch_latest(subject="Report", unread_only=True))
+            self.assertEqual(latest_unread(), "second")
+            self.assertEqual(latest_unread(), "second")
+            self.assertEqual(len(self.searches(imap)), 1)  # второй вызов — без поиска
+            imap.set_seen(second)                          # изменились флаги — HIGHESTMODSEQ вырос
+            self.assertEqual(latest_unread(), "first")
+            imap.add_message(make_raw_message("Report", "third"))  # новое письмо — UIDNEXT вырос
+            self.assertEqual(latest_unread(), "third")
+            self.assertEqual(len(self.searches(imap)), 3)
+
+    def test_search_cache_with_pool_and_without_condstore(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("Report", "a"))
+            with make_client(imap=imap, imap_pool_size=1) as client:
+                for _ in range(3):
+                    client.fetch_latest(subject="Report")
+                    client.fetch_latest(subject="Report", unread_only=True)
+                by_subject = [c for c in self.searches(imap) if "HEADER" in c]
+                self.assertEqual(len([c for c in by_subject if "UNSEEN" not in c]), 1)  # сверка папки — SELECT, не поиск
+                # Без CONDSTORE изменение флагов не видно по отпечатку — критерии по флагам не кэшируются
+                self.assertEqual(len([c for c in by_subject if "UNSEEN" in c]), 3)
+
+
+class TestWatch(unittest.TestCase):
+    def deliver_later(self, imap, subjects, delay=0.2):
+        def deliver():
+            for subject in subjects:
+                time.sleep(delay)
+                imap.add_message(make_raw_message(subject))
+        threading.Thread(target=deliver, daemon=True).start()
+
+    def test_idle_delivers_only_new_uids(self):
+        with FakeImapServer() as imap:
+            imap.capabilities.append("IDLE")
+            imap.add_message(make_raw_message("old"))
+            client = make_client(imap=imap)
+            uids = client.watch()
+            self.deliver_later(imap, ["n1", "n2"])
+            started = time.monotonic()
+            self.assertEqual([next(uids), next(uids)], [2, 3])
+            self.assertLess(time.monotonic() - started, 2)   # без ожидания периода опроса
+            uids.close()
+            self.assertTrue(any(c.startswith("IDLE") for c in imap.commands))
+
+    def test_noop_fallback_with_callback(self):
+        with FakeImapServer() as imap:
+            client = make_client(imap=imap)
+            stop = threading.Event()
+            seen = []
+
+            def on_new(uid):
+                seen.append(uid)
+                stop.set()
+
+            self.deliver_later(imap, ["n1"])
+            client.watch(callback=on_new, stop=stop, poll_interval=0.05)
+            self.assertEqual(seen, [1])
+            self.assertFalse(any(c.startswith("IDLE") for c in imap.commands))
+            self.assertTrue(any(c.startswith("NOOP") for c in imap.commands))
+
+
+class TestMessageCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_path = os.path.join(tmp.name, "cache.sqlite")
+
+    def test_sync_downloads_only_new_messages(self):
+        with FakeImapServer() as imap:
+            for i in range(3):
+                imap.add_message(make_raw_message(f"s{i}"))
+            with make_client(imap=imap, cache_path=self.cache_path) as client:
+                self.assertEqual(client.sync(), [1, 2, 3])
+                sent = imap.bytes_sent
+                self.assertEqual(client.sync(), [])
+                self.assertEqual(imap.bytes_sent, sent)        # повторная синхронизация не качает тела
+                imap.add_message(make_raw_message("s3"))
+                self.assertEqual(client.sync(), [4])
+                self.assertFalse(any("RFC822" in c for c in imap.commands))  # BODY.PEEK — без \\Seen
+
+            # Новый клиент с тем же файлом читает письма с диска, не подключаясь к серверу
+            connections = imap.connections
+            with make_client(imap=imap, cache_path=self.cache_path) as client:
+                self.assertEqual(client.fetch_uid(2)["Subject"], "s1")
+            self.assertEqual(imap.connections, connections)
+
+    def test_first_sync_in_batches_resumes_after_interruption(self):
+        with FakeImapServer() as imap:
+            for i in range(5):
+                imap.add_message(make_raw_message(f"s{i}"))
+            with make_client(imap=imap, cache_path=self.cache_path) as client:
+                store = client.cache.store
+                calls = []
+
+                def failing_store(*args):                  # обрыв после второй сохранённой пачки
+                    calls.append(args)
+                    if len(calls) == 3:
+                        raise imaplib.IMAP4.abort("connection lost")
+                    return store(*args)
+
+                with unittest.mock.patch.object(client.cache, "store", failing_store):
+                    with self.assertRaises(imaplib.IMAP4.abort):
+                        client.sync(batch_size=2)
+                fetches = [c for c in imap.commands if c.upper().startswith("UID FETCH")]
+                self.assertEqual(len(fetches), 3)           # по команде FETCH на пачку, а не одна на всю папку
+                self.assertEqual(client.cache.state("INBOX")[1], 4)
+                imap.commands.clear()
+                self.assertEqual(client.sync(batch_size=2), [5])  # продолжение с последней сохранённой пачки
+                self.assertEqual(client.fetch_uid(3)["Subject"], "s2")
+
+    def test_condstore_updates_flags(self):
+        with FakeImapServer() as imap:
+            imap.capabilities.append("CONDSTORE")
+            for i in range(3):
+                imap.add_message(make_raw_message(f"s{i}"))
+            with make_client(imap=imap, imap_pool_size=1, cache_path=self.cache_path) as client:
+                client.sync()
+                imap.set_seen(2)
+                sent = imap.bytes_sent
+                self.assertEqual(client.sync(), [])
+                self.assertEqual(imap.bytes_sent, sent)
+                self.assertIn("CHANGEDSINCE 3", imap.commands[-1])
+                self.assertEqual(client.cache.flags("INBOX", 1, 2), ("\\Seen",))
+                self.assertEqual(client.cache.flags("INBOX", 1, 1), ())
+
+    def test_full_fetch_keeps_cached_flags(self):
+        # fetch_latest скачивает тело без FLAGS — флаги из sync не затираются
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("s0"), seen=True)
+            with make_client(imap=imap, cache_path=self.cache_path) as client:
+                client.sync(bodies=False)
+                self.assertEqual(client.cache.flags("INBOX", 1, 1), ("\\Seen",))
+                self.assertEqual(client.fetch_latest()["Subject"], "s0")
+                self.assertIsNotNone(client.cache.get("INBOX", 1, 1))
+                self.assertEqual(client.cache.flags("INBOX", 1, 1), ("\\Seen",))
+                client.cache.store("INBOX", 1, [{"uid": 9, "body": b"x"}])  # новое письмо без флагов
+                self.assertEqual(client.cache.flags("INBOX", 1, 9), ())
+
+    def test_uidvalidity_change_resets_cache(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("old"))
+            with make_client(imap=imap, cache_path=self.cache_path) as client:
+                client.sync()
+                imap.uidvalidity = 2
+                imap.mailboxes["INBOX"] = []
+                imap.add_message(make_raw_message("new"))
+                self.assertEqual(client.sync(), [1])
+                self.assertEqual(client.fetch_uid(1)["Subject"], "new")
+                self.assertEqual(client.cache.stats["resets"], 1)
+
+    def test_fetch_latest_reuses_cached_body(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("hello"))
+            with make_client(imap=imap, cache_path=self.cache_path) as client:
+                self.assertEqual(client.fetch_latest()["Subject"], "hello")
+                sent = imap.bytes_sent
+                self.assertEqual(client.fetch_latest()["Subject"], "hello")
+                self.assertEqual(imap.bytes_sent, sent)
+
+
+class TestMailIndex(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.index_path = os.path.join(tmp.name, "index.sqlite")
+
+    def test_incremental_update_and_local_search(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("Квартальный отчёт", "Бюджет утверждён", sender="boss@example.com"))
+            msg = EmailMessage()
+            msg["From"] = "ops@example.com"
+            msg["Subject"] = "Logs"
+            msg.set_content("nightly budget logs")
+            msg.add_attachment(b"budget " * 5000, maintype="application", subtype="octet-stream", filename="x.log")
+            imap.add_message(msg.as_bytes())
+            with make_client(imap=imap, index_path=self.index_path) as client:
+                self.assertEqual(client.update_index(), 2)
+                self.assertLess(imap.bytes_sent, 5000)            # вложения в индекс не скачиваются
+                self.assertEqual(client.update_index(), 0)
+                imap.add_message(make_raw_message("Budget draft", "numbers"))
+                self.assertEqual(client.update_index(), 1)
+
+                commands = len(imap.commands)
+                hits = client.index.search("budget", newest_first=True)
+                self.assertEqual([h.uid for h in hits], [3, 2])
+                self.assertEqual(len(imap.commands), commands)    # поиск — без обращения к серверу
+                hit, = client.index.search("subject:отчёт")
+                self.assertEqual((hit.uid, hit.subject, hit.sender), (1, "Квартальный отчёт", "boss@example.com"))
+                self.assertIn("[Бюджет]", client.index.search(client.index.terms("бюджет"))[0].snippet)
+                self.assertEqual(client.index.search("subject:logs"), client.index.search("ops", mailbox="INBOX"))
+
+    def test_uidvalidity_change_and_shared_index(self):
+        with FakeImapServer() as first, FakeImapServer(username="other@example.com") as second:
+            first.add_message(make_raw_message("alpha report"))
+            second.add_message(make_raw_message("beta report"))
+            with make_client(imap=first, index_path=self.index_path) as a, \
+                    make_client(imap=second, index_path=self.index_path) as b:
+                a.update_index()
+                b.update_index()
+                self.assertEqual(len(a.index.search("report")), 2)  # один файл индекса на оба аккаунта
+                hit, = b.index.search("report", account="other@example.com")
+                self.assertEqual(hit.subject, "beta report")
+
+                first.uidvalidity = 2
+                first.mailboxes["INBOX"] = []
+                first.add_message(make_raw_message("gamma"))
+                self.assertEqual(a.update_index(), 1)
+                self.assertEqual(a.index.stats["resets"], 1)
+                self.assertEqual(a.index.count(account="user@example.com"), 1)
+                self.assertEqual([h.subject for h in a.index.search("report")], ["beta report"])
+
+
+class TestPartialFetch(unittest.TestCase):
+    def add_message_with_attachment(self, imap, size=1 << 20):
+        msg = EmailMessage()
+        msg["From"] = "from@example.com"
+        msg["To"] = "user@example.com"
+        msg["Subject"] = "report"
+        msg["Date"] = "Mon, 01 Jan 2024 10:00:00 +0000"
+        msg.set_content("Привет! Отчёт во вложении.")
+        self.attachment = os.urandom(size)
+        msg.add_attachment(self.attachment, maintype="application", subtype="octet-stream", filename="report.bin")
+        imap.add_message(msg.as_bytes())
+
+    def test_text_mode_skips_attachments(self):
+        with FakeImapServer() as imap:
+            self.add_message_with_attachment(imap)
+            with make_client(imap=imap, imap_pool_size=1) as client:
+                msg = client.fetch_latest(mode="text")
+                self.assertEqual(msg.get("Subject"), "report")
+                self.assertEqual(msg["Date"], "Mon, 01 Jan 2024 10:00:00 +0000")
+                self.assertEqual(MailClient.extract_text(msg), "Привет! Отчёт во вложении.")
+                self.assertLess(imap.bytes_sent, 4096)          # вложение на 1 МБ не скачивалось
+
+                [attachment] = msg.attachments
+                self.assertEqual((attachment.filename, attachment.content_type),
+                                 ("report.bin", "application/octet-stream"))
+                self.assertEqual(msg.part_bytes(attachment), self.attachment)  # докачка по требованию
+                self.assertGreater(imap.bytes_sent, 1 << 20)
+
+    def test_headers_mode_loads_rest_lazily(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("plain", body="just text"))
+            with make_client(imap=imap) as client:
+                msg = client.fetch_latest(mode="headers")
+                self.assertEqual(msg["Subject"], "plain")
+                self.assertFalse(any("BODYSTRUCTURE" in c for c in imap.commands))
+                self.assertEqual(msg.text, "just text")         # BODYSTRUCTURE и BODY[1] — при обращении
+                self.assertEqual(msg.message.get_payload().strip(), "just text")
+                self.assertFalse(any("RFC822" in c for c in imap.commands))
+
+    def test_text_mode_single_part_html(self):
+        # Односоставное письмо — текст при любом типе, как у extract_text для полного письма
+        msg = EmailMessage()
+        msg["Subject"] = "html only"
+        msg.set_content("<p>Привет</p>", subtype="html")
+        with FakeImapServer() as imap:
+            imap.add_message(msg.as_bytes())
+            with make_client(imap=imap) as client:
+                expected = MailClient.extract_text(client.fetch_latest())
+                self.assertEqual(expected, "<p>Привет</p>")
+                lazy = client.fetch_latest(mode="text")
+                self.assertEqual(lazy.text, expected)
+                self.assertEqual(MailClient.extract_text(lazy), expected)
+                self.assertEqual(client.fetch_latest(mode="headers").text, expected)
+                self.assertEqual([m.text for m in client.fetch_many(mode="text")], [expected])
+
+    def test_parse_nested_bodystructure(self):
+        # Пример из RFC 3501 (7.4.2) с добавленным вложением
+        data = [b'1 (UID 7 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "US-ASCII") NIL NIL "7BIT" 1152 23)'
+                b'(("TEXT" "HTML" NIL NIL NIL "QUOTED-PRINTABLE" 400 10)("IMAGE" "PNG" ("NAME" "a.png") '
+                b'NIL NIL "BASE64" 4554 NIL ("INLINE" NIL) NIL) "RELATED")("APPLICATION" "PDF" NIL NIL NIL '
+                b'"BASE64" 100 NIL ("ATTACHMENT" ("FILENAME" "=?utf-8?b?0L7RgtGH0ZHRgi5wZGY=?=")) NIL) "MIXED"))']
+        [message] = mail_client_ref._parse_fetch(data)
+        parts = mail_client_ref._body_parts(message["items"]["BODYSTRUCTURE"])
+        self.assertEqual([(p.section, p.content_type) for p in parts], [
+            ("1", "text/plain"), ("2.1", "text/html"), ("2.2", "image/png"), ("3", "application/pdf"),
+        ])
+        self.assertEqual(parts[0].params["charset"], "US-ASCII")
+        self.assertEqual([p.filename for p in parts if p.is_attachment], ["отчёт.pdf"])
+
+
+class TestFetchMany(unittest.TestCase):
+    def fetch_commands(self, imap):
+        return [c for c in imap.commands if c.upper().startswith("UID FETCH")]
+
+    def test_batches_and_limit(self):
+        with FakeImapServer() as imap:
+            for i in range(50):
+                imap.add_message(make_raw_message(f"s{i}"))
+            client = make_client(imap=imap)
+            subjects = [m["Subject"] for m in client.fetch_many(batch_size=20)]
+            self.assertEqual(subjects, [f"s{i}" for i in range(50)])
+            self.assertEqual(len(self.fetch_commands(imap)), 3)  # 50 писем — три запроса, а не 50
+            self.assertEqual([m["Subject"] for m in client.fetch_many(limit=3)], ["s47", "s48", "s49"])
+            self.assertEqual([m["Subject"] for m in client.fetch_many('HEADER Subject "s4"')],
+                             ["s4"] + [f"s{i}" for i in range(40, 50)])
+
+    def test_fetch_range(self):
+        with FakeImapServer() as imap:
+            for i in range(5):
+                imap.add_message(make_raw_message(f"s{i}"))
+            client = make_client(imap=imap)
+            self.assertEqual([m["Subject"] for m in client.fetch_range(2, 4)], ["s1", "s2", "s3"])
+            self.assertEqual([m["Subject"] for m in client.fetch_range(4)], ["s3", "s4"])
+            self.assertEqual(list(client.fetch_range(6)), [])
+
+    def test_text_mode_groups_sections(self):
+        with FakeImapServer() as imap:
+            for i in range(4):
+                imap.add_message(make_raw_message(f"plain{i}", body=f"body{i}"))
+            msg = EmailMessage()
+            msg["Subject"] = "multi"
+            msg.set_content("multipart body")
+            msg.add_alternative("<p>multipart body</p>", subtype="html")  # текст окажется в части 1.1
+            msg.add_attachment(b"x" * 10000, maintype="application", subtype="octet-stream", filename="x.bin")
+            imap.add_message(msg.as_bytes())
+            client = make_client(imap=imap)
+            texts = [(m["Subject"], m.text) for m in client.fetch_many(mode="text")]
+            self.assertEqual(texts, [(f"plain{i}", f"body{i}") for i in range(4)] + [("multi", "multipart body")])
+            self.assertEqual(len(self.fetch_commands(imap)), 3)  # заголовки+структура, BODY[1] и BODY[1.1]
+            self.assertLess(imap.bytes_sent, 10000)
+
+    def test_abandoned_iteration_discards_session(self):
+        with FakeImapServer() as imap:
+            for i in range(10):
+                imap.add_message(make_raw_message(f"s{i}"))
+            with make_client(imap=imap, imap_pool_size=1) as client:
+                messages = client.fetch_many()
+                next(messages)
+                messages.close()                                # в сокете остался недочитанный ответ
+                self.assertEqual(client.imap_pool.stats["discarded"], 1)
+                self.assertEqual(client.fetch_latest()["Subject"], "s9")
+
+    def test_uid_set(self):
+        self.assertEqual(mail_client_ref._uid_set([9, 1, 2, 3, 7, 10]), "1:3,7,9:10")
+
+
+class TestMimeStream(unittest.TestCase):
+    def make_message(self, attachment_size=100_000):
+        msg = EmailMessage()
+        msg["Subject"] = "stream"
+        msg.set_content("Привет!\n" + "строка со знаком = и длинным хвостом\n" * 50, cte="quoted-printable")
+        msg.add_alternative("<p>Привет!</p>", subtype="html")
+        msg.add_attachment(os.urandom(attachment_size), maintype="application", subtype="octet-stream",
+                           filename="data.bin")
+        msg.add_attachment("вложенный текст\n", filename="note.txt")
+        return msg.as_bytes()
+
+    def test_matches_email_parser_for_any_chunking(self):
+        for raw in (self.make_message(), self.make_message().replace(b"\n", b"\r\n")):
+            expected = email.message_from_bytes(raw)
+            leaves = [p for p in expected.walk() if not p.is_multipart()]
+            for size in (1, 13, 4096, len(raw)):
+                with self.subTest(size=size, crlf=b"\r\n" in raw):
+                    received = {}
+                    parser = MimeStreamParser(
+                        on_attachment=lambda a, chunk: received.setdefault(a.filename, bytearray()).extend(chunk))
+                    text = "".join(parser.parse(raw[i:i + size] for i in range(0, len(raw), size)))
+                    self.assertEqual(text.strip(), MailClient.extract_text(expected).replace("\r\n", "\n"))
+                    self.assertEqual(parser.headers["Subject"], "stream")
+                    self.assertEqual([a.filename for a in parser.attachments], [None, "data.bin", "note.txt"])
+                    self.assertEqual(bytes(received["data.bin"]), leaves[2].get_payload(decode=True))
+                    self.assertEqual(bytes(received["note.txt"]), leaves[3].get_payload(decode=True))
+
+    def test_memory_does_not_grow_with_message(self):
+        raw = self.make_message(attachment_size=4_000_000)
+        with tempfile.TemporaryDirectory() as tmp:
+            parser = MimeStreamParser(attachment_dir=tmp)
+            tracemalloc.start()
+            try:
+                for _ in parser.parse(io.BytesIO(raw)):
+                    pass
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertLess(peak, 1_000_000)                   # письмо ~5.5 МБ, в памяти — только текущий кусок
+            data = parser.attachments[1]
+            self.assertEqual((data.size, os.path.getsize(data.path)), (4_000_000, 4_000_000))
+            parser.cleanup()
+            self.assertFalse(os.path.exists(data.path))
+
+    def test_stream_message_from_imap(self):
+        raw = self.make_message()
+        with FakeImapServer() as imap, tempfile.TemporaryDirectory() as tmp:
+            uid = imap.add_message(raw)
+            client = make_client(imap=imap)
+            parser = MimeStreamParser(attachment_dir=tmp)
+            text = "".join(client.stream_message(uid, parser, chunk_size=1000))
+            self.assertTrue(text.startswith("Привет!\n"))
+            with open(parser.attachments[1].path, "rb") as f:
+                self.assertEqual(f.read(), email.message_from_bytes(raw).get_payload()[1].get_payload(decode=True))
+            self.assertFalse(any("RFC822" in c for c in imap.commands))
+
+
+class TestExtractText(unittest.TestCase):
+    def make_message(self):
+        msg = EmailMessage()
+        msg["Subject"] = "parts"
+        msg.set_content("\n\n   " + "Строка отчёта номер 1. " * 400, charset="cp1251", cte="base64")
+        msg.add_alternative("<p>html</p>", subtype="html")
+        msg.add_attachment("не текст письма", filename="notes.txt")
+        second = EmailMessage()
+        second.set_content("Вторая часть — café " * 300, cte="quoted-printable")
+        msg.attach(second)
+        msg.attach(EmailMessage())
+        msg.get_payload()[-1].set_content("третья\n", cte="8bit")
+        return email.message_from_bytes(msg.as_bytes())
+
+    def test_options_match_full_extraction(self):
+        msg = self.make_message()
+        full = MailClient.extract_text(msg)
+        self.assertTrue(full.startswith("Строка отчёта"))
+        self.assertNotIn("не текст письма", full)
+        self.assertIn("Вторая часть — café", full)
+        self.assertTrue(full.endswith("\nтретья"))
+        self.assertEqual(MailClient.extract_text(msg, first_only=True), full[:full.index("\nВторая")].strip())
+        first_len = len(MailClient.extract_text(msg, first_only=True))
+        for n in (0, 1, 100, first_len - 1, first_len + 5, len(full) - 3, len(full) + 10):
+            with self.subTest(max_length=n):
+                self.assertEqual(MailClient.extract_text(msg, max_length=n), full[:n])
+
+    def test_unknown_charset_and_whitespace_prefix(self):
+        msg = email.message_from_bytes(
+            b"Content-Type: text/plain; charset=x-unknown\r\nContent-Transfer-Encoding: 8bit\r\n\r\n"
+            + b" " * 5000 + b"text\r\n"
+        )
+        self.assertEqual(MailClient.extract_text(msg), "text")  # неизвестная кодировка — как utf-8
+        self.assertEqual(MailClient.extract_text(msg, max_length=2), "te")  # начало части — одни пробелы
+
+
+# === ТЕСТЫ ПАРАЛЛЕЛЬНОГО ПОЛУЧЕНИЯ ===
+class TestMailboxFleet(unittest.TestCase):
+    def test_concurrent_fetch_with_server_limit(self):
+        with FakeImapServer() as first, FakeImapServer() as second:
+            for imap in (first, second):
+                imap.delay = 0.05
+                for box in ("INBOX", "Work", "Spam"):
+                    imap.add_message(make_raw_message(f"{imap.port}-{box}"), mailbox=box)
+            targets = [FetchTarget(make_client(imap=imap), box, key=(imap.port, box))
+                       for imap in (first, second) for box in ("INBOX", "Work", "Spam")]
+            start = time.monotonic()
+            with MailboxFleet(max_workers=8, per_server=2) as fleet:
+                results = fleet.fetch_all(targets)
+            elapsed = time.monotonic() - start
+
+            self.assertTrue(all(r.ok for r in results))
+            self.assertEqual([r.message["Subject"] for r in results], [f"{port}-{box}" for port, box in
+                                                                        (t.key for t in targets)])
+            self.assertLessEqual(first.max_active, 2)    # не больше per_server соединений на сервер
+            self.assertLessEqual(second.max_active, 2)
+            # Последовательно: 6 целей × 4 команды × 0.05 с ≈ 1.2 с; параллельно — по 2 на сервер
+            self.assertLess(elapsed, 0.9)
+
+    def test_repeated_target_keeps_order(self):
+        with FakeImapServer() as imap:
+            imap.add_message(make_raw_message("inbox"))
+            imap.add_message(make_raw_message("work"), mailbox="Work")
+            client = make_client(imap=imap)
+            inbox, work = FetchTarget(client), FetchTarget(client, "Work")
+            with MailboxFleet(max_workers=1) as fleet:
+                results = fleet.fetch_all([inbox, work, inbox])
+            self.assertEqual([r.message["Subject"] for r in results], ["inbox", "work", "inbox"])
+
+    def test_errors_and_timeouts_are_results(self):
+        with FakeImapServer() as fast, FakeImapServer() as slow, FakeImapServer() as locked:
+            fast.add_message(make_raw_message("fast"))
+            slow.add_message(make_raw_message("slow"))
+            slow.delay = 0.5
+            bad = make_client(imap=locked)
+            bad.password = "wrong"
+            targets = [
+                FetchTarget(make_client(imap=slow), key="slow"),
+                FetchTarget(bad, key="bad"),
+                FetchTarget(make_client(imap=fast), criteria='HEADER Subject "fast"', limit=5, key="fast"),
+            ]
+            start = time.monotonic()
+            with MailboxFleet(timeout=0.3) as fleet:
+                results = list(fleet.fetch(targets))
+            self.assertLess(time.monotonic() - start, 0.6)  # медленный ящик не задерживает остальные
+
+            by_key = {r.target.key: r for r in results}
+            self.assertEqual(results[-1].target.key, "slow")  # результаты — в порядке готовности
+            self.assertIsInstance(by_key["slow"].error, TimeoutError)
+            self.assertIsNotNone(by_key["bad"].error)
+            self.assertEqual([m["Subject"] for m in by_key["fast"].messages], ["fast"])
+
+
+# === ТЕСТЫ АСИНХРОННОГО КЛИЕНТА ===
+class TestAsyncMailClient(unittest.TestCase):
+    def test_send_and_fetch_concurrently(self):
+        with FakeSmtpServer() as smtp, FakeImapServer() as imap:
+            for i in range(5):
+                imap.add_message(make_raw_message(f"subject {i}", f"body {i}"))
+            client = AsyncMailClient.from_client(make_client(smtp, imap), max_connections=10)
+
+            async def scenario():
+                sends = [client.send_email([f"u{i}@example.com"], f"s{i}", "b") for i in range(20)]
+                fetches = [client.fetch_latest(subject=f"subject {i}") for i in range(5)]
+                return await asyncio.gather(*sends, *fetches)
+
+            results = asyncio.run(scenario())
+            self.assertEqual(len(smtp.messages), 20)
+            texts = [AsyncMailClient.extract_text(m) for m in results[20:]]
+            self.assertEqual(texts, [f"body {i}" for i in range(5)])
+
+    def test_errors_are_reported(self):
+        with FakeSmtpServer() as smtp, FakeImapServer() as imap:
+            client = AsyncMailClient.from_client(make_client(smtp, imap))
+            with self.assertRaises(AsyncSmtpError):
+                asyncio.run(client.send_email(["reject@example.com"], "s", "b"))
+            self.assertIsNone(asyncio.run(client.fetch_latest()))
+
+    def test_stalled_server_does_not_outlive_timeout(self):
+        # Сервер замолкает посреди операции или на QUIT/LOGOUT: вызов укладывается примерно в timeout
+        for stall in ("MAIL", "QUIT", "SELECT", "LOGOUT"):
+            with self.subTest(stall=stall), FakeSmtpServer() as smtp, FakeImapServer() as imap:
+                smtp.stall = imap.stall = stall
+                client = AsyncMailClient.from_client(make_client(smtp, imap), timeout=0.5)
+                if stall in ("SELECT", "LOGOUT"):
+                    call = client.fetch_latest()
+                else:
+                    call = client.send_email(["a@example.com"], "s", "b")
+
+                async def scenario():
+                    return await asyncio.wait_for(call, 5)     # внешний предел — только страховка теста
+
+                start = time.monotonic()
+                if stall in ("MAIL", "SELECT"):
+                    with self.assertRaises(asyncio.TimeoutError):
+                        asyncio.run(scenario())
+                else:
+                    asyncio.run(scenario())                    # операция прошла, зависло только прощание
+                self.assertLess(time.monotonic() - start, 1.5)
+
+
+# Запуск тестов при прямом вызове файла
+if __name__ == "__main__":
+    unittest.main(verbosity=2)